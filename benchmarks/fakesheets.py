@@ -0,0 +1,460 @@
+# ---------------------------------------------------
+# fakesheets.py - FakeSheetsServer Class
+# ---------------------------------------------------
+# A local stand-in of the Sheets and Drive REST APIs
+# that serves synthetic workbooks shaped like the
+# department timesheets. Each workbook has the
+# Instructions tab with the department name on H2 and
+# the *- prefixed tabs with the ownership on F1:F2
+# and the data rows starting on row 6.
+# The server can emulate a per-minute read quota that
+# answers 429 errors and a latency per request, so the
+# Reader can be measured without network access.
+# Like the Google APIs, the fields parameter selects
+# the fields of a response and the responses are gzip
+# compressed for clients with gzip on its user agent.
+# Run it from the project folder with:
+#   python -m benchmarks.fakesheets [sheets] [rows] [port]
+# ---------------------------------------------------
+
+import gzip
+import json
+import random
+import re
+import sys
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+import gspread
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class FakeSheetsServer:
+
+    # Hosts of the Google APIs that are redirected to this server
+    API_HOSTS = ("https://sheets.googleapis.com", "https://www.googleapis.com")
+    SHEET_URL = "https://docs.google.com/spreadsheets/d/%s/"
+    # Base date of the spreadsheet serial date numbers
+    SERIAL_BASE = datetime(1899, 12, 30)
+
+    def __init__(self, *, workbooks=None, latency=0, quota=None, period=60,
+                 retry_after=None, port=0):
+        """
+        FakeSheetsServer serves the workbooks dictionary of spreadsheet
+        id to workbook made by make_workbook. Every request waits for
+        latency seconds. If quota is given, only quota requests are
+        answered per period of seconds and the rest get a 429 error
+        with the optional Retry-After header value.
+        """
+        self.workbooks = dict(workbooks or {})
+        self.latency = latency
+        self.quota = quota
+        self.period = period
+        self.retry_after = retry_after
+        self._lock = threading.Lock()
+        self._window = (0.0, 0)
+
+        # Counters that can be checked using the stats method
+        self.requests = 0
+        self.throttled = 0
+        self.bytes_sent = 0
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", port),
+                                           self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    @property
+    def base_url(self):
+        """ Returns the http url of the running server. """
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def sheets_url(self):
+        """ Returns the spreadsheets endpoint to pass to AsyncReader. """
+        return f"{self.base_url}/v4/spreadsheets"
+
+    @property
+    def drive_url(self):
+        """ Returns the drive files endpoint to pass to AsyncReader. """
+        return f"{self.base_url}/drive/v3/files"
+
+    def start(self):
+        """ Serves the requests on a background thread. """
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """ Stops the server and closes its socket. """
+        self._server.shutdown()
+        self._server.server_close()
+
+    def url(self, spreadsheet_id):
+        """ Returns the GSheet URL of a served spreadsheet id. """
+        return self.SHEET_URL % spreadsheet_id
+
+    def client(self):
+        """
+        Returns a gspread client that sends its requests to this server.
+        Assign it to the client of a Reader to fetch the fake workbooks.
+        """
+        session = requests.Session()
+        adapter = _RedirectAdapter(self.base_url, self.API_HOSTS)
+        for host in self.API_HOSTS:
+            session.mount(host, adapter)
+        return gspread.Client(None, session=session)
+
+    def touch(self, spreadsheet_id, rows=0):
+        """
+        Marks a workbook as modified now and appends rows more data rows
+        to each of its *- tabs like an employee filling the timesheet.
+        """
+        workbook = self.workbooks[spreadsheet_id]
+        with self._lock:
+            for title, grid in workbook["sheets"].items():
+                if title.startswith("*-"):
+                    first = len(grid)
+                    grid.extend(_data_row(workbook["rand"], index,
+                                          workbook["month"])
+                                for index in range(first, first + rows))
+            workbook["modified"] = _now()
+
+    def stats(self):
+        """ Returns a dictionary of the counters of this server. """
+        with self._lock:
+            return {"requests": self.requests, "throttled": self.throttled,
+                    "bytes_sent": self.bytes_sent}
+
+    @staticmethod
+    def make_workbook(*, sheets=5, rows=1000, department="Department",
+                      month=(2024, 1), seed=0):
+        """
+        Makes a synthetic workbook of the given number of *- tabs with
+        rows data rows each. The same seed always makes the same values.
+        Dates and times are kept as serial numbers and about a third of
+        the rows have an empty processed column like unfinished tasks.
+        """
+        rand = random.Random(seed)
+        instructions = [[""] * 8 for _ in range(2)]
+        instructions[1][7] = department
+        workbook = {"sheets": {"Instructions": instructions},
+                    "title": f"{department} Timesheet", "month": month,
+                    "modified": _now(), "rand": rand}
+        for sheet in range(sheets):
+            grid = [[""] * 10 for _ in range(5)]
+            grid[0][5] = f"Employee {seed}-{sheet}"
+            grid[1][5] = f"Account {sheet % 8}"
+            grid.extend(_data_row(rand, index, month)
+                        for index in range(rows))
+            workbook["sheets"][f"*-{sheet + 1:03d}"] = grid
+        return workbook
+
+    def _handler(self):
+        """ Helper method to create the request handler of the server. """
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                status, body, headers = server._respond(self.path)
+                data = json.dumps(body).encode()
+                if "gzip" in self.headers.get("Accept-Encoding", "") and \
+                        "gzip" in self.headers.get("User-Agent", ""):
+                    data = gzip.compress(data)
+                    headers["Content-Encoding"] = "gzip"
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(data)
+                with server._lock:
+                    server.bytes_sent += len(data)
+
+        return Handler
+
+    def _respond(self, path):
+        """
+        Helper method to answer a GET request path. Returns the status
+        code, the JSON body and the extra headers of the response.
+        """
+        if self.latency:
+            time.sleep(self.latency)
+        if not self._take_quota():
+            headers = {}
+            if self.retry_after is not None:
+                headers["Retry-After"] = str(self.retry_after)
+            return 429, _error(429, "Quota exceeded for quota metric "
+                                    "'Read requests' per minute.",
+                               "RESOURCE_EXHAUSTED"), headers
+
+        url = urlparse(path)
+        query = parse_qs(url.query)
+        match = re.match(r"/(?:v4/spreadsheets|drive/v3/files)/([^/:]+)"
+                         r"(/values:batchGet|/values/.+)?$", url.path)
+        workbook = self.workbooks.get(match.group(1)) if match else None
+        if not workbook:
+            return 404, _error(404, "Requested entity was not found.",
+                               "NOT_FOUND"), {}
+
+        spreadsheet_id, values_path = match.groups()
+        with self._lock:
+            if url.path.startswith("/drive/"):
+                body = {"id": spreadsheet_id, "name": workbook["title"],
+                        "createdTime": workbook["modified"],
+                        "modifiedTime": workbook["modified"]}
+            elif not values_path:
+                body = self._metadata(spreadsheet_id, workbook)
+            else:
+                if values_path == "/values:batchGet":
+                    ranges = query.get("ranges", [])
+                else:
+                    ranges = [unquote(values_path[len("/values/"):])]
+                try:
+                    value_ranges = [self._values(workbook, a1_range, query)
+                                    for a1_range in ranges]
+                except (KeyError, ValueError) as e:
+                    return 400, _error(400, f"Unable to parse range: {e}",
+                                       "INVALID_ARGUMENT"), {}
+                body = value_ranges[0]
+                if values_path == "/values:batchGet":
+                    body = {"spreadsheetId": spreadsheet_id,
+                            "valueRanges": value_ranges}
+        if "fields" in query:
+            body = _select(body, _parse_fields(query["fields"][0]))
+        return 200, body, {}
+
+    def _take_quota(self):
+        """
+        Helper method to count a request on the current quota window.
+        Returns False if the request should be throttled.
+        """
+        with self._lock:
+            self.requests += 1
+            if not self.quota:
+                return True
+            start, count = self._window
+            now = time.monotonic()
+            if now - start >= self.period:
+                start, count = now, 0
+            if count >= self.quota:
+                self.throttled += 1
+                return False
+            self._window = (start, count + 1)
+            return True
+
+    @staticmethod
+    def _metadata(spreadsheet_id, workbook):
+        """ Helper method to build the spreadsheet metadata response. """
+        sheets = []
+        for index, (title, grid) in enumerate(workbook["sheets"].items()):
+            sheets.append({"properties": {
+                "sheetId": index, "title": title, "index": index,
+                "sheetType": "GRID",
+                "gridProperties": {"rowCount": len(grid),
+                                   "columnCount": len(grid[0])}}})
+        return {"spreadsheetId": spreadsheet_id,
+                "properties": {"title": workbook["title"],
+                               "locale": "en_US", "timeZone": "Etc/GMT"},
+                "sheets": sheets,
+                "spreadsheetUrl": FakeSheetsServer.SHEET_URL % spreadsheet_id}
+
+    def _values(self, workbook, a1_range, query):
+        """
+        Helper method to build the value range of an A1 range using the
+        majorDimension and valueRenderOption query parameters.
+        """
+        title, _, cells = a1_range.rpartition("!")
+        if title:
+            title = title[1:-1].replace("''", "'") \
+                if title.startswith("'") else title
+        else:
+            title = next(iter(workbook["sheets"]))
+        grid = workbook["sheets"][title]
+
+        # Parse the columns and the optional rows of the range
+        match = re.match(r"([A-Z]+)(\d*)(?::([A-Z]+)(\d*))?$", cells)
+        if not match:
+            raise ValueError(a1_range)
+        first_col, first_row, last_col, last_row = match.groups()
+        first_row = int(first_row) if first_row else 1
+        if last_col is None:
+            last_col, last_row = first_col, last_row or first_row
+        last_row = min(int(last_row) if last_row else len(grid), len(grid))
+
+        formatted = query.get("valueRenderOption",
+                              ["FORMATTED_VALUE"])[0] == "FORMATTED_VALUE"
+        columns = range(_column_index(first_col), _column_index(last_col) + 1)
+        values = []
+        for row in grid[first_row - 1:last_row]:
+            values.append([self._render(row[col] if col < len(row) else "",
+                                        formatted) for col in columns])
+        if query.get("majorDimension", ["ROWS"])[0] == "COLUMNS":
+            values = [list(column) for column in zip(*values)]
+
+        # Trailing empty cells and empty rows are not returned by the API
+        for line in values:
+            while line and line[-1] == "":
+                line.pop()
+        while values and not values[-1]:
+            values.pop()
+        value_range = {"range": f"'{title}'!{cells}",
+                       "majorDimension": query.get("majorDimension",
+                                                   ["ROWS"])[0]}
+        if values:
+            value_range["values"] = values
+        return value_range
+
+    @staticmethod
+    def _render(value, formatted):
+        """
+        Helper method to render a cell value. Serial dates are shown as
+        M/D/YYYY, serial times as H:MM:SS AM and numbers as strings on
+        formatted values.
+        """
+        if isinstance(value, tuple):
+            serial, kind = value
+            if not formatted:
+                return serial
+            if kind == "time":
+                return _format_time(round(serial * 96))
+            date = FakeSheetsServer.SERIAL_BASE + timedelta(days=serial)
+            return f"{date.month}/{date.day}/{date.year}"
+        return str(value) if formatted else value
+
+
+class _RedirectAdapter(HTTPAdapter):
+
+    def __init__(self, base_url, hosts):
+        """ HTTPAdapter that sends the requests of the hosts to base_url. """
+        super().__init__()
+        self.base_url = base_url
+        self.hosts = hosts
+
+    def send(self, request, **kwargs):
+        for host in self.hosts:
+            if request.url.startswith(host):
+                request.url = self.base_url + request.url[len(host):]
+                break
+        return super().send(request, **kwargs)
+
+
+def _data_row(rand, index, month):
+    """
+    Helper function to make a data row of a *- tab. The date and time
+    columns have (serial, kind) tuples so they are rendered as a date or
+    a time on formatted values.
+    """
+    year, month_num = month
+    serial = (datetime(year, month_num, 1) - FakeSheetsServer.SERIAL_BASE).days
+    start, length = rand.randrange(32, 72), rand.randrange(1, 16)
+    row = [""] * 10
+    row[4] = (serial + index // 40 % 28, "date")
+    row[5] = f"Task {index}"
+    row[7] = rand.randrange(1, 50) if rand.randrange(3) else ""
+    row[8] = (start / 96, "time")
+    row[9] = ((start + length) / 96, "time")
+    return row
+
+
+def _format_time(quarter):
+    """ Helper function to format a quarter of the day as H:MM:SS AM. """
+    hour, minute = divmod(quarter * 15, 60)
+    return f"{hour % 12 or 12}:{minute:02d}:00 {'AM' if hour < 12 else 'PM'}"
+
+
+def _parse_fields(fields):
+    """
+    Helper function to parse a field mask like a,b.c,d(e,f) into a tree
+    of field name to its selected sub fields or None for all of them.
+    """
+    tree, position = _parse_field_list(fields, 0)
+    return tree
+
+
+def _parse_field_list(fields, position):
+    """ Helper function to parse the fields until a closing bracket. """
+    tree = {}
+    while position < len(fields) and fields[position] != ")":
+        match = re.match(r"[\w.]+", fields[position:])
+        path = match.group().split(".")
+        position = position + match.end()
+        subtree = None
+        if position < len(fields) and fields[position] == "(":
+            subtree, position = _parse_field_list(fields, position + 1)
+            position = position + 1
+        # A dotted path is the same as nested brackets
+        for name in reversed(path[1:]):
+            subtree = {name: subtree}
+        node = tree.setdefault(path[0], {})
+        if subtree is None or node is None:
+            tree[path[0]] = None
+        else:
+            node.update(subtree)
+        if position < len(fields) and fields[position] == ",":
+            position = position + 1
+    return tree, position
+
+
+def _select(body, tree):
+    """ Helper function to keep only the fields of the tree on a body. """
+    if tree is None:
+        return body
+    if isinstance(body, list):
+        return [_select(item, tree) for item in body]
+    if not isinstance(body, dict):
+        return body
+    return {key: _select(value, tree[key])
+            for key, value in body.items() if key in tree}
+
+
+def _column_index(letter):
+    """ Helper function to convert a column letter to its 0-based index. """
+    index = 0
+    for char in letter:
+        index = index * 26 + ord(char) - ord("A") + 1
+    return index - 1
+
+
+def _error(code, message, status):
+    """ Helper function to build the JSON body of an API error. """
+    return {"error": {"code": code, "message": message, "status": status}}
+
+
+def _now():
+    """ Helper function to get the current time as an RFC 3339 string. """
+    return datetime.now(timezone.utc).isoformat(timespec="milliseconds") \
+        .replace("+00:00", "Z")
+
+
+if __name__ == "__main__":
+    sheets = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    rows = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    port = int(sys.argv[3]) if len(sys.argv) > 3 else 8085
+    server = FakeSheetsServer(
+        workbooks={"fake": FakeSheetsServer.make_workbook(sheets=sheets,
+                                                          rows=rows)},
+        port=port)
+    print(f"Serving {server.url('fake')} on {server.base_url}")
+    server.start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.stop()
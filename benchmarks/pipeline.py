@@ -0,0 +1,429 @@
+# ---------------------------------------------------
+# pipeline.py - Pipeline Benchmark
+# ---------------------------------------------------
+# A benchmark script that times each stage of the
+# fetch pipeline on synthetic spreadsheets served by
+# the local FakeSheetsServer. The stages are the
+# batched and async fetch, the batched fetch with
+# the cached metadata, the row parsing of the
+# worksheets in this process and on the parse pool
+# processes, the save of the rows on the data store,
+# the load of the saved rows and of a single column
+# next to the load of the same rows from a JSON data
+# file, the refresh of the saved rows after a few
+# rows were added to each worksheet, the startup load
+# of the GSheetLister and the CSV report. The load
+# stages also have the bytes of the saved rows.
+# The results are written into a JSON file with the
+# commit hash so runs of two commits can be compared.
+# Run it from the project folder with:
+#   python -m benchmarks.pipeline [--rows 1000,10000]
+#       [--sheets 5,50] [--repeat 3] [--output file]
+#   python -m benchmarks.pipeline --compare old new
+# ---------------------------------------------------
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from types import SimpleNamespace
+from unittest.mock import patch
+from benchmarks.fakesheets import FakeSheetsServer
+from controls.gsheetlister import GSheetLister
+from controls.settingsmanager import SettingsManager
+from modules.asyncreader import AsyncReader
+from modules.clientpool import ClientPool
+from modules.metacache import MetadataCache
+from modules.parsepool import ParsePool
+from modules.reader import Reader
+from modules.rowsink import StoreRowSink
+
+# Total rows and number of worksheets of the synthetic spreadsheets
+ROWS = (1000, 10000, 100000)
+SHEETS = (5, 50, 200)
+# Slowdown ratio reported as a regression by compare
+THRESHOLD = 1.1
+RESULTS_PATH = Path(__file__).resolve().parent / "results"
+SPREADSHEET_ID = "benchmark"
+
+
+class _NullProgress:
+    """ Progress bar stand-in that ignores every update. """
+
+    def reset(self):
+        pass
+
+    def update_progress(self, **kwargs):
+        pass
+
+
+def run(*, rows=ROWS, sheets=SHEETS, repeat=3):
+    """
+    Runs every stage on each combination of total rows and worksheets.
+    Each stage is run repeat times and its fastest time is kept.
+    Returns the results with the details of the environment.
+    """
+    results = []
+    with _offline() as data_dir:
+        for total_rows in rows:
+            for sheet_count in sheets:
+                results.extend(_run_case(total_rows, sheet_count, repeat,
+                                         data_dir))
+    return {"commit": _commit(), "created": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(), "repeat": repeat,
+            "results": results}
+
+
+def compare(old, new):
+    """
+    Compares two results of run and returns a list of each stage and
+    case with its old and new seconds and the ratio of new to old.
+    """
+    old_times = {_case_key(result): result["seconds"]
+                 for result in old["results"]}
+    changes = []
+    for result in new["results"]:
+        key = _case_key(result)
+        if key in old_times:
+            ratio = result["seconds"] / old_times[key] \
+                if old_times[key] else float("inf")
+            changes.append({"stage": result["stage"], "rows": result["rows"],
+                            "sheets": result["sheets"],
+                            "old": old_times[key],
+                            "new": result["seconds"], "ratio": ratio})
+    return changes
+
+
+def _run_case(total_rows, sheet_count, repeat, data_dir):
+    """
+    Helper function to time the stages of a single spreadsheet size.
+    The data store only has the saved source of this case and the
+    metadata cache of the previous case is cleared.
+    """
+    store = Reader.data_store()
+    for source in store.sources():
+        store.delete(source["name"])
+    (data_dir / "recents.json").write_text("[]")
+    Reader.metadata_cache().invalidate()
+
+    per_sheet = max(1, total_rows // sheet_count)
+    workbook = FakeSheetsServer.make_workbook(
+        sheets=sheet_count, rows=per_sheet,
+        department=f"Bench {total_rows} {sheet_count}")
+    case = {"rows": per_sheet * sheet_count, "sheets": sheet_count}
+    results = []
+
+    with FakeSheetsServer(workbooks={SPREADSHEET_ID: workbook}) as server:
+        # Fetch stages against the local server
+        fetched = {}
+
+        def fetch():
+            reader = Reader(url=server.url(SPREADSHEET_ID))
+            reader.client = _client(server)
+            _check(reader.fetch_data(
+                sheet_identifier="*-", progress=_ignore, batched=True,
+                completed=lambda **kwargs: fetched.update(kwargs)))
+
+        def fetch_async():
+            reader = AsyncReader(url=server.url(SPREADSHEET_ID),
+                                 sheets_url=server.sheets_url,
+                                 drive_url=server.drive_url)
+            reader.client = _client(server)
+            _check(asyncio.run(reader.fetch_data(
+                sheet_identifier="*-", progress=_ignore,
+                completed=lambda **kwargs: None)))
+
+        # The metadata cache is only enabled on the fetch_cached stage
+        # after a first fetch has saved the metadata
+        for stage, func, ttl in (("fetch", fetch, 0),
+                                 ("fetch_async", fetch_async, 0),
+                                 ("fetch_cached", fetch,
+                                  MetadataCache.DEFAULT_TTL)):
+            _update_settings(metadata_ttl=ttl)
+            if ttl:
+                func()
+            before = server.stats()
+            seconds = _measure(func, repeat)
+            after = server.stats()
+            results.append({"stage": stage, **case, "seconds": seconds,
+                            "requests": (after["requests"] -
+                                         before["requests"]) // repeat,
+                            "bytes": (after["bytes_sent"] -
+                                      before["bytes_sent"]) // repeat})
+        _update_settings(metadata_ttl=0)
+
+    # Parse stage of the worksheet columns without any request
+    columns = [_sheet_columns(grid) for title, grid
+               in workbook["sheets"].items() if title.startswith("*-")]
+
+    def parse():
+        for datedata, data in columns:
+            Reader._process_worksheet(
+                datedata, data, ownership=["Bench", "Account", "Owner"],
+                first_index=0, task_col="F", proccessed_col="H",
+                start_col="I", end_col="J")
+
+    results.append({"stage": "parse", **case,
+                    "seconds": _measure(parse, repeat)})
+
+    # Parse stage on a process per core with the rows merged in order
+    pool = ParsePool(workers=os.cpu_count() or 1, min_rows=0)
+
+    def parse_pool():
+        parsing = [pool.submit(
+            Reader._process_worksheet, datedata, data, rows=len(datedata[0]),
+            ownership=["Bench", "Account", "Owner"], first_index=0,
+            task_col="F", proccessed_col="H", start_col="I", end_col="J")
+            for datedata, data in columns]
+        for future in parsing:
+            future.result()
+
+    parse_pool()
+    results.append({"stage": "parse_pool", **case,
+                    "seconds": _measure(parse_pool, repeat)})
+    pool.shutdown()
+
+    # Save stage of the rows into the data store
+    rows = fetched["final_data"].to_list()
+    fields = {key: value for key, value in fetched.items()
+              if key != "final_data"}
+    filename = Reader.data_filename(fields["owner"], fields["month_num"])
+
+    sheet_counts = [mark["count"] for mark
+                    in fields["watermarks"]["sheets"].values()]
+
+    def save():
+        sink, index = StoreRowSink(store), 0
+        for sheet_rows in sheet_counts:
+            sink.start_sheet()
+            for row in rows[index:index + sheet_rows]:
+                sink.write(row)
+            index = index + sheet_rows
+        sink.close(filename, fields)
+
+    results.append({"stage": "save", **case,
+                    "seconds": _measure(save, repeat)})
+
+    # Load stages of the saved column blocks and of a JSON data file
+    json_path = data_dir / "benchmark.json"
+    json_path.write_text(json.dumps({**fields, "final_data": rows}))
+
+    def load_json():
+        with open(json_path, "r") as infile:
+            return json.loads(infile.read())["final_data"]
+
+    results.append({"stage": "load_json", **case,
+                    "seconds": _measure(load_json, repeat),
+                    "bytes": json_path.stat().st_size})
+    json_path.unlink()
+    results.append({"stage": "load", **case,
+                    "seconds": _measure(lambda: store.load(filename), repeat),
+                    "bytes": _stored_bytes(store, filename)})
+    results.append({"stage": "load_column", **case, "seconds": _measure(
+        lambda: sum(minutes or 0 for minutes in store.iter_column(
+            filename, "duration", typed=True)), repeat),
+        "bytes": _stored_bytes(store, filename, "duration")})
+
+    # Refresh stage of the saved rows after a few rows were added to
+    # each worksheet, only the tail blocks are written again
+    with FakeSheetsServer(workbooks={SPREADSHEET_ID: workbook}) as server:
+
+        def refresh_setup():
+            server.touch(SPREADSHEET_ID, rows=5)
+            return store.load(filename)
+
+        def refresh(previous):
+            reader = Reader(url=server.url(SPREADSHEET_ID))
+            reader.client = _client(server)
+            _check(reader.fetch_data(
+                sheet_identifier="*-", progress=_ignore, batched=True,
+                completed=_ignore, previous=previous,
+                sink=StoreRowSink(store)))
+
+        results.append({"stage": "refresh", **case, "seconds": _measure(
+            refresh, repeat, setup=refresh_setup)})
+
+    # Startup load of the saved file of this month and year
+    month_num, year = fields["month_num"].split("-")
+
+    def startup_setup():
+        GSheetLister.URLS_DB.clear()
+        lister = GSheetLister()
+        lister._month_dropdown.current.value = month_num
+        lister._year_dropdown.current.value = year
+        return lister
+
+    results.append({"stage": "startup", **case, "seconds": _measure(
+        lambda lister: lister._load_gsheeturl_data(initial_load=True),
+        repeat, setup=startup_setup)})
+    GSheetLister.URLS_DB.clear()
+
+    results.append({"stage": "csv_report", **case, "seconds": _measure(
+        lambda: Reader.generate_csv_report(_NullProgress()), repeat)})
+
+    for result in results:
+        result["rows_per_second"] = round(result["rows"] / result["seconds"])
+    return results
+
+
+@contextmanager
+def _offline():
+    """
+    Helper context manager that runs the stages on a temporary
+    project folder. The settings file is copied with a read quota
+    the rate limiter won't reach and the pauses of the CSV report
+    and the opening of the downloads folder are skipped. The fetch
+    checkpoints are also saved on the temporary folder.
+    """
+    settings = SettingsManager.get_settings_data()
+    settings["read_quota"] = 10 ** 6
+    with tempfile.TemporaryDirectory() as base:
+        base_path = Path(base)
+        data_dir = base_path / "downloads/data"
+        data_dir.mkdir(parents=True)
+        settings_path = base_path / "settings.json"
+        settings_path.write_text(json.dumps(settings))
+        with patch.object(Reader, "BASE_PATH", base_path), \
+                patch.object(Reader, "CHECKPOINT_DIR",
+                             base_path / "downloads/checkpoints"), \
+                patch.object(SettingsManager, "settings_path", settings_path), \
+                patch("modules.reader.time",
+                      SimpleNamespace(sleep=lambda seconds: None)), \
+                patch("modules.reader.platform",
+                      SimpleNamespace(system=lambda: "Benchmark")):
+            yield data_dir
+
+
+def _update_settings(**values):
+    """ Helper function to change the values of the settings file. """
+    settings = SettingsManager.get_settings_data()
+    settings.update(values)
+    SettingsManager.settings_path.write_text(json.dumps(settings))
+
+
+def _measure(func, repeat, setup=None):
+    """
+    Helper function to get the fastest time of repeat calls of func.
+    The value returned by setup is passed to func and is not timed.
+    """
+    times = []
+    for _ in range(repeat):
+        args = (setup(),) if setup else ()
+        start = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - start)
+    return round(min(times), 6)
+
+
+def _client(server):
+    """
+    Helper function to get a client of the fake server that asks for
+    compressed responses the same as the clients of the ClientPool.
+    """
+    client = server.client()
+    ClientPool.compress_responses(client.http_client.session)
+    return client
+
+
+def _stored_bytes(store, name, column=None):
+    """
+    Helper function to get the compressed bytes of the column blocks of
+    a saved source, only the ones of the column if it is given.
+    """
+    query = ("SELECT COALESCE(SUM(LENGTH(b.data) + "
+             "COALESCE(LENGTH(b.dictionary), 0)), 0) FROM blocks b "
+             "JOIN sources s ON s.id = b.source_id WHERE s.name = ?")
+    params = (name,)
+    if column:
+        query = query + " AND b.field = ?"
+        params = (name, store.ROW_COLUMNS.index(column))
+    with store._connect() as connection:
+        return connection.execute(query, params).fetchone()[0]
+
+
+def _sheet_columns(grid):
+    """
+    Helper function to get the date column and the data columns of a
+    fake worksheet grid the same way a download returns them.
+    """
+    rows = grid[5:]
+    datedata = [[row[4][0] for row in rows]]
+    data = {letter: [FakeSheetsServer._render(row[index], True)
+                     for row in rows]
+            for letter, index in (("F", 5), ("H", 7), ("I", 8), ("J", 9))}
+    return datedata, data
+
+
+def _check(result):
+    """ Helper function to raise if a fetch did not complete. """
+    if result is not True:
+        raise RuntimeError(f"Benchmark fetch failed: {result}")
+
+
+def _ignore(**kwargs):
+    """ Helper function used as the progress callback of a fetch. """
+
+
+def _case_key(result):
+    """ Helper function to get the key of a stage and case result. """
+    return result["stage"], result["rows"], result["sheets"]
+
+
+def _commit():
+    """ Helper function to get the current git commit hash if any. """
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+            text=True, check=True,
+            cwd=Path(__file__).resolve().parent).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _numbers(value):
+    """ Helper function to parse a comma separated list of numbers. """
+    return tuple(int(number) for number in value.split(","))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Times the fetch, parse, save, load, refresh, startup "
+                    "and CSV report stages on synthetic spreadsheets.")
+    parser.add_argument("--rows", type=_numbers, default=ROWS)
+    parser.add_argument("--sheets", type=_numbers, default=SHEETS)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", type=Path)
+    parser.add_argument("--compare", nargs=2, type=Path,
+                        metavar=("OLD", "NEW"))
+    args = parser.parse_args()
+
+    if args.compare:
+        old, new = (json.loads(path.read_text()) for path in args.compare)
+        regressions = 0
+        for change in compare(old, new):
+            flag = "SLOWER" if change["ratio"] > THRESHOLD else ""
+            regressions = regressions + bool(flag)
+            print(f"{change['stage']:<12}{change['rows']:>8} rows"
+                  f"{change['sheets']:>5} sheets  {change['old']:.4f}s -> "
+                  f"{change['new']:.4f}s  {change['ratio']:.2f}x {flag}")
+        sys.exit(1 if regressions else 0)
+
+    report = run(rows=args.rows, sheets=args.sheets, repeat=args.repeat)
+    output = args.output or \
+        RESULTS_PATH / f"pipeline-{report['commit'] or 'local'}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    for result in report["results"]:
+        print(f"{result['stage']:<12}{result['rows']:>8} rows"
+              f"{result['sheets']:>5} sheets  {result['seconds']:.4f}s  "
+              f"{result['rows_per_second']:>10} rows/s")
+    print(f"Results saved to {output}")
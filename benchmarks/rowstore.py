@@ -0,0 +1,73 @@
+# ---------------------------------------------------
+# rowstore.py - RowStore Benchmark
+# ---------------------------------------------------
+# A benchmark script that measures the memory used
+# by the final_data rows when kept as a list of
+# string lists and when kept on a RowStore. The rows
+# are synthetic rows shaped like a department file
+# and memory is measured using tracemalloc.
+# Run it from the project folder with:
+#   python -m benchmarks.rowstore [rows]
+# ---------------------------------------------------
+
+import json
+import random
+import sys
+import tracemalloc
+from modules.rowstore import RowStore
+
+
+def generate_rows(rows, seed=0, chunk=10000):
+    """
+    Generates synthetic final_data rows. The rows are decoded from JSON
+    in chunks like the rows loaded from a saved data file, so no string
+    object is shared between the rows.
+    """
+    rand = random.Random(seed)
+    for first in range(0, rows, chunk):
+        chunk_rows = []
+        for index in range(first, min(rows, first + chunk)):
+            owner = rand.randrange(40)
+            start, end = rand.randrange(96), rand.randrange(96)
+            minutes = abs(end - start) * 15
+            chunk_rows.append([
+                "Department", f"Account {owner % 8}", f"Employee {owner}",
+                f"2024-01-{rand.randrange(1, 32):02d}", f"Task {index}",
+                str(rand.randrange(1, 50)), _format_time(start),
+                _format_time(end), f"{minutes // 60}:{minutes % 60:02d}:00"])
+        yield from json.loads(json.dumps(chunk_rows))
+
+
+def measure(build, rows):
+    """ Returns the memory in bytes of the rows kept by build. """
+    tracemalloc.start()
+    kept = build(generate_rows(rows))
+    current = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+    return current
+
+
+def run(rows=500000):
+    """ Measures the list and RowStore memory of the same rows. """
+    list_memory = measure(list, rows)
+    store_memory = measure(RowStore, rows)
+    return {"rows": rows, "list": list_memory, "rowstore": store_memory,
+            "list_per_row": list_memory / rows,
+            "rowstore_per_row": store_memory / rows}
+
+
+def _format_time(quarter):
+    """ Helper function to format a quarter hour of a day as a time. """
+    hour, minute = divmod(quarter * 15, 60)
+    ampm = "AM" if hour < 12 else "PM"
+    return f"{(hour % 12) or 12}:{minute:02d} {ampm}"
+
+
+if __name__ == "__main__":
+    result = run(int(sys.argv[1]) if len(sys.argv) > 1 else 500000)
+    print(f"Rows: {result['rows']}")
+    print(f"List of lists: {result['list'] / 2 ** 20:.1f} MiB "
+          f"({result['list_per_row']:.0f} bytes per row)")
+    print(f"RowStore: {result['rowstore'] / 2 ** 20:.1f} MiB "
+          f"({result['rowstore_per_row']:.0f} bytes per row)")
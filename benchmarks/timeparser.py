@@ -0,0 +1,103 @@
+# ---------------------------------------------------
+# timeparser.py - TimeParser Benchmark
+# ---------------------------------------------------
+# A benchmark script that compares the memoized
+# TimeParser against the previous strptime based
+# parsing of the Reader row pipeline. It generates
+# synthetic serial date and time columns and prints
+# the time spent by each parser on the same columns.
+# Run it from the project folder with:
+#   python -m benchmarks.timeparser [rows]
+# ---------------------------------------------------
+
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from modules.timeparser import TimeParser
+
+
+def generate_columns(rows, seed=0):
+    """ Generates the synthetic date, start and end time columns. """
+    rand = random.Random(seed)
+    dates, start_times, end_times = [], [], []
+    for _ in range(rows):
+        dates.append(45292 + rand.randrange(31))
+        # Leave around 5 percent of the time cells empty
+        start, end = rand.randrange(24 * 60), rand.randrange(24 * 60)
+        start_times.append(_format_time(start) if rand.random() > .05 else "")
+        end_times.append(_format_time(end) if rand.random() > .05 else "")
+    return dates, start_times, end_times
+
+
+def legacy_parse(dates, start_times, end_times):
+    """ The previous parsing loops of the Reader row pipeline. """
+    dates, durations = list(dates), []
+    for i, strdate in enumerate(dates):
+        if strdate:
+            date = datetime(1899, 12, 30) + timedelta(days=int(strdate))
+            dates[i] = str(date.date())
+            date.strftime("%B %Y"), date.strftime("%m-%Y")
+    start_times = [_legacy_sanitize_time(st) for st in start_times]
+    end_times = [_legacy_sanitize_time(et) for et in end_times]
+    for st, et in zip(start_times, end_times):
+        if st and et:
+            start_time = datetime.strptime(st, "%I:%M %p")
+            end_time = datetime.strptime(et, "%I:%M %p")
+            duration_str = str(end_time - start_time)
+            durations.append(duration_str.split("day, ")[-1])
+        else:
+            durations.append("")
+    return dates, start_times, end_times, durations
+
+
+def memoized_parse(dates, start_times, end_times):
+    """ The TimeParser parsing of the Reader row pipeline. """
+    dates = list(dates)
+    for i, strdate in enumerate(dates):
+        if strdate:
+            dates[i] = TimeParser.serial_date(strdate)[0]
+    start_times = [TimeParser.sanitize_time(st) for st in start_times]
+    end_times = [TimeParser.sanitize_time(et) for et in end_times]
+    durations = [TimeParser.duration(st, et) if st and et else ""
+                 for st, et in zip(start_times, end_times)]
+    return dates, start_times, end_times, durations
+
+
+def run(rows=100000):
+    """ Runs both parsers on the same columns and returns the timings. """
+    columns = generate_columns(rows)
+    start = time.perf_counter()
+    legacy = legacy_parse(*columns)
+    legacy_time = time.perf_counter() - start
+    start = time.perf_counter()
+    memoized = memoized_parse(*columns)
+    memoized_time = time.perf_counter() - start
+    if legacy != memoized:
+        raise AssertionError("TimeParser results differ from legacy parsing")
+    return {"rows": rows, "legacy": legacy_time, "memoized": memoized_time,
+            "speedup": legacy_time / memoized_time}
+
+
+def _format_time(minutes):
+    """ Helper function to format minutes as a sheet time string. """
+    hour, minute = divmod(minutes, 60)
+    ampm = "AM" if hour < 12 else "PM"
+    return f"{(hour % 12) or 12}:{minute:02d}:00 {ampm}"
+
+
+def _legacy_sanitize_time(strtime):
+    """ Helper function of the previous Reader._sanitize_time. """
+    if len(strtime.split()) > 1:
+        timestr, ampm = strtime.split()
+        hour, minutes = timestr.split(":")[:2]
+        return f"{hour}:{minutes} {ampm}"
+    return ""
+
+
+if __name__ == "__main__":
+    result = run(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
+    print(f"Rows: {result['rows']}")
+    print(f"Legacy parsing: {result['legacy']:.3f}s")
+    print(f"TimeParser parsing: {result['memoized']:.3f}s")
+    print(f"Speedup: {result['speedup']:.1f}x")
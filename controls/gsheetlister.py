@@ -7,18 +7,27 @@
 # control dropdowns and buttons. The body is also
 # a column that lists gsheeturl controls.
 # This control autoloads the saved data on the
-# current month and year if there is any.
+# current month and year if there is any from the
+# sources of the data store.
+# The gsheeturl controls that are downloading are
+# tracked so they are kept while changing filters.
+# The refresh of all the urls runs on the background
+# and can be cancelled from its button.
 # ---------------------------------------------------
 
 import flet as ft
 import json
+import threading
 import time
 from pathlib import Path
 from datetime import datetime
 from calendar import month_name as months
 from controls.gsheeturl import GSheetURL
+from controls.settingsmanager import SettingsManager
+from modules.bulkrefresh import BulkRefresher
 from modules.reader import Reader
 from modules.styles import Styles
+from modules.writebehind import WriteBehind
 
 
 class GSheetLister(ft.Card):
@@ -26,6 +35,10 @@ class GSheetLister(ft.Card):
     # Class Variable to track Recents and URLs List
     RECENTS = []
     URLS_DB = {}
+    # Class Variable of the gsheeturl controls currently downloading
+    DOWNLOADS = {}
+    # Lock of the recents file written by the download threads
+    _recents_lock = threading.Lock()
 
     def __init__(self):
         """
@@ -46,6 +59,10 @@ class GSheetLister(ft.Card):
         self._loading_message = ft.Ref[ft.Text]()
         self._loading_icon = ft.Ref[ft.Icon]()
         self._recent_button = ft.Ref[ft.ElevatedButton]()
+        self._refresh_button = ft.Ref[ft.ElevatedButton]()
+
+        # The bulk refresher of the running refresh of all the urls
+        self._refresher = None
 
         # Determine the list of months and years to the dropdown
         month_options = [ft.dropdown.Option(text=m, key=str(k).zfill(2))
@@ -66,6 +83,13 @@ class GSheetLister(ft.Card):
                             color=ft.colors.WHITE54)
                 ]),
                 ft.Row([
+                    ft.ElevatedButton(text="Refresh All",
+                       ref=self._refresh_button,
+                       on_click=self.refresh_all_gsheeturl,
+                       icon="sync_rounded",
+                       style=Styles.recently_added_style,
+                       tooltip="REDOWNLOAD SHEETS OF THIS MONTH",
+                       height=35),
                     ft.ElevatedButton(text="Recently Added",
                        ref=self._recent_button,
                        on_click=lambda e: self.show_recently_added(),
@@ -136,8 +160,9 @@ class GSheetLister(ft.Card):
 
     def remove(self, gsheeturl):
         """ This method removes a specific GSheetURL object to its list. """
-        if gsheeturl:
-            self._gsheets_url_column.current.controls.remove(gsheeturl)
+        controls = self._gsheets_url_column.current.controls
+        if gsheeturl and gsheeturl in controls:
+            controls.remove(gsheeturl)
 
     def add_recents(self, filename):
         """
@@ -145,35 +170,53 @@ class GSheetLister(ft.Card):
         the recents list. It will also make sure to save only latest
         ten items of unique urls added.
         """
-        self.RECENTS.insert(0, filename)
-        self.RECENTS = self.RECENTS[:10]
-        # Save the current RECENTS into a JSON file
-        file = Path(Reader.BASE_PATH / "downloads/data/recents.json")
-        with open(file, "w") as outfile:
-            json.dump(self.RECENTS, outfile)
+        with self._recents_lock:
+            self.RECENTS.insert(0, filename)
+            self.RECENTS = self.RECENTS[:10]
+            self._save_recents()
 
     def remove_recents(self, filename):
         """
         This method will be used to remove a filename to the recents
         list. It will also update the recents.json file.
         """
-        if filename in self.RECENTS:
-            self.RECENTS.remove(filename)
-            # Save the current RECENTS into a JSON file
-            file = Path(Reader.BASE_PATH / "downloads/data/recents.json")
-            with open(file, "w") as outfile:
-                json.dump(self.RECENTS, outfile)
+        with self._recents_lock:
+            if filename in self.RECENTS:
+                self.RECENTS.remove(filename)
+                self._save_recents()
+
+    def _save_recents(self):
+        """
+        Helper method to save the current RECENTS into the recents.json
+        file on the background writer, so the callbacks never wait for
+        the disk.
+        """
+        file = Path(Reader.BASE_PATH / "downloads/data/recents.json")
+        WriteBehind.get_shared().write(file, json.dumps(self.RECENTS))
 
     def add_urlsdb(self, *, url, month, month_num, year, owner, filename):
         """
-        This method adds gsheet url data from currently finished fetch
-        callback method in main. It should be used only for newly added urls.
+        This method adds gsheet url data of a saved source while loading
+        the data store. The url data already on URLS_DB is kept, so the
+        sources are added from the newest one.
         """
         if url not in self.URLS_DB.keys():
             self.URLS_DB[url] = {"month": month, "month_num": month_num,
                                  "year": year, "owner": owner,
                                  "filename": filename}
 
+    def save_urlsdb(self, fetched):
+        """
+        This method adds or replaces the gsheet url data with the
+        completed kwargs of a fetch saved on the data store, so the
+        URLS_DB always has the latest saved source of each url.
+        """
+        month, year = fetched["month"].split()
+        self.URLS_DB[fetched["url"]] = {
+            "month": month, "month_num": fetched["month_num"].split("-")[0],
+            "year": year, "owner": fetched["owner"],
+            "filename": fetched["filename"]}
+
     def remove_urlsdb(self, url):
         """ Remove the specified url from the URLSDB variable. """
         if url in self.URLS_DB.keys():
@@ -188,6 +231,7 @@ class GSheetLister(ft.Card):
         self._month_dropdown.current.disabled = flag
         self._year_dropdown.current.disabled = flag
         self._recent_button.current.disabled = flag
+        self._refresh_button.current.disabled = flag
 
     def disable_gsheeturl_controls(self, flag):
         """ This will toggle to disable or not the gsheeturl items buttons. """
@@ -252,40 +296,152 @@ class GSheetLister(ft.Card):
         self._recent_button.current.style = Styles.recently_added_style
         self.update()
 
+    def refresh_all_gsheeturl(self, e):
+        """
+        This button event will redownload all the saved gsheet urls of the
+        selected month and year filters in one pass on the background.
+        It shows the overall progress on the progress bar and each running
+        download on its gsheeturl control, where it can be cancelled.
+        Clicking the button again while refreshing cancels every url.
+        """
+        if self._refresher:
+            self._refresher.cancel()
+            self._refresh_button.current.disabled = True
+            self.update()
+            return
+
+        month = self._month_dropdown.current.value
+        year = self._year_dropdown.current.value
+        progressbar = e.page.get_progressbar()
+        # The urls that are already downloading are not refreshed again
+        urls_db = {url: url_data for url, url_data in self.URLS_DB.items()
+                   if url not in self.DOWNLOADS}
+        # The gsheeturl controls of the urls that are being refreshed
+        refreshing = {}
+
+        def status_callback(url, status, details):
+            """ Callback to show the refresh of the url on its control. """
+            if status == BulkRefresher.RUNNING:
+                # A url downloaded by itself after it was queued is left
+                # to its own download
+                if url in self.DOWNLOADS:
+                    self._refresher.cancel(url)
+                    return
+                control = self._get_gsheeturl_control(url) or GSheetURL(url)
+                refreshing[url] = self.DOWNLOADS[url] = control
+                control.show_download(details["reader"])
+                return
+
+            if status in (BulkRefresher.DONE, BulkRefresher.UNCHANGED):
+                self.save_urlsdb(details)
+            control = refreshing.pop(url, None)
+            if not control:
+                return
+            self.DOWNLOADS.pop(url, None)
+            control.end_download()
+            url_data = self.URLS_DB[url]
+            if status in (BulkRefresher.FAILED, BulkRefresher.CANCELLED):
+                timestamp = "DOWNLOAD CANCELLED" \
+                    if status == BulkRefresher.CANCELLED else "UPDATE FAILED"
+                control.update_display_labels(
+                    owner=url_data["owner"],
+                    month=f"{url_data['month']} {url_data['year']}",
+                    timestamp=timestamp)
+            else:
+                control.update_display_labels(
+                    owner=details["owner"], month=details["month"],
+                    timestamp=details["timestamp"], diskload=False)
+
+        def progress_callback(done, total):
+            """ Callback to show the overall progress of the refresh. """
+            progressbar.update_progress(
+                left="Refreshing", center=f"{done} of {total}",
+                right="GSheets...", value=done / total if total else 0)
+
+        # Refresh the urls using the parallel downloads setting
+        settings = SettingsManager.get_settings_data()
+        self._refresher = BulkRefresher(urls_db=urls_db,
+                                        workers=settings.get("max_workers", 1),
+                                        month_num=month, year=year,
+                                        on_status=status_callback,
+                                        on_progress=progress_callback)
+        self._refresh_button.current.text = "Cancel All"
+        self._refresh_button.current.icon = "cancel_rounded"
+        self._refresh_button.current.tooltip = "CANCEL REFRESH OF ALL SHEETS"
+        progressbar.reset()
+        e.page.update()
+        e.page.run_thread(self._run_refresh, e.page)
+
+    def _run_refresh(self, page):
+        """
+        Helper method that runs the refresh of all the urls on the
+        background thread and shows its result on the progress bar.
+        """
+        try:
+            statuses = self._refresher.run()
+        finally:
+            self._refresher = None
+            self._refresh_button.current.text = "Refresh All"
+            self._refresh_button.current.icon = "sync_rounded"
+            self._refresh_button.current.tooltip = \
+                "REDOWNLOAD SHEETS OF THIS MONTH"
+            self._refresh_button.current.disabled = False
+
+        values = list(statuses.values())
+        done = len(values) - values.count(BulkRefresher.FAILED) - \
+            values.count(BulkRefresher.CANCELLED)
+        right = "Refresh Cancelled" \
+            if BulkRefresher.CANCELLED in values else "Refresh Completed"
+        page.get_progressbar().update_progress(
+            center=f"{done} of {len(values)}", right=right, value=1)
+        page.update()
+
+    def _get_gsheeturl_control(self, url):
+        """ Helper method to get the listed gsheeturl control of a url. """
+        for control in self._gsheets_url_column.current.controls:
+            if control.url == url:
+                return control
+        return None
+
     def _load_gsheeturl_data(self, initial_load=False):
         """
-        This method will load json from data folder based on the month
-        and year dropdown values. It will create a gsheeturl control
-        and cache its loaded data into memory.
+        This method will load the saved sources of the data store based
+        on the month and year dropdown values. It will create a gsheeturl
+        control and cache its loaded data into memory.
         This will also load the recents.json file and also list all
-        the existing URLS in the data folder.
+        the existing URLS in the data store.
         """
         month = self._month_dropdown.current.value
         year = self._year_dropdown.current.value
         data_dir = Path(Reader.BASE_PATH / "downloads/data")
+        store = Reader.data_store()
 
-        if not data_dir.exists():
-            return  # If data folder does not exist then exit this method
-
-        # Create a gsheeturl control if there are existing urls on this month
-        for path_name in data_dir.iterdir():
-            if path_name.name.startswith(f"{month}-{year}"):
-                self._create_gsheeturl_control(path_name.name, diskload=True)
+        # Move the JSON data files of the older versions into the store
+        if initial_load:
+            store.import_json(data_dir)
+
+        # Create a gsheeturl control if there are existing urls on this
+        # month. If it's initial load then recreate the URLS_DB dictionary
+        # on the same pass over the sources from the newest one, so each
+        # url points to its latest source. No rows are read for it.
+        month_num = f"{month}-{year}"
+        sources = store.sources(newest=True) if initial_load else \
+            store.sources(month_num)
+        month_sources = []
+        for source in sources:
+            if source["month_num"] == month_num:
+                month_sources.append(source)
+            if initial_load:
+                month_str, year_str = source["month"].split()
+                self.add_urlsdb(url=source["url"], month=month_str,
+                                month_num=source["month_num"].split("-")[0],
+                                year=year_str, owner=source["owner"],
+                                filename=source["name"])
+        for source in sorted(month_sources, key=lambda item: item["name"]):
+            self._create_gsheeturl_control(source, diskload=True)
 
-        # If it's initial load then recreate the URLS_DB dictionary
         # Load also the recents.json file into RECENTS list variable
         if initial_load:
-            for path_name in data_dir.iterdir():
-                if not path_name.name.startswith("recents"):
-                    with open(path_name, "r") as file:
-                        url_data = json.loads(file.read())
-                        month_str, year_str = url_data["month"].split()
-                        month_num = url_data["month_num"].split("-")[0]
-                        self.add_urlsdb(url=url_data["url"], month=month_str,
-                                        month_num=month_num, year=year_str,
-                                        owner=url_data["owner"],
-                                        filename=path_name.name)
-
             recents_file = data_dir / "recents.json"
             if recents_file.exists():
                 with open(recents_file) as file:
@@ -307,25 +463,27 @@ class GSheetLister(ft.Card):
         time.sleep(1)
 
         # Load and create the gsheeturl controls from RECENTS list
+        store = Reader.data_store()
         for filename in self.RECENTS:
-            self._create_gsheeturl_control(filename, diskload=False)
+            source = store.get_source(filename)
+            if source:
+                self._create_gsheeturl_control(source, diskload=False)
 
         # Update the loading container and reset the filter controls
         self._loading_container.current.visible = False
         self.disable_filter_controls(False)
         self.update()
 
-    def _create_gsheeturl_control(self, filename, diskload):
-        """ Helper method to create a gsheeturl control from filename. """
-        data_dir = Path(Reader.BASE_PATH / "downloads/data")
-        if data_dir.exists():
-            with open((data_dir / filename), "r") as file:
-                gsheet_data = json.loads(file.read())
-                gsheet_control = GSheetURL(gsheet_data["url"])
-                self.append(gsheet_control)
-                owner = gsheet_data["owner"]
-                month = gsheet_data["month"]
-                timestamp = gsheet_data["timestamp"]
-                gsheet_control.update_display_labels(
-                    owner=owner, month=month, timestamp=timestamp,
-                    autoupdate=False, diskload=diskload)
+    def _create_gsheeturl_control(self, source, diskload):
+        """ Helper method to create a gsheeturl control from a source. """
+        # Show the same control of a url that is still downloading
+        # so its progress is kept
+        if source["url"] in self.DOWNLOADS:
+            self.append(self.DOWNLOADS[source["url"]])
+            return
+        gsheet_control = GSheetURL(source["url"])
+        self.append(gsheet_control)
+        gsheet_control.update_display_labels(
+            owner=source["owner"], month=source["month"],
+            timestamp=source["timestamp"], autoupdate=False,
+            diskload=diskload)
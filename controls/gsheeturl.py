@@ -5,12 +5,15 @@
 # for displaying the added GSheet URLs. It shows
 # the URL, Last Time Updated, Department Owner of
 # the sheet and action buttons for this control.
+# The data of the url is downloaded on a background
+# thread and its progress is shown on this control,
+# so many urls can be downloaded at the same time.
 # ---------------------------------------------------
 
 import flet as ft
-import json
-from pathlib import Path
-from modules.reader import Reader
+from controls.settingsmanager import SettingsManager
+from modules.reader import FetchCancelled, Reader
+from modules.rowsink import StoreRowSink
 from modules.styles import Styles
 
 
@@ -24,8 +27,10 @@ class GSheetURL(ft.Container):
         """
         super().__init__()
 
-        # Save the url reference of the gsheet
+        # Save the url reference of the gsheet and the reader of its
+        # running download
         self.url = url
+        self.reader = None
 
         # Declaration of flet control references
         self._owner_name_text = ft.Ref[ft.Text]()
@@ -38,6 +43,8 @@ class GSheetURL(ft.Container):
         self._month_text = ft.Ref[ft.Text]()
         self._redownload_button = ft.Ref[ft.IconButton]()
         self._remove_button = ft.Ref[ft.IconButton]()
+        self._cancel_button = ft.Ref[ft.IconButton]()
+        self._download_progress = ft.Ref[ft.ProgressBar]()
 
         # Initialize first the container parameters
         self.bgcolor = ft.colors.BLUE_GREY_900
@@ -57,6 +64,9 @@ class GSheetURL(ft.Container):
                             overflow=ft.TextOverflow.ELLIPSIS,
                             color=ft.colors.WHITE60),
                 ], spacing=3),
+                ft.ProgressBar(ref=self._download_progress, width=480,
+                               bar_height=3, value=0, visible=False,
+                               color=ft.colors.GREEN_400),
                 ft.Row([
                     ft.Container(content=ft.Row([
                         ft.Icon("calendar_month_rounded", size=12,
@@ -93,6 +103,11 @@ class GSheetURL(ft.Container):
                              border_radius=6,
                              padding=ft.padding.symmetric(3, 10),
                              margin=ft.margin.only(0, 0, 20, 0)),
+                ft.IconButton(icon="cancel_rounded",
+                              ref=self._cancel_button,
+                              on_click=self.cancel_download,
+                              style=Styles.cancel_url_style,
+                              tooltip="CANCEL DOWNLOAD", visible=False),
                 ft.IconButton(icon="download_for_offline_rounded",
                               ref=self._redownload_button,
                               on_click=self.redownload_gsheet_data,
@@ -131,7 +146,7 @@ class GSheetURL(ft.Container):
             self._month_container.current.bgcolor = ft.colors.TEAL_600
             self._timestamp_container.current.bgcolor = ft.colors.TEAL_600
         if autoupdate:
-            self.update()
+            self._refresh()
 
     def reset_display_labels(self):
         """ This method resets the labels to its starting UI gray design. """
@@ -144,67 +159,165 @@ class GSheetURL(ft.Container):
         self._timestamp_text.current.value = "TIMESTAMP: Fetching Details..."
         self._month_text.current.value = "MONTH: Fetching Details..."
         self.disable_buttons(True)
-        self.update()
+        self._refresh()
 
     def disable_buttons(self, flag):
-        """ This will toggle the disabled flag of this gsheeturl buttons. """
-        self._remove_button.current.disabled = flag
-        self._redownload_button.current.disabled = flag
+        """
+        This will toggle the disabled flag of this gsheeturl buttons.
+        The buttons stay disabled while its data is downloading.
+        """
+        self._remove_button.current.disabled = flag or self.downloading
+        self._redownload_button.current.disabled = flag or self.downloading
 
-    def redownload_gsheet_data(self, e):
-        """ Redownload the data and save it again as json data file. """
-        # Reset the label displays of this gsheeturl control
+    @property
+    def downloading(self):
+        """ Returns True if the data of this url is downloading. """
+        return self.reader is not None
+
+    def start_download(self, page, *, previous=None, completed=None,
+                       failed=None):
+        """
+        Starts the download of this url data on a background thread of
+        the page and shows its progress on this control. The completed
+        callback receives the kwargs of the fetch and the failed callback
+        receives the result of a failed or cancelled fetch. Both of them
+        are called on the background thread after the download ends.
+        """
+        page.get_gsheetlister().DOWNLOADS[self.url] = self
+        self.show_download(Reader(url=self.url))
+        page.run_thread(self._run_download, page, previous,
+                        completed or (lambda **kwargs: None),
+                        failed or (lambda result: None))
+
+    def show_download(self, reader):
+        """
+        Shows the running download of the reader on this control. The
+        cancel button of this control cancels the reader.
+        """
+        self.reader = reader
         self.reset_display_labels()
-        # Get the page reference and call the helper method to disable buttons.
-        e.page.disable_all_buttons(True)
-        e.page.get_progressbar().reset()
-        e.page.update()
+        self._download_progress.current.value = 0
+        self._download_progress.current.visible = True
+        self._cancel_button.current.disabled = False
+        self._cancel_button.current.visible = True
+        self._refresh()
+
+    def end_download(self):
+        """ Hides the progress and cancel button of the ended download. """
+        self.reader = None
+        self._download_progress.current.visible = False
+        self._cancel_button.current.visible = False
+
+    def cancel_download(self, e):
+        """ Cancels the running download of this url data. """
+        if self.reader:
+            self.reader.cancel()
+            self._cancel_button.current.disabled = True
+            self._month_text.current.value = "CANCELLING..."
+            self._refresh()
+
+    def _run_download(self, page, previous, completed, failed):
+        """
+        Helper method that runs the fetch of this url on the background
+        thread. The rows are saved on the data store after downloading
+        and each progress is shown on this control.
+        """
+        def progress_callback(*, left="", center="", right="", value=0):
+            """ Callback for the progress bar of this control to update. """
+            self._download_progress.current.value = value
+            self._month_text.current.value = " ".join(
+                text for text in (left, right) if text).upper()
+            self._refresh()
+
+        fetched = {}
+        data_sink = StoreRowSink(Reader.data_store())
+        try:
+            result = self.reader.fetch_data(
+                sheet_identifier="*-", progress=progress_callback,
+                completed=lambda **kwargs: fetched.update(kwargs),
+                batched=True, previous=previous, sink=data_sink)
+        except Exception as e:
+            result = e
+        finally:
+            page.get_gsheetlister().DOWNLOADS.pop(self.url, None)
+            self.end_download()
+
+        if result is not True:
+            failed(result)
+            self._refresh()
+            return
+
+        # Show the completed download on the main progress bar and the
+        # timings of the fetch stages if enabled on settings
+        progressbar = page.get_progressbar()
+        with progressbar.lock:
+            progressbar.update_progress(center=fetched["owner"],
+                                        right="Download Completed", value=1)
+            if SettingsManager.get_settings_data().get("show_timings"):
+                progressbar.show_timings(fetched["timings"])
+        completed(**fetched)
+
+    def _refresh(self):
+        """
+        Helper method to update this control only if it is still shown
+        on the page since a filter may remove it while downloading.
+        """
+        if self.page:
+            self.update()
+
+    def redownload_gsheet_data(self, e):
+        """ Redownload the data and save it again on the data store. """
+        url_data = e.page.get_gsheetlister().URLS_DB.get(self.url)
 
         def fetch_completed(**kwargs):
             """ Callback method after the data fetch has been completed. """
+            # The downloaded data is already saved on the data store
+            # Point the URLS_DB to its source in case its month changed
+            e.page.get_gsheetlister().save_urlsdb(kwargs)
             self.update_display_labels(owner=kwargs["owner"],
                                        month=kwargs["month"],
                                        timestamp=kwargs["timestamp"],
                                        diskload=False)
-            # Update back the buttons to clickable
-            e.page.disable_all_buttons(False)
-            e.page.update()
-
-            # Save the downloaded data to its own JSON file
-            data_dir = Path(Reader.BASE_PATH / "downloads/data")
-            owner_formatted = kwargs["owner"].lower().replace(" ", "-")
-            filename = f"{kwargs['month_num']}-{owner_formatted}.json"
-            file = data_dir / filename
-            with open(file, "w") as outfile:
-                json.dump(kwargs, outfile)
-
-        def progress_callback(**kwargs):
-            """ Callback for the progress bar control to update. """
-            progressbar_control = e.page.get_progressbar()
-            progressbar_control.update_progress(**kwargs)
-
-        # Create Reader class to fetch data and pass the required callbacks
-        reader = Reader(url=self.url)
-        reader.fetch_data(sheet_identifier="*-",
-                          progress=progress_callback,
-                          completed=fetch_completed)
+
+        def fetch_failed(result):
+            """ Callback method to show back the saved data details. """
+            if url_data:
+                timestamp = "DOWNLOAD CANCELLED" \
+                    if result is FetchCancelled else "UPDATE FAILED"
+                self.update_display_labels(
+                    owner=url_data["owner"],
+                    month=f"{url_data['month']} {url_data['year']}",
+                    timestamp=timestamp)
+
+        # Load the previous saved data of this url to only download the
+        # new rows after its saved watermarks
+        previous = None
+        if url_data:
+            previous = Reader.data_store().load(url_data["filename"])
+
+        # A manual redownload also gets the worksheets and ownership of
+        # the spreadsheet again instead of using the metadata cache
+        Reader.invalidate_metadata(self.url)
+
+        # Download the data on the background so the other controls
+        # can still be used while downloading
+        self.start_download(e.page, previous=previous,
+                            completed=fetch_completed, failed=fetch_failed)
 
     def remove_gsheet_data(self, e):
-        """ Remove the saved gsheeturl from data folder and recents list. """
+        """ Remove the saved gsheeturl from data store and recents list. """
         gsheetlister = e.page.get_gsheetlister()
         url_data = gsheetlister.URLS_DB[self.url]
 
         def confirm_delete(ev):
             """ Callback function for confirming the delete in bottom sheet. """
-            # Delete the file on the data folder
-            data_dir = Path(Reader.BASE_PATH / "downloads/data")
-            file = data_dir / url_data["filename"]
-            if file.exists():
-                file.unlink()
+            # Delete the source and its rows on the data store
+            Reader.data_store().delete(url_data["filename"])
             # Remove from the recents list and resave the recents.json file
             gsheetlister.remove_recents(url_data["filename"])
-            # Remove also the loaded data from URLSDB
+            # Remove also the loaded data from URLSDB and metadata cache
             gsheetlister.remove_urlsdb(self.url)
+            Reader.invalidate_metadata(self.url)
             # Finally remove the gsheeturl control
             gsheetlister.remove(self)
             ev.page.close(bottom_sheet)
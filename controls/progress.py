@@ -5,10 +5,12 @@
 # displaying a progressbar with accompanied text
 # used in showing status messages. This also has
 # methods to easily change the progress value and
-# status messages.
+# status messages. The updates can be made from the
+# download threads and are done one at a time.
 # ---------------------------------------------------
 
 import flet as ft
+import threading
 
 
 class Progress(ft.Column):
@@ -29,6 +31,10 @@ class Progress(ft.Column):
         self._center_container = ft.Ref[ft.Container]()
         self._progress_bar = ft.Ref[ft.ProgressBar]()
 
+        # Lock of the updates made by the download threads. Hold it to
+        # make more than one update without the other threads between.
+        self.lock = threading.RLock()
+
         # Column Parameters
         self.expand = 5
 
@@ -56,40 +62,71 @@ class Progress(ft.Column):
 
     def update_progress(self, *, left="", center="", right="", value=0):
         """ Updates the message and progress value of this control. """
-        self._message_text_left.current.value = left
-        self._message_text_right.current.value = right
-        self._center_container.current.visible = False
-        if center:
-            self._center_container.current.visible = True
-            self._message_text_center.current.value = center.upper()
-        self._progress_bar.current.value = value
+        with self.lock:
+            self._message_text_left.current.value = left
+            self._message_text_right.current.value = right
+            self._center_container.current.visible = False
+            if center:
+                self._center_container.current.visible = True
+                self._message_text_center.current.value = center.upper()
+            self._progress_bar.current.value = value
+
+            # Change to red style when detected "Download Failed" on left
+            if left == "Download Failed":
+                self._message_text_left.current.color = ft.colors.RED_ACCENT
+                self._message_text_right.current.color = ft.colors.RED_ACCENT
+                self._center_container.current.bgcolor = \
+                    ft.colors.RED_ACCENT_700
+                self._progress_bar.current.color = ft.colors.RED_ACCENT
+
+            # Change the appearance of the message if progress is finished
+            if value == 1:
+                self._message_text_left.current.color = ft.colors.GREEN_400
+                self._message_text_right.current.color = ft.colors.GREEN_400
+                self._center_container.current.bgcolor = ft.colors.GREEN_700
+                self._center_icon.current.name = "cloud_done_rounded"
 
-        # Change to red style when detected "Download Failed" text on left
-        if left == "Download Failed":
-            self._message_text_left.current.color = ft.colors.RED_ACCENT
-            self._message_text_right.current.color = ft.colors.RED_ACCENT
-            self._center_container.current.bgcolor = ft.colors.RED_ACCENT_700
-            self._progress_bar.current.color = ft.colors.RED_ACCENT
+            self.update()
 
-        # Change the appearance of the message if progress bar is finished
-        if value == 1:
-            self._message_text_left.current.color = ft.colors.GREEN_400
-            self._message_text_right.current.color = ft.colors.GREEN_400
-            self._center_container.current.bgcolor = ft.colors.GREEN_700
-            self._center_icon.current.name = "cloud_done_rounded"
+    def show_timings(self, timings):
+        """
+        Shows the total time, API calls and downloaded size of a fetch
+        timings report beside the right message. The time of each stage
+        and the slowest worksheets are shown on its tooltip.
+        """
+        with self.lock:
+            size = timings["bytes"] / 1024
+            self._message_text_right.current.value = (
+                f"{self._message_text_right.current.value} "
+                f"({timings['total']:.1f}s, {timings['api_calls']} calls, "
+                f"{size:,.0f} KB)")
 
-        self.update()
+            # List the stages from the slowest and the three slowest sheets
+            lines = [f"{stage}: {seconds:.2f}s" for stage, seconds in
+                     sorted(timings["stages"].items(),
+                            key=lambda item: item[1], reverse=True)]
+            lines.append(f"rate limit wait: {timings['wait']:.2f}s")
+            slowest = sorted(timings["sheets"].items(), reverse=True,
+                             key=lambda item: item[1].get("download", 0) +
+                             item[1].get("parse", 0))
+            for sheet, stages in slowest[:3]:
+                lines.append(f"{sheet}: {stages.get('download', 0):.2f}s "
+                             f"download, {stages.get('parse', 0):.2f}s parse")
+            self._message_text_right.current.tooltip = "\n".join(lines)
+            self.update()
 
     def reset(self):
         """ Resets the progress bar to show no message and 0 value. """
-        self._message_text_left.current.value = ""
-        self._message_text_center.current.value = ""
-        self._message_text_right.current.value = ""
-        self._center_container.current.visible = False
-        self._center_icon.current.name = "account_circle"
-        self._center_container.current.bgcolor = ft.colors.BLUE_800
-        self._message_text_left.current.color = ft.colors.WHITE
-        self._message_text_right.current.color = ft.colors.WHITE
-        self._progress_bar.current.color = ft.colors.GREEN_400
-        self._progress_bar.current.value = 0
-        self.update()
+        with self.lock:
+            self._message_text_left.current.value = ""
+            self._message_text_center.current.value = ""
+            self._message_text_right.current.value = ""
+            self._message_text_right.current.tooltip = None
+            self._center_container.current.visible = False
+            self._center_icon.current.name = "account_circle"
+            self._center_container.current.bgcolor = ft.colors.BLUE_800
+            self._message_text_left.current.color = ft.colors.WHITE
+            self._message_text_right.current.color = ft.colors.WHITE
+            self._progress_bar.current.color = ft.colors.GREEN_400
+            self._progress_bar.current.value = 0
+            self.update()
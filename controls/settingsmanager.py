@@ -12,6 +12,9 @@
 import flet as ft
 import json
 from pathlib import Path
+from modules.metacache import MetadataCache
+from modules.parsepool import ParsePool
+from modules.ratelimiter import RateLimiter
 
 
 class SettingsManager(ft.Row):
@@ -41,6 +44,11 @@ class SettingsManager(ft.Row):
         self._task_name = ft.Ref[ft.TextField]()
         self._proccessed_col = ft.Ref[ft.TextField]()
         self._proccessed_name = ft.Ref[ft.TextField]()
+        self._read_quota = ft.Ref[ft.TextField]()
+        self._max_workers = ft.Ref[ft.TextField]()
+        self._metadata_ttl = ft.Ref[ft.TextField]()
+        self._parse_workers = ft.Ref[ft.TextField]()
+        self._show_timings = ft.Ref[ft.Switch]()
 
         self.controls = [
             ft.Row([
@@ -124,6 +132,28 @@ class SettingsManager(ft.Row):
                                 color=ft.colors.WHITE70)
                     ], alignment=ft.MainAxisAlignment.START),
 
+                    # Container for the API Request Fields
+                    ft.Container(content=ft.Column([
+                        NumberFieldContainer(icon="speed_rounded",
+                                             label="Read Quota\nPer Minute",
+                                             field_ref=self._read_quota),
+                        NumberFieldContainer(icon="call_split_rounded",
+                                             label="Parallel\nDownloads",
+                                             field_ref=self._max_workers),
+                        NumberFieldContainer(icon="cached_rounded",
+                                             label="Metadata Cache\nMinutes",
+                                             field_ref=self._metadata_ttl),
+                        NumberFieldContainer(icon="memory_rounded",
+                                             label="Parse\nProcesses",
+                                             field_ref=self._parse_workers),
+                        SwitchFieldContainer(icon="timer_outlined",
+                                             label="Show Fetch\nTimings",
+                                             field_ref=self._show_timings),
+                    ], spacing=15),
+                        bgcolor=ft.colors.BLUE_GREY_800,
+                        padding=ft.padding.all(10),
+                        margin=ft.margin.only(0, 5, 0, 10)),
+
                     ft.Row([
                         ft.ElevatedButton("BACK", height=40,
                                           bgcolor=ft.colors.BLUE_GREY_700,
@@ -161,6 +191,10 @@ class SettingsManager(ft.Row):
         task_name = self._task_name.current.value
         proccessed_col = self._proccessed_col.current.value
         proccessed_name = self._proccessed_name.current.value
+        read_quota = self._read_quota.current.value
+        max_workers = self._max_workers.current.value
+        metadata_ttl = self._metadata_ttl.current.value
+        parse_workers = self._parse_workers.current.value
 
         req_var = []
 
@@ -175,6 +209,10 @@ class SettingsManager(ft.Row):
         if not task_name: req_var.append("Task Name Column Name")
         if not proccessed_col: req_var.append("Task Count Column Letter")
         if not proccessed_name: req_var.append("Task Count Column Name")
+        if not read_quota: req_var.append("Read Quota Per Minute")
+        if not max_workers: req_var.append("Parallel Downloads")
+        if not metadata_ttl: req_var.append("Metadata Cache Minutes")
+        if not parse_workers: req_var.append("Parse Processes")
 
         # Create the bottom sheet control for displaying the list of empty fields after save
         if req_var:
@@ -190,6 +228,11 @@ class SettingsManager(ft.Row):
                          [end_time_col, end_time_name]],
             "other_columns": [[task_col, task_name],
                               [proccessed_col, proccessed_name]],
+            "read_quota": int(read_quota),
+            "max_workers": max(1, int(max_workers)),
+            "metadata_ttl": int(metadata_ttl),
+            "parse_workers": max(0, int(parse_workers)),
+            "show_timings": bool(self._show_timings.current.value),
         }
 
         # Save the dictionary into a json file
@@ -245,6 +288,16 @@ class SettingsManager(ft.Row):
                 self._task_name.current.value = other_cols[0][1]
                 self._proccessed_col.current.value = other_cols[1][0]
                 self._proccessed_name.current.value = other_cols[1][1]
+            self._read_quota.current.value = str(
+                settings_data.get("read_quota", RateLimiter.DEFAULT_QUOTA))
+            self._max_workers.current.value = str(
+                settings_data.get("max_workers", 1))
+            self._metadata_ttl.current.value = str(
+                settings_data.get("metadata_ttl", MetadataCache.DEFAULT_TTL))
+            self._parse_workers.current.value = str(
+                settings_data.get("parse_workers", ParsePool.DEFAULT_WORKERS))
+            self._show_timings.current.value = settings_data.get(
+                "show_timings", False)
 
 
 #----------------------------------
@@ -281,6 +334,49 @@ class FieldContainer(ft.Row):
                          text_size=14, expand=2, height=40)
         ]
 
+class NumberFieldContainer(ft.Row):
+
+    def __init__(self, *, icon, label, field_ref):
+        """
+        Custom Control for Settings to generate
+        a row of numeric field setting with label,
+        icon and a number only field.
+        """
+        super().__init__()
+
+        self.controls = [
+            ft.Row([
+                ft.Icon(icon, color=ft.colors.WHITE70),
+                ft.Text(label, weight=ft.FontWeight.BOLD, size=13)], expand=1),
+            ft.TextField(ref=field_ref, hint_text="Number",
+                         hint_style=ft.TextStyle(color=ft.colors.BLACK54, size=12),
+                         bgcolor=ft.colors.WHITE70,
+                         border_color=ft.colors.GREY_500,
+                         color=ft.colors.BLACK,
+                         text_size=16, expand=1, height=40,
+                         text_align=ft.TextAlign.CENTER,
+                         input_filter=ft.NumbersOnlyInputFilter())
+        ]
+
+class SwitchFieldContainer(ft.Row):
+
+    def __init__(self, *, icon, label, field_ref):
+        """
+        Custom Control for Settings to generate
+        a row of on and off setting with label,
+        icon and a switch.
+        """
+        super().__init__()
+
+        self.controls = [
+            ft.Row([
+                ft.Icon(icon, color=ft.colors.WHITE70),
+                ft.Text(label, weight=ft.FontWeight.BOLD, size=13)], expand=1),
+            ft.Row([ft.Switch(ref=field_ref,
+                              active_color=ft.colors.BLUE_ACCENT_700)],
+                   alignment=ft.MainAxisAlignment.CENTER, expand=1)
+        ]
+
 class RequiredMessage(ft.BottomSheet):
 
     def __init__(self, *, errors):
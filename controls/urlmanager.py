@@ -6,14 +6,14 @@
 # which contain error messages to the related URL.
 # This also fetches the gsheet data on a valid
 # URL input and converts them to gsheeturl controls.
+# The data is downloaded on the background so more
+# urls can be added while the others are downloading.
 # ---------------------------------------------------
 
 import flet as ft
-import json
 import gspread.exceptions as gexceptions
-from pathlib import Path
 from controls.gsheeturl import GSheetURL
-from modules.reader import Reader
+from modules.reader import FetchCancelled
 from modules.styles import Styles
 
 
@@ -76,6 +76,11 @@ class URLManager(ft.Card):
                        "domain, must be a valid URL and not empty.")
             dialogbox = self._generate_invalid_url_dialogbox(message)
 
+        # Perform a validation to determine if URL is being downloaded
+        elif url in gsheetlister.DOWNLOADS.keys():
+            message = "This GSheet URL is already being downloaded."
+            dialogbox = self._generate_invalid_url_dialogbox(message)
+
         # Perform a validation to determine if URL already exists
         elif url in gsheetlister.URLS_DB.keys():
             data = gsheetlister.URLS_DB[url]
@@ -97,8 +102,6 @@ class URLManager(ft.Card):
         gsheeturl_control = GSheetURL(url)
         self._gsheet_url.current.value = ""
         gsheetlister.append(gsheeturl_control, first=True)
-        e.page.disable_all_buttons(True)
-        e.page.get_progressbar().reset()
         e.page.update()
 
         def fetch_completed(**kwargs):
@@ -106,66 +109,45 @@ class URLManager(ft.Card):
             gsheeturl_control.update_display_labels(
                 owner=kwargs["owner"], month=kwargs["month"],
                 timestamp=kwargs["timestamp"], diskload=False)
-            # Update the states of UI Controls
-            e.page.disable_all_buttons(False)
-            e.page.update()
 
-            # Save the downloaded data to its own JSON file
-            data_dir = Path(Reader.BASE_PATH / "downloads/data")
-            data_dir.mkdir(parents=True, exist_ok=True)
-            owner_formatted = kwargs["owner"].lower().replace(" ", "-")
-            filename = f"{kwargs['month_num']}-{owner_formatted}.json"
-            file = data_dir / filename
-            with open(file, "w") as outfile:
-                json.dump(kwargs, outfile)
+            # The downloaded data is already saved on the data store
+            filename = kwargs["filename"]
 
             # Save to the gsheetlister RECENTS list
             gsheetlister.add_recents(filename)
             # Save to the gsheetlister URLS_DB dictionary
-            month, year = kwargs["month"].split()
-            month_num = kwargs["month_num"].split("-")[0]
-            gsheetlister.add_urlsdb(url=kwargs["url"], month=month,
-                                    year=year, month_num=month_num,
-                                    owner=kwargs["owner"],
-                                    filename=filename)
-
-        def progress_callback(**kwargs):
-            """ Callback for the progress bar control to update. """
-            progressbar_control = e.page.get_progressbar()
-            progressbar_control.update_progress(**kwargs)
-
-        # Create Reader class to fetch data and pass the required callbacks
-        # If it returns an exception from gspread then show an appropriate
-        # error dialog box.
-        reader = Reader(url=url)
-        result = reader.fetch_data(sheet_identifier="*-",
-                                   progress=progress_callback,
-                                   completed=fetch_completed)
-        reset_prog = True
-        match result:
-            case gexceptions.SpreadsheetNotFound:
-                message = "Spreadsheet not found on the provided URL."
-            case gexceptions.APIError:
-                message = "API Key Configuration Not Found."
-            case gexceptions.GSpreadException:
-                message = ("GSheet URL is not shared to the configured\n"
-                           "email of GSheet Reader API key.")
-            case _:
-                reset_prog = False
-                message = ("Data Reading Failed. Details of the Error: \n"
-                           f"{str(result)}")
-
-        # Remove the gsheeturl control if an exception is found.
-        # Also reset the progress and the filter buttons.
-        if result is not True:
-            dialogbox = self._generate_invalid_url_dialogbox(message)
-            e.page.open(dialogbox)
+            gsheetlister.save_urlsdb(kwargs)
+
+        def fetch_failed(result):
+            """
+            Callback method if the data fetch failed or was cancelled.
+            If it returns an exception from gspread then show an
+            appropriate error dialog box.
+            """
+            # Remove the gsheeturl control since it has no saved data
             gsheetlister.remove(gsheeturl_control)
-            e.page.disable_all_buttons(False)
-            if reset_prog:
-                e.page.get_progressbar().reset()
+            if result is not FetchCancelled:
+                match result:
+                    case gexceptions.SpreadsheetNotFound:
+                        message = "Spreadsheet not found on the provided URL."
+                    case gexceptions.APIError:
+                        message = "API Key Configuration Not Found."
+                    case gexceptions.GSpreadException:
+                        message = ("GSheet URL is not shared to the "
+                                   "configured\nemail of GSheet Reader "
+                                   "API key.")
+                    case _:
+                        message = ("Data Reading Failed. Details of the "
+                                   f"Error: \n{str(result)}")
+                e.page.open(self._generate_invalid_url_dialogbox(message))
             e.page.update()
 
+        # Download the data on the background and show its progress on
+        # the gsheeturl control. The rows are saved on the data store
+        # after downloading.
+        gsheeturl_control.start_download(e.page, completed=fetch_completed,
+                                         failed=fetch_failed)
+
     def disable_buttons(self, flag: bool):
         """ Helper method to change state this control buttons. """
         self._add_url_button.current.disabled = flag
@@ -1,4 +1,5 @@
 import flet as ft
+import multiprocessing
 from controls.urlmanager import URLManager
 from controls.settingsmanager import SettingsManager
 from controls.gsheetlister import GSheetLister
@@ -10,11 +11,6 @@ from modules.styles import Styles
 # Flet Control References
 download_button = ft.Ref[ft.ElevatedButton]()
 
-# Custom Control References
-progressbar_control = Progress()
-gsheetlister_control = GSheetLister()
-urlmanager_control = URLManager()
-
 
 def download_button_event(e):
     """
@@ -22,20 +18,20 @@ def download_button_event(e):
     on the saved json files.
     """
     # Disable the current visible buttons
-    disable_all_buttons(True)
+    e.page.disable_all_buttons(True)
     e.page.update()
     # Generate the CSV Report
-    Reader.generate_csv_report(progressbar_control)
+    Reader.generate_csv_report(e.page.get_progressbar())
     # Enable again all the visible buttons
-    disable_all_buttons(False)
+    e.page.disable_all_buttons(False)
     e.page.update()
 
 
-def disable_all_buttons(flag: bool):
+def disable_all_buttons(page: ft.Page, flag: bool):
     """ Helper method of the main window to enable/disable all buttons. """
-    urlmanager_control.disable_buttons(flag)
-    gsheetlister_control.disable_filter_controls(flag)
-    gsheetlister_control.disable_gsheeturl_controls(flag)
+    page.get_urlmanager().disable_buttons(flag)
+    page.get_gsheetlister().disable_filter_controls(flag)
+    page.get_gsheetlister().disable_gsheeturl_controls(flag)
     download_button.current.disabled = flag
 
 
@@ -50,11 +46,18 @@ def main(page: ft.Page):
     page.window.resizable = False
     page.theme_mode = ft.ThemeMode.DARK
 
+    # Create the custom controls only on the app process, the worker
+    # processes of the parse pool import this module too and must not
+    # open the data store
+    progressbar_control = Progress()
+    gsheetlister_control = GSheetLister()
+    urlmanager_control = URLManager()
+
     # Set function call references on page to easily get parent controls
     page.get_progressbar = lambda: progressbar_control
     page.get_gsheetlister = lambda: gsheetlister_control
     page.get_urlmanager = lambda: urlmanager_control
-    page.disable_all_buttons = disable_all_buttons
+    page.disable_all_buttons = lambda flag: disable_all_buttons(page, flag)
 
     # Download Button and Progress Bar Container
     download_progress_container = ft.Container(
@@ -95,5 +98,8 @@ def main(page: ft.Page):
     page.go("/dashboard")
 
 
-# Run the main Flet Window App
-ft.app(main)
+# Run the main Flet Window App. The worker processes of the parse pool
+# import this module too, so they must not open the window again.
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    ft.app(main)
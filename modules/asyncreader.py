@@ -0,0 +1,311 @@
+# ---------------------------------------------------
+# asyncreader.py - AsyncReader Class
+# ---------------------------------------------------
+# A module that contains an asyncio version of the
+# Reader. Instead of the blocking gspread client, the
+# Sheets and Drive REST endpoints are requested with
+# an async HTTP client so many batch requests and many
+# spreadsheets can be downloaded on one event loop.
+# The same ranges, watermarks, row format and results
+# of the batched Reader fetch are used. The readers of
+# many spreadsheets can share one HTTP client so its
+# connections are reused, and the rows are saved on a
+# worker thread so the event loop is never blocked.
+# ---------------------------------------------------
+
+import asyncio
+import contextlib
+import gspread
+import httpx
+from google.auth.transport.requests import Request
+from gspread.utils import extract_id_from_url
+from modules.fetchtimer import FetchTimer
+from modules.reader import FetchError, Reader
+
+
+class AsyncReader(Reader):
+
+    # Base urls of the Sheets and Drive REST endpoints
+    SHEETS_URL = "https://sheets.googleapis.com/v4/spreadsheets"
+    DRIVE_URL = "https://www.googleapis.com/drive/v3/files"
+    # Seconds to wait for a response of a single request
+    TIMEOUT = 60
+
+    def __init__(self, *, url, sheets_url=SHEETS_URL, drive_url=DRIVE_URL,
+                 session=None):
+        """
+        AsyncReader downloads the same data as the batched Reader using
+        an async HTTP client. The sheets_url and drive_url can point to
+        another server that serves the same endpoints. The access token
+        is taken from the credentials of the shared gspread client.
+        Pass the same session of create_session to the readers of many
+        spreadsheets to reuse its connections, it is not closed by the
+        reader. Without a session each fetch opens its own client.
+        """
+        super().__init__(url=url)
+        self.sheets_url = sheets_url.rstrip("/")
+        self.drive_url = drive_url.rstrip("/")
+        self.session = session
+        self._headers = {}
+
+    @staticmethod
+    def create_session(max_connections=None):
+        """
+        Returns a new async HTTP client to share between the readers,
+        with the default connection limits of httpx if max_connections
+        is not given. Close it with aclose or use it as an async context
+        manager.
+        """
+        if not max_connections:
+            return httpx.AsyncClient(timeout=AsyncReader.TIMEOUT)
+        return httpx.AsyncClient(
+            timeout=AsyncReader.TIMEOUT,
+            limits=httpx.Limits(max_connections=max_connections))
+
+    async def fetch_data(self, *, sheet_identifier, progress, completed,
+                         previous=None, sink=None):
+        """
+        Async version of Reader.fetch_data. Accepts the same arguments
+        and calls completed with the same kwargs. Returns True or the
+        exception class or exception if the spreadsheet can't be read.
+        The worksheets are always downloaded in batched requests.
+        """
+        try:
+            sheets = await self._download_sheets(
+                sheet_identifier=sheet_identifier, progress=progress,
+                previous=previous, skip_unchanged=sink is not None)
+        except FetchError as e:
+            if sink:
+                sink.discard()
+            return e.result
+        except Exception:
+            if sink:
+                sink.discard()
+            raise
+        finally:
+            # Save the metadata downloaded even if the fetch failed
+            self.metadata.save()
+        # The rows are parsed and saved while iterated, so they are
+        # consumed on a worker thread
+        return await asyncio.to_thread(self._store_rows, sheets,
+                                       progress=progress,
+                                       completed=completed, sink=sink)
+
+    async def download_rows(self, *, sheet_identifier, progress,
+                            previous=None, skip_unchanged=False):
+        """
+        Downloads every worksheet range of the spreadsheet and returns
+        a generator of the final rows the same as Reader.iter_rows. An
+        unchanged spreadsheet has the previous rows, or no rows at all
+        if skip_unchanged is True.
+        The result variable is saved after the last row is yielded.
+        The worksheets saved on the checkpoint of a failed fetch are
+        resumed the same as Reader.iter_rows.
+        Raises FetchError if the spreadsheet can't be read.
+        """
+        return self._flatten(await self._download_sheets(
+            sheet_identifier=sheet_identifier, progress=progress,
+            previous=previous, skip_unchanged=skip_unchanged))
+
+    async def _download_sheets(self, *, sheet_identifier, progress,
+                               previous=None, skip_unchanged=False):
+        """
+        Helper method of download_rows that returns a generator of the
+        kept and new rows of each worksheet the same as
+        Reader._iter_sheets.
+        """
+        self.result, self.unchanged, self.checkpoint = None, False, None
+        self._base_name, self._base_positions = None, {}
+        self.timer = FetchTimer()
+
+        # Check first if client is valid and the url has a spreadsheet id
+        if not self.client:
+            raise FetchError(gspread.exceptions.APIError)
+        try:
+            spreadsheet_id = extract_id_from_url(self.url)
+        except gspread.exceptions.NoValidUrlKeyFound:
+            raise FetchError(gspread.exceptions.SpreadsheetNotFound)
+
+        # Get the settings saved configuration data and the planner of
+        # the ranges to request on each worksheet
+        columns, planner = self._load_settings()
+        columns_key = list(columns.values())
+        self._headers = await asyncio.to_thread(self._auth_headers)
+
+        async with self._open_session() as session:
+            # Check first the last modified time of the spreadsheet and
+            # skip the download if it did not change since previous fetch
+            progress(left="Checking Sheet Changes...", value=0)
+            with self.timer.span("check_changes"):
+                modified_time = await self._get_modified_time_async(
+                    session, spreadsheet_id)
+            if self._is_unchanged(previous, modified_time, columns_key):
+                progress(left="Sheet Unchanged", center=previous["owner"],
+                         right="Download Skipped", value=1)
+                self._set_unchanged_result(previous)
+                return iter(() if skip_unchanged else
+                            [((), previous["final_data"])])
+
+            # Get the worksheets of the spreadsheet from the metadata
+            # cache if the spreadsheet did not change since they were
+            # cached. If not, download the worksheets with its row count
+            # to bound the rows of the ranges.
+            progress(left="Opening Sheet from URL...", value=0)
+            metadata = self.metadata.get(spreadsheet_id, modified_time)
+            cached, row_counts = metadata is not None, {}
+            if not cached:
+                try:
+                    with self.timer.span("open"):
+                        response = await self._get_json(
+                            session, f"{self.sheets_url}/{spreadsheet_id}",
+                            {"fields": Reader.SHEETS_FIELDS})
+                except gspread.exceptions.APIError as e:
+                    if e.code == 404:
+                        raise FetchError(
+                            gspread.exceptions.SpreadsheetNotFound)
+                    if e.code == 403:
+                        raise FetchError(gspread.exceptions.GSpreadException)
+                    raise
+                sheets, row_counts = self._read_worksheets(response)
+                self.metadata.update(spreadsheet_id, sheets=sheets,
+                                     modified_time=modified_time)
+                metadata = {"sheets": sheets, "department": None,
+                            "ownerships": {}}
+
+            # Get the worksheets with only names starting with identifier
+            progress(left="Filtering Worksheet Names...", value=0.05)
+            sheets_names = [title for title, sheet_id in metadata["sheets"]
+                            if title.startswith(sheet_identifier)]
+
+            # Get the watermarks of the previous fetch and the worksheets
+            # of the checkpoint. Only the pending worksheets are downloaded.
+            resumed, old_marks, old_rows, starts = self._plan_sheets(
+                previous, columns_key, sheets_names, modified_time)
+            pending = [name for name in sheets_names if name not in resumed]
+
+            # Download the formatted and the date ranges at the same time
+            # The cached department name and ownerships are not requested
+            progress(left="Fetching Sheet Ownership...", value=0.1)
+            department_name = metadata["department"]
+            ownerships = metadata["ownerships"]
+            formatted_ranges, date_ranges = self._batch_ranges(
+                pending, starts, row_counts, planner, department_name,
+                ownerships)
+            semaphore = asyncio.Semaphore(self.workers)
+            try:
+                with self.timer.span("batch_download"):
+                    formatted, dates = await asyncio.gather(
+                        self._values_batch_get_async(
+                            session, semaphore, spreadsheet_id,
+                            formatted_ranges, Reader.FORMATTED_PARAMS),
+                        self._values_batch_get_async(
+                            session, semaphore, spreadsheet_id,
+                            date_ranges, Reader.UNFORMATTED_PARAMS))
+            except gspread.exceptions.APIError as e:
+                # A cached worksheet that was renamed or deleted can't be
+                # requested, so its metadata is downloaded on next fetch
+                if cached and e.code == 400:
+                    self.metadata.invalidate(spreadsheet_id)
+                raise
+        department_name, batch_data = self._split_batch(
+            formatted, dates, pending, planner, department_name, ownerships)
+        self.metadata.update(spreadsheet_id, department=department_name,
+                             ownerships={name: batch_data[name][0]
+                                         for name in pending
+                                         if name not in ownerships})
+
+        downloads = (batch_data[name] for name in pending)
+        return self._merge_downloads(
+            downloads, sheets_names=sheets_names, starts=starts,
+            resumed=resumed, old_marks=old_marks, old_rows=old_rows,
+            previous=previous,
+            columns=columns, department_name=department_name,
+            modified_time=modified_time, progress=progress)
+
+    @contextlib.asynccontextmanager
+    async def _open_session(self):
+        """
+        Helper method to use the shared session of this reader or open
+        a client that is closed after the fetch.
+        """
+        if self.session is not None:
+            yield self.session
+            return
+        async with AsyncReader.create_session(self.workers) as session:
+            yield session
+
+    def _auth_headers(self):
+        """
+        Helper method to get the authorization header of the shared
+        client credentials. Refreshes the access token if expired.
+        A client session without credentials sends no authorization.
+        The compressed response headers of the session are also sent.
+        """
+        session = self.client.http_client.session
+        headers = {key: session.headers[key]
+                   for key in ("Accept-Encoding", "User-Agent")
+                   if key in session.headers}
+        credentials = getattr(session, "credentials", None)
+        if credentials is None:
+            return headers
+        if not credentials.valid:
+            credentials.refresh(Request())
+        credentials.apply(headers)
+        return headers
+
+    async def _get_json(self, session, url, params):
+        """
+        Helper method to request a url through the shared rate limiter
+        and return its JSON response. Raises gspread APIError if the
+        response has an error status so it can be retried. The bytes
+        received before decompression are added to the timer.
+        """
+        self._check_cancelled()
+
+        async def request():
+            response = await session.get(url, params=params,
+                                         headers=self._headers)
+            self.timer.add_bytes(response.num_bytes_downloaded)
+            if response.is_error:
+                raise gspread.exceptions.APIError(response)
+            return response.json()
+
+        return await self.timer.call_async(self.limiter, request)
+
+    async def _get_modified_time_async(self, session, spreadsheet_id):
+        """
+        Helper method to get the modifiedTime of the spreadsheet from the
+        Drive file metadata. Returns None if it can't be retrieved.
+        """
+        try:
+            metadata = await self._get_json(
+                session, f"{self.drive_url}/{spreadsheet_id}",
+                {"fields": "modifiedTime", "supportsAllDrives": "true"})
+        except gspread.exceptions.APIError:
+            return None
+        return metadata.get("modifiedTime")
+
+    async def _values_batch_get_async(self, session, semaphore,
+                                      spreadsheet_id, ranges, params):
+        """
+        Helper method to request the values:batchGet endpoint on chunks
+        of ranges at the same time, limited by the semaphore. Returns
+        the list of values of each range in the same order.
+        """
+        url = f"{self.sheets_url}/{spreadsheet_id}/values:batchGet"
+        chunks = [ranges[i:i + Reader.BATCH_RANGES]
+                  for i in range(0, len(ranges), Reader.BATCH_RANGES)]
+
+        async def batch_get(chunk):
+            async with semaphore:
+                return await self._get_json(
+                    session, url, {**params, "ranges": chunk,
+                                   "fields": Reader.BATCH_FIELDS})
+
+        responses = await asyncio.gather(*(batch_get(chunk)
+                                           for chunk in chunks))
+        values = []
+        for response in responses:
+            for value_range in response.get("valueRanges", []):
+                values.append(value_range.get("values", []))
+        return values
@@ -0,0 +1,241 @@
+# ---------------------------------------------------
+# blockwriter.py - BlockWriter Class
+# ---------------------------------------------------
+# A module that writes the final_data rows of a fetch
+# into the column blocks of a DataStore source while
+# the fetch is still running. The rows are grouped by
+# worksheet and each block is encoded and staged on
+# its own short transaction as soon as it is full, so
+# only one block of rows is kept in memory and the
+# write lock is never held during the requests of a
+# fetch. A refresh keeps the blocks of the first rows
+# of each of its worksheets from the previous source
+# and only stages the tail blocks after them. The
+# staged blocks are moved into the source on a single
+# transaction when committed, so the previous source
+# is kept as it was if the fetch fails or if the rows
+# are saved with another name.
+# ---------------------------------------------------
+
+import json
+import uuid
+from contextlib import contextmanager
+
+
+class BlockWriter:
+
+    def __init__(self, store, base=None):
+        """
+        BlockWriter writes the rows of a fetch on the source of the
+        store named on commit. The first rows of each worksheet can be
+        kept from the worksheet at the same position of the source
+        named base. The base is looked up on the first worksheet.
+        """
+        self.store = store
+        self.base = base
+        self.stage = uuid.uuid4().hex
+        self._connection = None
+        self._base_id = None
+        self._base_state = None
+        self._sheet = -1
+        self._block = 0
+        self._rows = []
+        # First block of each worksheet that is not kept from the base
+        self._kept = {}
+
+    def start_sheet(self, kept=0):
+        """
+        Starts the rows of the next worksheet after keeping its first
+        kept rows from the base source.
+        """
+        self._open()
+        self._flush()
+        self._sheet = self._sheet + 1
+        self._block, self._rows = self._keep(kept)
+        self._kept[self._sheet] = self._block
+
+    def write(self, row):
+        """
+        Adds a single row to the current worksheet and stages its block
+        when full. Rows written before any worksheet start the first.
+        """
+        if self._sheet < 0:
+            self.start_sheet()
+        self._rows.append(row)
+        if len(self._rows) >= self.store.BLOCK_ROWS:
+            self._flush()
+
+    def commit(self, name, fields):
+        """
+        Saves the staged rows and the fetch details of fields on the
+        source named name on a single transaction. Any other source with
+        the same name is replaced. Raises ValueError if the base source
+        was saved again by another fetch since its rows were kept.
+        """
+        try:
+            self._open()
+            self._flush()
+            values = self.store.source_values(name, fields)
+            with self._transaction() as connection:
+                self._check_base(connection)
+                if self._base_id is not None and name == self.base:
+                    source_id = self._base_id
+                    self._replace_blocks()
+                else:
+                    connection.execute("DELETE FROM sources WHERE name = ?",
+                                       (name,))
+                    source_id = connection.execute(
+                        f"INSERT INTO sources ({', '.join(values)}) "
+                        f"VALUES ({', '.join('?' * len(values))})",
+                        tuple(values.values())).lastrowid
+                    self._copy_kept_blocks(source_id)
+                # Move the staged blocks to their worksheet of the source
+                connection.execute(
+                    "INSERT INTO blocks SELECT ?, sheet, block, field, "
+                    "encoding, dictionary, rows, data FROM staged_blocks "
+                    "WHERE stage = ?", (source_id, self.stage))
+                connection.execute("DELETE FROM staged_blocks WHERE "
+                                   "stage = ?", (self.stage,))
+                connection.execute(
+                    f"UPDATE sources SET "
+                    f"{', '.join(column + ' = ?' for column in values)} "
+                    "WHERE id = ?", (*values.values(), source_id))
+                connection.execute(
+                    "INSERT OR REPLACE INTO states VALUES (?, ?, ?)",
+                    (source_id, fields.get("modified_time"),
+                     json.dumps(fields.get("watermarks"))))
+        except BaseException:
+            self.rollback()
+            raise
+        self._close()
+
+    def rollback(self):
+        """ Drops the staged rows, the sources are left as they were. """
+        if self._connection is not None:
+            try:
+                with self._transaction() as connection:
+                    connection.execute("DELETE FROM staged_blocks WHERE "
+                                       "stage = ?", (self.stage,))
+            finally:
+                self._close()
+
+    def _open(self):
+        """
+        Helper method to open the connection on the first call and find
+        the base source and its state, which is checked again on commit.
+        """
+        if self._connection is not None:
+            return
+        self._connection = self.store.open_connection()
+        # The transactions are controlled by this writer
+        self._connection.isolation_level = None
+        if self.base is not None:
+            row = self._connection.execute(
+                "SELECT s.id, t.modified_time, t.watermarks FROM sources s "
+                "LEFT JOIN states t ON t.source_id = s.id WHERE s.name = ?",
+                (self.base,)).fetchone()
+            if row:
+                self._base_id, self._base_state = row[0], row[1:]
+
+    @contextmanager
+    def _transaction(self):
+        """
+        Helper method to run a short write transaction on the connection
+        that is committed on exit or rolled back if an exception was
+        raised.
+        """
+        connection = self._connection
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    def _check_base(self, connection):
+        """
+        Helper method to raise ValueError if the base source of the kept
+        rows was removed or saved again since the fetch started.
+        """
+        if self._base_id is None:
+            return
+        row = connection.execute(
+            "SELECT t.modified_time, t.watermarks FROM sources s "
+            "LEFT JOIN states t ON t.source_id = s.id WHERE s.id = ? AND "
+            "s.name = ?", (self._base_id, self.base)).fetchone()
+        if row is None or row != self._base_state:
+            raise ValueError(f"Source {self.base} was changed while its "
+                             "rows were fetched.")
+
+    def _keep(self, kept):
+        """
+        Helper method to find the blocks of the first kept rows of the
+        current worksheet on the base source. Returns the number of the
+        first block to write and the kept rows of a partly kept block,
+        which are written again with the new rows.
+        """
+        if not kept:
+            return 0, []
+        if self._base_id is None:
+            raise ValueError(f"Source {self.base} has no rows to keep.")
+        total = 0
+        for block, rows in self._connection.execute(
+                "SELECT block, rows FROM blocks WHERE source_id = ? AND "
+                "sheet = ? AND field = 0 ORDER BY block",
+                (self._base_id, self._sheet)).fetchall():
+            if total + rows == kept:
+                return block + 1, []
+            if total + rows > kept:
+                columns = self._connection.execute(
+                    "SELECT encoding, dictionary, data FROM blocks WHERE "
+                    "source_id = ? AND sheet = ? AND block = ? ORDER BY "
+                    "field", (self._base_id, self._sheet, block)).fetchall()
+                return block, self.store.decode_block(columns)[:kept - total]
+            total = total + rows
+        raise ValueError(f"Source {self.base} has only {total} rows to "
+                         f"keep on worksheet {self._sheet}.")
+
+    def _flush(self):
+        """
+        Helper method to stage the rows of the current block on its own
+        transaction.
+        """
+        if not self._rows:
+            return
+        with self._transaction() as connection:
+            self.store.insert_block(connection, self.stage, self._sheet,
+                                    self._block, self._rows,
+                                    table="staged_blocks")
+        self._block = self._block + 1
+        self._rows = []
+
+    def _replace_blocks(self):
+        """
+        Helper method to remove the blocks of the base source that are
+        replaced by the staged blocks and the worksheets that are gone.
+        """
+        self._connection.executemany(
+            "DELETE FROM blocks WHERE source_id = ? AND sheet = ? AND "
+            "block >= ?", ((self._base_id, sheet, block)
+                           for sheet, block in self._kept.items()))
+        self._connection.execute(
+            "DELETE FROM blocks WHERE source_id = ? AND sheet > ?",
+            (self._base_id, self._sheet))
+
+    def _copy_kept_blocks(self, source_id):
+        """
+        Helper method to copy the kept blocks of the base source into
+        the new source of another name.
+        """
+        self._connection.executemany(
+            "INSERT INTO blocks SELECT ?, sheet, block, field, encoding, "
+            "dictionary, rows, data FROM blocks WHERE source_id = ? AND "
+            "sheet = ? AND block < ?",
+            ((source_id, self._base_id, sheet, block)
+             for sheet, block in self._kept.items() if block))
+
+    def _close(self):
+        """ Helper method to close the connection of the writer. """
+        self._connection.close()
+        self._connection = None
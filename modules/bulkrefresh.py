@@ -0,0 +1,138 @@
+# ---------------------------------------------------
+# bulkrefresh.py - BulkRefresher Class
+# ---------------------------------------------------
+# A module that refreshes many saved GSheet URLs in
+# one unattended pass. The urls are taken from the
+# URLS_DB of the gsheetlister, optionally filtered by
+# month and year, and put on a work queue that is
+# processed by a limited number of worker threads.
+# Every Reader shares the same rate limiter so the
+# whole pass still honours the API read quota. The
+# pass or a single url of it can be cancelled from
+# another thread.
+# ---------------------------------------------------
+
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from modules.reader import FetchCancelled, Reader
+from modules.rowsink import StoreRowSink
+
+
+class BulkRefresher:
+
+    # Status values reported for each url
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    UNCHANGED = "unchanged"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+    def __init__(self, *, urls_db, workers=2, month_num=None, year=None,
+                 on_status=None, on_progress=None):
+        """
+        BulkRefresher redownloads every url of the urls_db dictionary or
+        only the ones saved on the month_num and year if given. The
+        on_status callback receives the url, its status and a dictionary
+        of the fetch details or the error message. The details of the
+        running status have the reader of the url. The on_progress
+        callback receives the number of finished and total urls.
+        """
+        self.workers = max(1, workers)
+        self.on_status = on_status or (lambda url, status, details: None)
+        self.on_progress = on_progress or (lambda done, total: None)
+        self.store = Reader.data_store()
+        self.statuses = {}
+        self._lock = threading.Lock()
+        self._readers = {}
+        self._cancelled = set()
+        self._stopped = threading.Event()
+
+        # Select the urls to refresh based on the month and year filters
+        self.queue = {url: data for url, data in urls_db.items()
+                      if (not month_num or data["month_num"] == month_num)
+                      and (not year or data["year"] == year)}
+        for url in self.queue:
+            self.statuses[url] = self.QUEUED
+
+    def run(self):
+        """
+        Refreshes all the queued urls on the worker threads and waits
+        for them to finish. Returns the dictionary of url statuses.
+        """
+        total, done = len(self.queue), 0
+        self.on_progress(done, total)
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(self._refresh, url, data)
+                       for url, data in self.queue.items()]
+            for future in as_completed(futures):
+                future.result()
+                done = done + 1
+                self.on_progress(done, total)
+        return dict(self.statuses)
+
+    def cancel(self, url=None):
+        """
+        Cancels the refresh of the url or of every url if no url is
+        given. A running fetch stops before its next request and the
+        queued urls are not fetched.
+        """
+        with self._lock:
+            if url is None:
+                self._stopped.set()
+                readers = list(self._readers.values())
+            else:
+                self._cancelled.add(url)
+                readers = [self._readers[url]] if url in self._readers \
+                    else []
+        for reader in readers:
+            reader.cancel()
+
+    def _is_cancelled(self, url):
+        """ Helper method to check if the refresh of the url is cancelled. """
+        return self._stopped.is_set() or url in self._cancelled
+
+    def _refresh(self, url, url_data):
+        """
+        Helper method to redownload a single url using its previous
+        saved data and save the new data on the data store.
+        """
+        reader = Reader(url=url)
+        with self._lock:
+            if self._is_cancelled(url):
+                reader = None
+            else:
+                self._readers[url] = reader
+        if reader is None:
+            self._set_status(url, self.CANCELLED)
+            return
+        self._set_status(url, self.RUNNING, {"reader": reader})
+        previous = self.store.load(url_data["filename"])
+
+        details = {}
+        try:
+            result = reader.fetch_data(
+                sheet_identifier="*-", progress=lambda **kwargs: None,
+                completed=lambda **kwargs: details.update(kwargs),
+                batched=True, previous=previous,
+                sink=StoreRowSink(self.store))
+        except Exception as e:
+            result = e
+        finally:
+            with self._lock:
+                self._readers.pop(url, None)
+
+        if result is True:
+            status = self.UNCHANGED if reader.unchanged else self.DONE
+            self._set_status(url, status, details)
+        elif result is FetchCancelled:
+            self._set_status(url, self.CANCELLED)
+        else:
+            message = getattr(result, "__name__", None) or str(result)
+            self._set_status(url, self.FAILED, {"error": message})
+
+    def _set_status(self, url, status, details=None):
+        """ Helper method to save and report the status of a url. """
+        with self._lock:
+            self.statuses[url] = status
+        self.on_status(url, status, details or {})
@@ -0,0 +1,112 @@
+# ---------------------------------------------------
+# checkpoint.py - FetchCheckpoint Class
+# ---------------------------------------------------
+# A module that saves the processed worksheets of a
+# running fetch into a checkpoint file, so a fetch
+# that failed or was cancelled on a worksheet can be
+# resumed from that worksheet on the next retry.
+# The checkpoint is a JSON lines file in the
+# downloads/checkpoints folder, the first line has
+# the url and columns config and each next line has
+# the new rows, watermark and month of a worksheet.
+# The rows kept from the previous fetch are not
+# saved again, only their count, and are rebuilt from
+# the previous rows when the worksheet is loaded.
+# ---------------------------------------------------
+
+import hashlib
+import json
+import os
+from pathlib import Path
+
+
+class FetchCheckpoint:
+
+    def __init__(self, *, url, columns, checkpoint_dir):
+        """
+        FetchCheckpoint keeps the worksheets processed by the fetches
+        of the url. The saved worksheets are only loaded if they were
+        saved with the same columns config. Each worksheet also has the
+        modified time of the spreadsheet when it was downloaded.
+        """
+        self.url = url
+        self.columns = columns
+        self.checkpoint_dir = Path(checkpoint_dir)
+        key = hashlib.sha1(url.encode()).hexdigest()[:20]
+        self.path = self.checkpoint_dir / f"{key}.jsonl"
+        self.sheets = {}
+        self._started = False
+        self._load()
+
+    def save_sheet(self, sheet_name, *, rows, kept, ownership, watermark,
+                   month, modified_time, base):
+        """
+        Appends a processed worksheet to the checkpoint file. A saved
+        worksheet with the same name is replaced by the new one. The
+        rows are the rows after the first kept rows of the worksheet on
+        the previous fetch of the base modified time, which get the
+        ownership of the worksheet when rebuilt.
+        """
+        sheet = {"sheet": sheet_name, "rows": rows, "kept": kept,
+                 "ownership": ownership, "watermark": watermark,
+                 "month": month, "modified_time": modified_time,
+                 "base": base}
+        if not self._started:
+            self.checkpoint_dir.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "w") as outfile:
+                outfile.write(json.dumps({"url": self.url,
+                                          "columns": self.columns}) + "\n")
+            self._started = True
+        with open(self.path, "a") as outfile:
+            outfile.write(json.dumps(sheet) + "\n")
+        self.sheets[sheet_name] = sheet
+
+    def sheet_rows(self, sheet_name, previous_rows, base):
+        """
+        Returns every row of a saved worksheet, its kept rows taken from
+        the previous_rows of the worksheet on the previous fetch of the
+        base modified time. Returns None if the kept rows can't be
+        rebuilt from them.
+        """
+        sheet = self.sheets[sheet_name]
+        kept = sheet.get("kept", 0)
+        if not kept:
+            return sheet["rows"]
+        if sheet["base"] != base or previous_rows is None or \
+                len(previous_rows) < kept:
+            return None
+        ownership = sheet["ownership"]
+        return [ownership + row[3:] for row in previous_rows[:kept]] + \
+            sheet["rows"]
+
+    def clear(self):
+        """ Removes the checkpoint file after the fetch is completed. """
+        self.sheets = {}
+        self._started = False
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def _load(self):
+        """
+        Helper method to load the saved worksheets of the checkpoint
+        file. A last line that was not completely written is skipped.
+        """
+        if not self.path.exists():
+            return
+        with open(self.path, "r") as infile:
+            lines = infile.read().splitlines()
+        try:
+            header = json.loads(lines[0])
+        except (IndexError, json.JSONDecodeError):
+            return
+        if header.get("url") != self.url or \
+                header.get("columns") != self.columns:
+            return
+
+        self._started = True
+        for line in lines[1:]:
+            try:
+                sheet = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            self.sheets[sheet["sheet"]] = sheet
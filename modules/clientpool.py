@@ -0,0 +1,79 @@
+# ---------------------------------------------------
+# clientpool.py - ClientPool Class
+# ---------------------------------------------------
+# A module that keeps one authorized gspread client
+# for the whole application process. Every Reader
+# reuses its credentials, access token and the
+# keep-alive HTTP connections of its session instead
+# of reading the API key and authenticating again.
+# The access token is only refreshed by the session
+# when it is missing or expired. The session asks for
+# gzip compressed responses, which the Google APIs
+# only send if gzip is also on the user agent.
+# ---------------------------------------------------
+
+import threading
+import gspread
+from requests.adapters import HTTPAdapter
+
+
+class ClientPool:
+
+    # Number of keep-alive connections kept open per host
+    POOL_SIZE = 10
+    # User agent of the session, it must contain gzip to get compressed
+    # responses from the Google APIs
+    USER_AGENT = "timesheet-reader (gzip)"
+
+    # Class Variables of the shared client and its API key file state
+    _client = None
+    _key_state = None
+    _lock = threading.Lock()
+
+    @staticmethod
+    def get_client(filename):
+        """
+        Returns the shared gspread client authorized with the service
+        account key file. The client is only recreated when the key
+        file was changed. Raises FileNotFoundError if there is no key.
+        """
+        with ClientPool._lock:
+            stat = filename.stat()
+            key_state = (stat.st_mtime_ns, stat.st_size)
+            if ClientPool._client is None or \
+                    key_state != ClientPool._key_state:
+                ClientPool._client = ClientPool._create_client(filename)
+                ClientPool._key_state = key_state
+            return ClientPool._client
+
+    @staticmethod
+    def reset():
+        """ Closes the session of the shared client and removes it. """
+        with ClientPool._lock:
+            if ClientPool._client is not None:
+                ClientPool._client.http_client.session.close()
+            ClientPool._client = None
+            ClientPool._key_state = None
+
+    @staticmethod
+    def _create_client(filename):
+        """
+        Helper method to create the gspread client with a connection
+        pool big enough for the parallel downloads of the Reader.
+        """
+        client = gspread.service_account(
+            filename=filename, scopes=gspread.auth.READONLY_SCOPES)
+        adapter = HTTPAdapter(pool_connections=ClientPool.POOL_SIZE,
+                              pool_maxsize=ClientPool.POOL_SIZE)
+        client.http_client.session.mount("https://", adapter)
+        ClientPool.compress_responses(client.http_client.session)
+        return client
+
+    @staticmethod
+    def compress_responses(session):
+        """
+        Sets the headers of a requests session to receive the responses
+        gzip compressed. The session decompresses them transparently.
+        """
+        session.headers["Accept-Encoding"] = "gzip"
+        session.headers["User-Agent"] = ClientPool.USER_AGENT
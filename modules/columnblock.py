@@ -0,0 +1,182 @@
+# ---------------------------------------------------
+# columnblock.py - ColumnBlock Class
+# ---------------------------------------------------
+# A static module that encodes a block of values of
+# one final_data column into compressed bytes and
+# decodes them back. The department, account and
+# owner repeat on every row so they are dictionary
+# encoded. Dates are kept as day numbers, the start
+# and end times and the durations as minutes and the
+# processed counts as integers. A block with a value
+# that would not be decoded to the same string falls
+# back to the dictionary encoding, so decoding always
+# gives back the exact saved rows. The numbers are
+# always saved little endian, so a database can be
+# moved between machines.
+# No need to instantiate this class, just call the
+# encode and decode methods.
+# ---------------------------------------------------
+
+import json
+import sys
+import zlib
+from array import array
+from datetime import date
+from modules.timeparser import TimeParser
+
+
+class ColumnBlock:
+    """ Contains the encoders and decoders of the column blocks. """
+
+    # Encodings and the array type code of their values
+    DICT = "dict"
+    TEXT = "text"
+    DATE = "date"
+    TIME = "time"
+    DURATION = "duration"
+    NUMBER = "number"
+    TYPECODES = {DICT: "I", DATE: "i", TIME: "h", DURATION: "h",
+                 NUMBER: "q"}
+    # Stored number of an empty date, time and duration value
+    EMPTY = {DATE: 0, TIME: -1, DURATION: -1}
+    # zlib level, the higher levels only save a few bytes more
+    LEVEL = 6
+
+    # Precomputed H:MM AM/PM strings for every minute of a day
+    TIMES = [f"{(m // 60) % 12 or 12}:{m % 60:02d} "
+             f"{'AM' if m < 720 else 'PM'}" for m in range(24 * 60)]
+
+    @staticmethod
+    def encode(kind, values):
+        """
+        Encodes a list of string values with the encoding of kind.
+        Returns the used encoding, the JSON dictionary of a dict block
+        or None and the compressed data bytes.
+        """
+        if kind not in (ColumnBlock.DICT, ColumnBlock.TEXT):
+            numbers = ColumnBlock._encode_numbers(kind, values)
+            if numbers is not None:
+                return kind, None, ColumnBlock._compress(numbers)
+            kind = ColumnBlock.DICT
+
+        if kind == ColumnBlock.TEXT:
+            return kind, None, zlib.compress(json.dumps(values).encode(),
+                                             ColumnBlock.LEVEL)
+
+        codes, distinct = array(ColumnBlock.TYPECODES[kind]), {}
+        for value in values:
+            code = distinct.get(value)
+            if code is None:
+                code = distinct[value] = len(distinct)
+            codes.append(code)
+        return kind, json.dumps(list(distinct)), ColumnBlock._compress(codes)
+
+    @staticmethod
+    def decode(encoding, dictionary, data, kind=None):
+        """
+        Decodes the data of a block into its list of string values. If
+        the date, time, duration or number kind of the column is given
+        the values are returned as their day numbers, minutes and
+        integers with None for an empty or unknown value.
+        """
+        if encoding == ColumnBlock.TEXT:
+            values = json.loads(zlib.decompress(data))
+            return ColumnBlock._to_numbers(kind, values) if kind else values
+        numbers = array(ColumnBlock.TYPECODES[encoding])
+        numbers.frombytes(zlib.decompress(data))
+        if sys.byteorder == "big":
+            numbers.byteswap()
+
+        # Only the few distinct values of a block are converted
+        if encoding == ColumnBlock.DICT:
+            values = json.loads(dictionary)
+            if kind:
+                values = ColumnBlock._to_numbers(kind, values)
+            return list(map(values.__getitem__, numbers))
+        if kind:
+            empty = ColumnBlock.EMPTY.get(encoding)
+            return [None if number == empty else number
+                    for number in numbers]
+        formatted = {number: ColumnBlock._format(encoding, number)
+                     for number in set(numbers)}
+        return list(map(formatted.__getitem__, numbers))
+
+    @staticmethod
+    def _encode_numbers(kind, values):
+        """
+        Helper method to convert the values into the array of their
+        numbers. Returns None if a value can't be converted back to the
+        same string.
+        """
+        numbers, parsed = array(ColumnBlock.TYPECODES[kind]), {}
+        for value in values:
+            number = parsed.get(value)
+            if number is None:
+                number = ColumnBlock._parse(kind, value)
+                if number is None or \
+                        ColumnBlock._format(kind, number) != value:
+                    return None
+                parsed[value] = number
+            numbers.append(number)
+        return numbers
+
+    @staticmethod
+    def _to_numbers(kind, values):
+        """
+        Helper method to convert string values into their numbers of
+        kind, None for an empty or unknown value.
+        """
+        numbers = []
+        for value in values:
+            number = ColumnBlock._parse(kind, value)
+            if number == ColumnBlock.EMPTY.get(kind):
+                number = None
+            numbers.append(number)
+        return numbers
+
+    @staticmethod
+    def _parse(kind, value):
+        """
+        Helper method to convert a string value into its stored number
+        or None if it has a different format.
+        """
+        if value == "" and kind in ColumnBlock.EMPTY:
+            return ColumnBlock.EMPTY[kind]
+        try:
+            if kind == ColumnBlock.DATE:
+                return date.fromisoformat(value).toordinal()
+            if kind == ColumnBlock.TIME:
+                return TimeParser.minutes(value)
+            if kind == ColumnBlock.DURATION:
+                hours, minutes, seconds = value.split(":")
+                number = int(hours) * 60 + int(minutes)
+                return number if 0 <= number < 24 * 60 else None
+            number = int(value)
+            # The integer has to fit the 8 bytes of the array values
+            return number if -2 ** 63 <= number < 2 ** 63 else None
+        except (TypeError, ValueError):
+            return None
+
+    @staticmethod
+    def _format(kind, number):
+        """ Helper method to convert a stored number into its string. """
+        if number == ColumnBlock.EMPTY.get(kind):
+            return ""
+        if kind == ColumnBlock.DATE:
+            return date.fromordinal(number).isoformat()
+        if kind == ColumnBlock.TIME:
+            return ColumnBlock.TIMES[number]
+        if kind == ColumnBlock.DURATION:
+            return TimeParser.DURATIONS[number]
+        return str(number)
+
+    @staticmethod
+    def _compress(numbers):
+        """
+        Helper method to compress the little endian bytes of a numbers
+        array.
+        """
+        if sys.byteorder == "big":
+            numbers = array(numbers.typecode, numbers)
+            numbers.byteswap()
+        return zlib.compress(numbers.tobytes(), ColumnBlock.LEVEL)
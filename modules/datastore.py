@@ -0,0 +1,376 @@
+# ---------------------------------------------------
+# datastore.py - DataStore Class
+# ---------------------------------------------------
+# A module that keeps the downloaded data of every
+# GSheet URL on an embedded SQLite database instead
+# of one JSON file per url. The sources table is the
+# small header of each saved fetch with its url,
+# owner, month, year and timestamp. Its payload is
+# kept apart, the states table has the modified time
+# and watermarks used to refresh it and the blocks
+# table has its final_data rows, so list views never
+# read them. The rows of each worksheet are saved by
+# column in blocks encoded and compressed by
+# ColumnBlock, so a single column can be read without
+# the others and a refresh only replaces the last
+# blocks of each worksheet. The blocks of a running
+# fetch are staged apart from every source until it
+# is completed. Listing a month, loading
+# a single url and exporting every row are indexed
+# queries so no file has to be read and parsed as a
+# whole, and the loaded rows are only decoded when
+# read. A source is always replaced on a single short
+# transaction so a failed fetch never leaves half of
+# its rows saved.
+# ---------------------------------------------------
+
+import json
+import sqlite3
+import threading
+from contextlib import closing, contextmanager
+from itertools import groupby, islice
+from pathlib import Path
+from modules.blockwriter import BlockWriter
+from modules.columnblock import ColumnBlock
+from modules.storedrows import StoredRows
+
+
+class DataStore:
+
+    # Columns of the sources table besides its id, the columns of a
+    # final_data row and the ColumnBlock encoding of each one
+    SOURCE_COLUMNS = ("name", "url", "owner", "month", "month_num", "year",
+                      "timestamp")
+    ROW_COLUMNS = ("department", "account", "owner", "date", "task",
+                   "processed", "start_time", "end_time", "duration")
+    COLUMN_KINDS = (ColumnBlock.DICT, ColumnBlock.DICT, ColumnBlock.DICT,
+                    ColumnBlock.DATE, ColumnBlock.TEXT, ColumnBlock.NUMBER,
+                    ColumnBlock.TIME, ColumnBlock.TIME, ColumnBlock.DURATION)
+    # Rows of each block of a worksheet column, the smaller blocks of
+    # a refresh compress only a few bytes less
+    BLOCK_ROWS = 2048
+    # Seconds to wait for the write lock of another connection
+    TIMEOUT = 30
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS sources (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE,
+            url TEXT NOT NULL,
+            owner TEXT,
+            month TEXT,
+            month_num TEXT,
+            year TEXT,
+            timestamp TEXT
+        );
+        CREATE INDEX IF NOT EXISTS sources_url ON sources (url);
+        CREATE INDEX IF NOT EXISTS sources_month ON sources (month_num);
+        CREATE TABLE IF NOT EXISTS states (
+            source_id INTEGER PRIMARY KEY
+                REFERENCES sources (id) ON DELETE CASCADE,
+            modified_time TEXT,
+            watermarks TEXT
+        );
+        CREATE TABLE IF NOT EXISTS blocks (
+            source_id INTEGER NOT NULL
+                REFERENCES sources (id) ON DELETE CASCADE,
+            sheet INTEGER NOT NULL,
+            block INTEGER NOT NULL,
+            field INTEGER NOT NULL,
+            encoding TEXT NOT NULL,
+            dictionary TEXT,
+            rows INTEGER NOT NULL,
+            data BLOB NOT NULL,
+            PRIMARY KEY (source_id, sheet, block, field)
+        );
+        CREATE TABLE IF NOT EXISTS staged_blocks (
+            stage TEXT NOT NULL,
+            sheet INTEGER NOT NULL,
+            block INTEGER NOT NULL,
+            field INTEGER NOT NULL,
+            encoding TEXT NOT NULL,
+            dictionary TEXT,
+            rows INTEGER NOT NULL,
+            data BLOB NOT NULL,
+            PRIMARY KEY (stage, sheet, block, field)
+        );
+    """
+
+    # Class Variable for the process wide shared store
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, path):
+        """
+        DataStore saves the sources and rows of the fetches on the
+        SQLite database of the path and creates its tables if needed.
+        The staged blocks left by fetches of a closed app are removed.
+        Every call opens its own connection so the store can be used
+        from the download threads at the same time.
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(self.SCHEMA)
+            connection.execute("DELETE FROM staged_blocks")
+
+    @staticmethod
+    def get_shared(path):
+        """
+        Returns the process wide data store of the path. Creates it on
+        first call or if the path changed.
+        """
+        with DataStore._shared_lock:
+            shared = DataStore._shared
+            if shared is None or shared.path != Path(path):
+                shared = DataStore(path)
+                DataStore._shared = shared
+            return shared
+
+    def sources(self, month_num=None, newest=False):
+        """
+        Returns the details of the saved sources ordered by name, only
+        the ones of the month_num like 01-2024 if it is given. With
+        newest they are ordered from the latest month and year, then
+        from the last saved. The details have the same keys as the
+        completed kwargs of a fetch without the final_data and with the
+        name and year of the source.
+        """
+        query = f"SELECT {', '.join(self.SOURCE_COLUMNS)} FROM sources"
+        params = ()
+        if month_num:
+            query = query + " WHERE month_num = ?"
+            params = (month_num,)
+        order = "year DESC, month_num DESC, id DESC" if newest else "name"
+        with self._connect() as connection:
+            return [self._source(row) for row in
+                    connection.execute(f"{query} ORDER BY {order}", params)]
+
+    def get_source(self, name):
+        """ Returns the details of the named source or None if missing. """
+        with self._connect() as connection:
+            row = connection.execute(
+                f"SELECT {', '.join(self.SOURCE_COLUMNS)} FROM sources "
+                "WHERE name = ?", (name,)).fetchone()
+        return self._source(row) if row else None
+
+    def load(self, name):
+        """
+        Returns the details of the named source with its modified time,
+        watermarks and final_data rows the same as the saved JSON data
+        files, or None if missing. The final_data is a StoredRows that
+        only decodes the rows when they are read.
+        """
+        with self._connect() as connection:
+            row = connection.execute(
+                f"SELECT {', '.join('s.' + c for c in self.SOURCE_COLUMNS)}, "
+                "s.id, t.modified_time, t.watermarks FROM sources s "
+                "LEFT JOIN states t ON t.source_id = s.id "
+                "WHERE s.name = ?", (name,)).fetchone()
+            if row is None:
+                return None
+            blocks = connection.execute(
+                "SELECT sheet, block, rows FROM blocks WHERE source_id = ? "
+                "AND field = 0 ORDER BY sheet, block", (row[-3],)).fetchall()
+        source = self._source(row)
+        source["modified_time"] = row[-2]
+        if row[-1] and row[-1] != "null":
+            source["watermarks"] = json.loads(row[-1])
+        source["final_data"] = StoredRows(self, row[-3], blocks)
+        return source
+
+    def iter_rows(self, name=None):
+        """
+        Yields the final_data rows of the named source in order, or the
+        rows of every source ordered by the source name if no name is
+        given.
+        """
+        query = ("SELECT b.source_id, b.sheet, b.block, b.encoding, "
+                 "b.dictionary, b.data FROM blocks b "
+                 "JOIN sources s ON s.id = b.source_id")
+        params = ()
+        if name is not None:
+            query = query + " WHERE s.name = ?"
+            params = (name,)
+        with self._connect() as connection:
+            # Each block has a row of every column ordered by field
+            blocks = connection.execute(
+                query + " ORDER BY s.name, b.sheet, b.block, b.field", params)
+            for _, columns in groupby(blocks, key=lambda row: row[:3]):
+                yield from self.decode_block(column[3:]
+                                             for column in columns)
+
+    def read_blocks(self, source_id, keys):
+        """
+        Yields the decoded rows of each block of the source_id on the
+        list of worksheet and block number keys.
+        """
+        with self._connect() as connection:
+            for sheet, block in keys:
+                yield self.decode_block(connection.execute(
+                    "SELECT encoding, dictionary, data FROM blocks WHERE "
+                    "source_id = ? AND sheet = ? AND block = ? ORDER BY "
+                    "field", (source_id, sheet, block)))
+
+    def iter_column(self, name, column, typed=False):
+        """
+        Yields the values of a single column of the named source in
+        order without reading the other columns. With typed the date,
+        time, duration and processed values are yielded as day numbers,
+        minutes and integers with None for empty values so they can be
+        aggregated.
+        """
+        field = self.ROW_COLUMNS.index(column)
+        kind = self.COLUMN_KINDS[field]
+        if not typed or kind in (ColumnBlock.DICT, ColumnBlock.TEXT):
+            kind = None
+        with self._connect() as connection:
+            for row in connection.execute(
+                    "SELECT b.encoding, b.dictionary, b.data FROM blocks b "
+                    "JOIN sources s ON s.id = b.source_id "
+                    "WHERE s.name = ? AND b.field = ? "
+                    "ORDER BY b.sheet, b.block",
+                    (name, field)):
+                yield from ColumnBlock.decode(*row, kind=kind)
+
+    def save(self, name, fields, rows):
+        """
+        Replaces the named source with the fetch details of fields and
+        its list of rows on a single transaction. The rows are split
+        into the worksheets of the watermarks if they have its rows.
+        """
+        writer = self.writer()
+        try:
+            counts, rows = self._sheet_counts(fields, rows), iter(rows)
+            for sheet_rows in counts:
+                writer.start_sheet()
+                for row in islice(rows, sheet_rows):
+                    writer.write(row)
+            for row in rows:
+                writer.write(row)
+        except BaseException:
+            writer.rollback()
+            raise
+        writer.commit(name, fields)
+
+    def writer(self, base=None):
+        """
+        Returns a BlockWriter to write the rows of a fetch while it is
+        running, keeping the first rows of the worksheets of the source
+        named base.
+        """
+        return BlockWriter(self, base)
+
+    def touch(self, name, timestamp):
+        """
+        Updates only the timestamp of the named source, used when its
+        spreadsheet did not change since it was saved.
+        """
+        with self._connect() as connection:
+            connection.execute("UPDATE sources SET timestamp = ? "
+                               "WHERE name = ?", (timestamp, name))
+
+    def delete(self, name):
+        """ Removes the named source and its rows. """
+        with self._connect() as connection:
+            connection.execute("DELETE FROM sources WHERE name = ?", (name,))
+
+    def import_json(self, data_dir):
+        """
+        Saves the JSON data files of the data folder that are not yet on
+        the store, then renames each file with an .imported suffix so it
+        is only imported once. Returns the number of imported files.
+        """
+        data_dir, count = Path(data_dir), 0
+        if not data_dir.exists():
+            return count
+        for path_name in data_dir.glob("*.json"):
+            if path_name.name.startswith("recents"):
+                continue
+            try:
+                with open(path_name, "r") as infile:
+                    data = json.loads(infile.read())
+            except (OSError, json.JSONDecodeError):
+                continue
+            if self.get_source(path_name.name) is None:
+                self.save(path_name.name, data, data["final_data"])
+                count = count + 1
+            path_name.rename(path_name.with_name(path_name.name +
+                                                 ".imported"))
+        return count
+
+    def open_connection(self):
+        """ Returns a new connection to the database of the store. """
+        connection = sqlite3.connect(self.path, timeout=self.TIMEOUT)
+        # WAL mode only needs a sync on checkpoints to stay consistent
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute("PRAGMA foreign_keys=ON")
+        return connection
+
+    @staticmethod
+    def source_values(name, fields):
+        """
+        Returns the sources table values of the named source with the
+        fetch details of fields.
+        """
+        month_num = fields.get("month_num") or ""
+        return {"name": name, "url": fields["url"],
+                "owner": fields.get("owner"),
+                "month": fields.get("month"), "month_num": month_num,
+                "year": month_num.split("-")[-1] or None,
+                "timestamp": fields.get("timestamp")}
+
+    @staticmethod
+    def insert_block(connection, source_id, sheet, block, rows,
+                     table="blocks"):
+        """
+        Encodes the rows into a block of every column of the worksheet
+        of the source and inserts them on the connection. The blocks of
+        a running fetch are inserted on the staged_blocks table with
+        its stage as the source_id.
+        """
+        columns = []
+        for field, values in enumerate(zip(*rows)):
+            encoding, dictionary, data = ColumnBlock.encode(
+                DataStore.COLUMN_KINDS[field], list(values))
+            columns.append((source_id, sheet, block, field, encoding,
+                            dictionary, len(rows), data))
+        connection.executemany(
+            f"INSERT INTO {table} VALUES (?, ?, ?, ?, ?, ?, ?, ?)", columns)
+
+    @staticmethod
+    def decode_block(columns):
+        """
+        Returns the rows of a block from the encoding, dictionary and
+        data of each of its columns ordered by field.
+        """
+        return [list(row) for row in
+                zip(*(ColumnBlock.decode(*column) for column in columns))]
+
+    @contextmanager
+    def _connect(self):
+        """
+        Helper method to open a connection that commits on exit or
+        rolls back if an exception was raised, then closes it.
+        """
+        with closing(self.open_connection()) as connection:
+            with connection:
+                yield connection
+
+    @staticmethod
+    def _sheet_counts(fields, rows):
+        """
+        Helper method to get the row count of each worksheet from the
+        watermarks of fields, or an empty list if they don't have the
+        same number of rows as the list of rows.
+        """
+        watermarks = fields.get("watermarks") or {}
+        counts = [mark.get("count", 0)
+                  for mark in watermarks.get("sheets", {}).values()]
+        return counts if sum(counts) == len(rows) else []
+
+    @staticmethod
+    def _source(row):
+        """ Helper method to convert a sources row into its details. """
+        return dict(zip(DataStore.SOURCE_COLUMNS, row))
@@ -0,0 +1,162 @@
+# ---------------------------------------------------
+# fetchtimer.py - FetchTimer Class
+# ---------------------------------------------------
+# A module that records where the time of a single
+# fetch goes. Each stage of the Reader is timed as a
+# span and each worksheet has its own download and
+# parse times. API calls made through the timer are
+# counted with their received bytes and the seconds
+# spent waiting on the rate limiter and its retries.
+# The report is passed with the completed kwargs.
+# ---------------------------------------------------
+
+import threading
+import time
+from contextlib import contextmanager
+
+
+class FetchTimer:
+
+    # Thread local of the timer of the API call running on a thread
+    _local = threading.local()
+
+    def __init__(self):
+        """
+        FetchTimer is a thread safe recorder of the timing spans of a
+        fetch. Stage spans are the wall clock time of the fetch thread
+        and add up to its total. Worksheet spans may overlap when the
+        worksheets are downloaded on worker threads.
+        """
+        self._lock = threading.Lock()
+        self._started = time.perf_counter()
+        self._stopped = None
+        self.stages = {}
+        self.sheets = {}
+        self.api_calls = 0
+        self.bytes = 0
+        self.wait = 0.0
+
+    @contextmanager
+    def span(self, stage, sheet=None, total=True):
+        """
+        Times the block and adds it to the stage. If a sheet is given
+        the time is also added to the stage of that worksheet. Use
+        total=False for spans that run on worker threads.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start, sheet=sheet,
+                     total=total)
+
+    def add(self, stage, value, *, sheet=None, total=True):
+        """ Adds a time or a count to the stage and to its worksheet. """
+        with self._lock:
+            if total:
+                self.stages[stage] = self.stages.get(stage, 0) + value
+            if sheet is not None:
+                sheet_stages = self.sheets.setdefault(sheet, {})
+                sheet_stages[stage] = sheet_stages.get(stage, 0) + value
+
+    def call(self, limiter, func, *args, **kwargs):
+        """
+        Calls the API function through the rate limiter. Counts every
+        attempt and the bytes of its responses, and adds the time not
+        spent on the attempts to the wait of the limiter.
+        """
+        attempts = []
+
+        def attempt(*args, **kwargs):
+            start = time.perf_counter()
+            previous = getattr(FetchTimer._local, "timer", None)
+            FetchTimer._local.timer = self
+            try:
+                return func(*args, **kwargs)
+            finally:
+                FetchTimer._local.timer = previous
+                attempts.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        try:
+            return limiter.call(attempt, *args, **kwargs)
+        finally:
+            self._count(attempts, time.perf_counter() - start)
+
+    async def call_async(self, limiter, func, *args, **kwargs):
+        """
+        Async version of call for the coroutine API functions. The
+        bytes of the responses are added by the caller using add_bytes.
+        """
+        attempts = []
+
+        async def attempt(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                attempts.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        try:
+            return await limiter.call_async(attempt, *args, **kwargs)
+        finally:
+            self._count(attempts, time.perf_counter() - start)
+
+    def add_bytes(self, size):
+        """ Adds the size of a received response body. """
+        with self._lock:
+            self.bytes += size
+
+    def stop(self):
+        """ Stops the total time of the fetch. """
+        self._stopped = time.perf_counter()
+
+    def report(self):
+        """
+        Returns the structured report of the fetch. Times are seconds
+        and other is the part of the total not covered by the stages.
+        """
+        stopped = self._stopped or time.perf_counter()
+        total = stopped - self._started
+        with self._lock:
+            stages = {stage: round(value, 4)
+                      for stage, value in self.stages.items()}
+            sheets = {sheet: {stage: round(value, 4)
+                              for stage, value in sheet_stages.items()}
+                      for sheet, sheet_stages in self.sheets.items()}
+            return {"total": round(total, 4), "stages": stages,
+                    "other": round(max(0, total - sum(self.stages.values())),
+                                   4),
+                    "api_calls": self.api_calls, "bytes": self.bytes,
+                    "wait": round(self.wait, 4), "sheets": sheets}
+
+    @staticmethod
+    def install(session):
+        """
+        Adds the response hook that counts the received bytes to a
+        requests session. Calling it again on the session does nothing.
+        """
+        hooks = session.hooks.setdefault("response", [])
+        if FetchTimer._record_response not in hooks:
+            hooks.append(FetchTimer._record_response)
+
+    @staticmethod
+    def _record_response(response, *args, **kwargs):
+        """
+        Response hook that adds the body size to the active timer. The
+        size is the bytes received before the body is decompressed.
+        """
+        timer = getattr(FetchTimer._local, "timer", None)
+        if timer:
+            content = response.content
+            try:
+                timer.add_bytes(response.raw.tell() or len(content))
+            except (AttributeError, OSError):
+                timer.add_bytes(len(content))
+
+    def _count(self, attempts, elapsed):
+        """ Helper method to count the attempts and the waits of a call. """
+        with self._lock:
+            self.api_calls += len(attempts)
+            self.wait += max(0, elapsed - sum(attempts))
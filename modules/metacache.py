@@ -0,0 +1,153 @@
+# ---------------------------------------------------
+# metacache.py - MetadataCache Class
+# ---------------------------------------------------
+# A module that keeps the metadata of the fetched
+# spreadsheets that almost never changes, like the
+# worksheet titles and ids, the department name on
+# the Instructions tab and the owner and account of
+# each worksheet. It is saved on a JSON file keyed by
+# the spreadsheet id so refreshes can skip the
+# requests of these values until the cached metadata
+# expires or is invalidated. Each entry has the Drive
+# modified time of the spreadsheet it was downloaded
+# from and is not used once the spreadsheet changed,
+# so a new worksheet or ownership is never missed.
+# ---------------------------------------------------
+
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+
+class MetadataCache:
+
+    # Default minutes the metadata of a spreadsheet is kept
+    DEFAULT_TTL = 360
+
+    # Class Variable for the process wide shared cache
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, path, *, ttl=DEFAULT_TTL):
+        """
+        MetadataCache is a thread safe store of spreadsheet metadata
+        saved on the JSON file of the path. Each spreadsheet entry
+        expires after ttl minutes from the download of its worksheet
+        list. A ttl of 0 disables the cache.
+        """
+        self.path = Path(path)
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = None
+        self._changed = False
+
+    @staticmethod
+    def get_shared(path, ttl=None):
+        """
+        Returns the process wide metadata cache of the path. Creates it
+        on first call or if the path changed and reconfigures its ttl
+        if a new one is given.
+        """
+        with MetadataCache._shared_lock:
+            shared = MetadataCache._shared
+            if shared is None or shared.path != Path(path):
+                shared = MetadataCache(path)
+                MetadataCache._shared = shared
+            if ttl is not None:
+                shared.ttl = ttl
+            return shared
+
+    def get(self, spreadsheet_id, modified_time):
+        """
+        Returns the cached metadata of the spreadsheet id or None if it
+        is not cached, has expired, was downloaded before the last
+        modified_time of the spreadsheet or the cache is disabled. It is
+        also None without a modified_time since it can't be checked. The
+        metadata has the sheets list of [title, sheet id] pairs, the
+        department name and the ownerships of each worksheet title.
+        """
+        if not self.ttl or modified_time is None:
+            return None
+        with self._lock:
+            entry = self._load().get(spreadsheet_id)
+            if not entry or time.time() - entry["saved"] > self.ttl * 60 \
+                    or entry.get("modified_time") != modified_time:
+                return None
+            return {"sheets": list(entry["sheets"]),
+                    "department": entry.get("department"),
+                    "ownerships": dict(entry.get("ownerships", {}))}
+
+    def update(self, spreadsheet_id, *, sheets=None, modified_time=None,
+               department=None, ownerships=None):
+        """
+        Updates the cached metadata of the spreadsheet id in memory.
+        A new sheets list starts a new entry with the current time and
+        the modified_time of the spreadsheet it was downloaded from.
+        Use save to write the changes into the JSON file.
+        """
+        if not self.ttl:
+            return
+        with self._lock:
+            entries = self._load()
+            if sheets is not None:
+                entries[spreadsheet_id] = {"saved": time.time(),
+                                           "modified_time": modified_time,
+                                           "sheets": sheets,
+                                           "ownerships": {}}
+            entry = entries.get(spreadsheet_id)
+            if entry is None:
+                return
+            if department is not None:
+                entry["department"] = department
+            if ownerships:
+                entry["ownerships"].update(ownerships)
+            self._changed = True
+
+    def invalidate(self, spreadsheet_id=None):
+        """
+        Removes the cached metadata of the spreadsheet id or of every
+        spreadsheet if no id is given, then saves the JSON file.
+        """
+        with self._lock:
+            entries = self._load()
+            if spreadsheet_id is None:
+                entries.clear()
+            else:
+                entries.pop(spreadsheet_id, None)
+            self._changed = True
+        self.save()
+
+    def save(self):
+        """
+        Writes the cached metadata into the JSON file if it changed.
+        The expired entries are not saved.
+        """
+        with self._lock:
+            if not self._changed:
+                return
+            now = time.time()
+            entries = {key: entry for key, entry in self._load().items()
+                       if now - entry["saved"] <= self.ttl * 60}
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            temp_path = self.path.with_suffix(".tmp")
+            with open(temp_path, "w") as outfile:
+                outfile.write(json.dumps(entries))
+            os.replace(temp_path, self.path)
+            self._changed = False
+
+    def _load(self):
+        """
+        Helper method to load the entries from the JSON file on first
+        use. A missing or unreadable file starts an empty cache.
+        """
+        if self._entries is None:
+            self._entries = {}
+            if self.path.exists():
+                try:
+                    with open(self.path, "r") as infile:
+                        self._entries = json.loads(infile.read())
+                except (OSError, json.JSONDecodeError):
+                    self._entries = {}
+        return self._entries
@@ -0,0 +1,100 @@
+# ---------------------------------------------------
+# parsepool.py - ParsePool Class
+# ---------------------------------------------------
+# A module that parses the downloaded worksheets on
+# a pool of worker processes. The date conversion,
+# time sanitizing, durations and row building of big
+# worksheets are CPU bound and would hold the GIL of
+# the thread that also downloads the next worksheets
+# and updates the UI. Small worksheets are parsed in
+# the calling thread since sending them to a worker
+# process costs more than parsing them.
+# ---------------------------------------------------
+
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+
+
+class ParsePool:
+
+    # Default worker processes, 0 parses in the calling thread
+    DEFAULT_WORKERS = 0
+    # Minimum rows of a worksheet to parse it on a worker process
+    MIN_ROWS = 5000
+
+    # Class Variable for the process wide shared pool
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, *, workers=DEFAULT_WORKERS, min_rows=MIN_ROWS):
+        """
+        ParsePool runs the parse jobs of at least min_rows rows on
+        workers processes. The processes are only started on the first
+        job that needs them. With 0 workers every job is run in the
+        calling thread.
+        """
+        self.workers = workers
+        self.min_rows = min_rows
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_shared(workers=None):
+        """
+        Returns the process wide parse pool. Creates it on first call
+        and recreates it if a different number of workers is given.
+        The jobs of the replaced pool are still finished.
+        """
+        with ParsePool._shared_lock:
+            shared = ParsePool._shared
+            if shared is None:
+                shared = ParsePool(workers=workers or 0)
+                ParsePool._shared = shared
+            elif workers is not None and workers != shared.workers:
+                shared.shutdown(cancel=False)
+                shared = ParsePool(workers=workers)
+                ParsePool._shared = shared
+            return shared
+
+    @property
+    def ahead(self):
+        """
+        Returns how many jobs to submit before waiting for the first
+        one so every worker process has a job while the next worksheet
+        is downloaded.
+        """
+        return self.workers + 1 if self.workers > 0 else 1
+
+    def submit(self, func, *args, rows, **kwargs):
+        """
+        Runs func with the arguments on a worker process if the job has
+        at least min_rows rows, otherwise runs it in this thread. Returns
+        a Future of the result in both cases. The func and its arguments
+        must be picklable, like a staticmethod with lists and dicts.
+        """
+        if self.workers > 0 and rows >= self.min_rows:
+            return self._get_executor().submit(func, *args, **kwargs)
+        future = Future()
+        try:
+            future.set_result(func(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def shutdown(self, cancel=True):
+        """
+        Stops the worker processes after their running jobs. The jobs
+        that did not start yet are cancelled, or also finished if cancel
+        is False. It does not wait for the jobs to finish.
+        """
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=cancel)
+            self._executor = None
+
+    def _get_executor(self):
+        """ Helper method to start the worker processes on first use. """
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            return self._executor
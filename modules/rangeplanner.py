@@ -0,0 +1,83 @@
+# ---------------------------------------------------
+# rangeplanner.py - RangePlanner Class
+# ---------------------------------------------------
+# A module that plans the smallest list of A1 ranges
+# to request from a worksheet based on the columns
+# configured on the settings of the application.
+# Adjacent columns are grouped into one range while
+# gaps between configured columns are not requested.
+# Rows are bounded by the worksheet row count if it
+# is known, otherwise the ranges are open ended.
+# ---------------------------------------------------
+
+
+class RangePlanner:
+
+    def __init__(self, *, date_col, data_cols):
+        """
+        RangePlanner groups the configured data column letters into
+        spans of adjacent columns. The date column is planned on its
+        own range since it is requested with unformatted values.
+        Column letters beyond Z like AA or BC are also supported.
+        """
+        self.date_col = date_col
+        self.spans = []
+
+        # Group the sorted unique column indexes into adjacent spans
+        indexes = sorted({self.column_index(col) for col in data_cols})
+        for index in indexes:
+            if self.spans and self.spans[-1][-1] == index - 1:
+                self.spans[-1].append(index)
+            else:
+                self.spans.append([index])
+
+    def date_range(self, first_row, last_row=None):
+        """
+        Returns the A1 range of the date column between the rows. If
+        last_row is None the range ends on the last row of the sheet.
+        """
+        last_row = self._last_row(first_row, last_row)
+        return f"{self.date_col}{first_row}:{self.date_col}{last_row}"
+
+    def data_ranges(self, first_row, last_row=None):
+        """ Returns the A1 ranges of each data column span. """
+        last_row = self._last_row(first_row, last_row)
+        ranges = []
+        for span in self.spans:
+            first_col = self.column_letter(span[0])
+            last_col = self.column_letter(span[-1])
+            ranges.append(f"{first_col}{first_row}:{last_col}{last_row}")
+        return ranges
+
+    def merge(self, values):
+        """
+        Merges the downloaded column values of each data range into
+        a dictionary of column letter to its column values.
+        """
+        merged = {}
+        for span, columns in zip(self.spans, values):
+            for index, column in zip(span, columns):
+                merged[self.column_letter(index)] = column
+        return merged
+
+    @staticmethod
+    def _last_row(first_row, last_row):
+        """ Helper method to get the last row number of a range. """
+        return "" if last_row is None else max(first_row, last_row)
+
+    @staticmethod
+    def column_index(letter):
+        """ Converts a column letter like A, Z or AA to its 1-based index. """
+        index = 0
+        for char in letter.upper():
+            index = index * 26 + ord(char) - ord("A") + 1
+        return index
+
+    @staticmethod
+    def column_letter(index):
+        """ Converts a 1-based column index to its column letter. """
+        letter = ""
+        while index > 0:
+            index, remainder = divmod(index - 1, 26)
+            letter = chr(ord("A") + remainder) + letter
+        return letter
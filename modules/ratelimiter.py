@@ -0,0 +1,191 @@
+# ---------------------------------------------------
+# ratelimiter.py - RateLimiter Class
+# ---------------------------------------------------
+# A module that contains a token bucket rate limiter
+# shared by every Reader of the application. Each
+# Sheets API request takes one token from a bucket
+# that refills based on the per-minute read quota.
+# Requests that fail with 429 or 5xx responses are
+# retried using exponential backoff with jitter and
+# honours the Retry-After header of the response.
+# ---------------------------------------------------
+
+import asyncio
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from gspread.exceptions import APIError
+
+
+class RateLimiter:
+
+    # Default Sheets API read requests per minute per user
+    DEFAULT_QUOTA = 60
+    # Retry configuration for the exponential backoff
+    MAX_RETRIES = 5
+    BASE_BACKOFF = 1
+    MAX_BACKOFF = 64
+    RETRY_CODES = (429, 500, 502, 503, 504)
+
+    # Class Variable for the process wide shared limiter
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, *, quota=DEFAULT_QUOTA, period=60,
+                 max_retries=MAX_RETRIES):
+        """
+        RateLimiter is a thread safe token bucket that allows at most
+        quota requests per period of seconds. It also counts the number
+        of requests, waits, total wait time and retries it performed.
+        """
+        self._lock = threading.Lock()
+        self.max_retries = max_retries
+        self.period = period
+        self.quota = quota
+        self._tokens = float(quota)
+        self._updated = time.monotonic()
+
+        # Counters that can be checked using the stats method
+        self.requests = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.retries = 0
+
+    @staticmethod
+    def get_shared(quota=None):
+        """
+        Returns the process wide rate limiter. Creates it on first
+        call and reconfigures its quota if a new one is given.
+        """
+        with RateLimiter._shared_lock:
+            if RateLimiter._shared is None:
+                RateLimiter._shared = RateLimiter(
+                    quota=quota or RateLimiter.DEFAULT_QUOTA)
+            elif quota and quota != RateLimiter._shared.quota:
+                RateLimiter._shared.configure(quota=quota)
+            return RateLimiter._shared
+
+    def configure(self, *, quota):
+        """ Changes the number of requests allowed per period. """
+        with self._lock:
+            self._refill()
+            self.quota = quota
+            self._tokens = min(self._tokens, float(quota))
+
+    def acquire(self):
+        """
+        Takes one token from the bucket. If the bucket is empty, the
+        token is reserved and this method sleeps until it is refilled.
+        """
+        delay = self._reserve()
+        if delay:
+            time.sleep(delay)
+
+    async def acquire_async(self):
+        """
+        Same as acquire but awaits the refill of the bucket so other
+        tasks of the event loop keep running while waiting.
+        """
+        delay = self._reserve()
+        if delay:
+            await asyncio.sleep(delay)
+
+    def call(self, func, *args, **kwargs):
+        """
+        Calls the given API function after acquiring a token. Retries
+        the call with backoff if the API returns a 429 or 5xx error.
+        """
+        attempt = 0
+        while True:
+            self.acquire()
+            try:
+                return func(*args, **kwargs)
+            except APIError as err:
+                delay = self._retry_delay(err, attempt)
+                if delay is None:
+                    raise
+                attempt += 1
+                time.sleep(delay)
+
+    async def call_async(self, func, *args, **kwargs):
+        """
+        Awaits the given async API function after acquiring a token.
+        Retries the call with backoff the same way as call.
+        """
+        attempt = 0
+        while True:
+            await self.acquire_async()
+            try:
+                return await func(*args, **kwargs)
+            except APIError as err:
+                delay = self._retry_delay(err, attempt)
+                if delay is None:
+                    raise
+                attempt += 1
+                await asyncio.sleep(delay)
+
+    def stats(self):
+        """ Returns a dictionary of the counters of this limiter. """
+        with self._lock:
+            return {"requests": self.requests, "waits": self.waits,
+                    "wait_time": round(self.wait_time, 3),
+                    "retries": self.retries}
+
+    def _reserve(self):
+        """
+        Helper method to take one token from the bucket. Returns the
+        seconds to wait until the reserved token is refilled.
+        """
+        with self._lock:
+            self._refill()
+            self._tokens -= 1
+            self.requests += 1
+            delay = 0
+            if self._tokens < 0:
+                delay = -self._tokens * self.period / self.quota
+                self.waits += 1
+                self.wait_time += delay
+        return delay
+
+    def _retry_delay(self, err, attempt):
+        """
+        Helper method to get the backoff delay of a failed call and
+        count the retry. Returns None if it should not be retried.
+        """
+        status = getattr(err.response, "status_code", err.code)
+        if status not in self.RETRY_CODES or attempt >= self.max_retries:
+            return None
+        retry_after = err.response.headers.get("Retry-After")
+        delay = self._backoff_delay(attempt, retry_after)
+        with self._lock:
+            self.retries += 1
+            self.wait_time += delay
+        return delay
+
+    def _refill(self):
+        """ Helper method to add the tokens earned since last update. """
+        now = time.monotonic()
+        earned = (now - self._updated) * self.quota / self.period
+        self._tokens = min(float(self.quota), self._tokens + earned)
+        self._updated = now
+
+    def _backoff_delay(self, attempt, retry_after):
+        """
+        Helper method to compute the exponential delay with jitter
+        of a retry. Uses the Retry-After header value if it is longer.
+        """
+        delay = min(self.MAX_BACKOFF, self.BASE_BACKOFF * 2 ** attempt)
+        delay = random.uniform(delay / 2, delay)
+        if retry_after:
+            try:
+                wait = float(retry_after)
+            except ValueError:
+                try:
+                    wait = (parsedate_to_datetime(retry_after) -
+                            datetime.now(timezone.utc)).total_seconds()
+                except (TypeError, ValueError):
+                    wait = 0
+            delay = max(delay, wait)
+        return delay
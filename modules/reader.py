@@ -13,15 +13,31 @@
 
 import gspread
 import csv
-import json
 import time
 import os
 import platform
 import subprocess
-from datetime import datetime, timedelta
+import threading
+from bisect import bisect_left
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from pathlib import Path
-from gspread.utils import Dimension, DateTimeOption, ValueRenderOption
+from gspread.urls import DRIVE_FILES_API_V3_URL
+from gspread.utils import (DateTimeOption, ValueRenderOption,
+                           absolute_range_name, extract_id_from_url)
 from controls.settingsmanager import SettingsManager
+from modules.checkpoint import FetchCheckpoint
+from modules.clientpool import ClientPool
+from modules.datastore import DataStore
+from modules.fetchtimer import FetchTimer
+from modules.metacache import MetadataCache
+from modules.parsepool import ParsePool
+from modules.rangeplanner import RangePlanner
+from modules.ratelimiter import RateLimiter
+from modules.rowstore import RowStore
+from modules.storedrows import StoredRows
+from modules.timeparser import TimeParser
 
 # WORKING SHEETS URL
 # "https://docs.google.com/spreadsheets/d/1xDew94vfttSPIZ39nA7G7V9kGs_76BI6g-URrsKHP_A/"
@@ -32,11 +48,46 @@ from controls.settingsmanager import SettingsManager
 # "https://docs.google.com/spreadsheets/d/1Rajey786y2rOpDzsclhnreexd4AMUdOjA6m68343S9Y/"
 # "https://docs.google.com/spreadsheets/d/1i2HylLwYeRIem-9pL8MqpW6S7W2MwHpNf-FYUBVgZNY/"
 
+class FetchError(Exception):
+
+    def __init__(self, result):
+        """
+        Exception raised by Reader.iter_rows when the spreadsheet can't
+        be read. It holds the result that fetch_data returns to its
+        caller, an exception class or the exception of the worksheet.
+        """
+        super().__init__(result)
+        self.result = result
+
+
+class FetchCancelled(Exception):
+    """ Result of fetch_data when the fetch was cancelled. """
+
+
 class Reader:
 
     # Configuration Path
     BASE_PATH = Path(__file__).resolve().parent.parent
     API_KEY = BASE_PATH / "config/apikey.json"
+    CHECKPOINT_DIR = BASE_PATH / "downloads/checkpoints"
+
+    # Maximum number of A1 ranges to request on a single batch get
+    BATCH_RANGES = 100
+    # Default number of worksheets to download at the same time
+    DEFAULT_WORKERS = 1
+    # Number of rows before the watermark to download again on refresh
+    OVERLAP_ROWS = 20
+    # Fields of the worksheets metadata saved on the metadata cache
+    SHEETS_FIELDS = "sheets.properties(sheetId,title,gridProperties.rowCount)"
+    # Query parameters of the formatted and the unformatted batch gets
+    FORMATTED_PARAMS = {"majorDimension": "COLUMNS"}
+    UNFORMATTED_PARAMS = {
+        "majorDimension": "COLUMNS",
+        "valueRenderOption": ValueRenderOption.unformatted,
+        "dateTimeRenderOption": DateTimeOption.serial_number}
+    # Fields of the values responses, the echoed ranges are not needed
+    VALUES_FIELDS = "values"
+    BATCH_FIELDS = "valueRanges(values)"
 
     def __init__(self, *, url):
         """
@@ -47,177 +98,896 @@ class Reader:
         """
         self.url = url
         self.timestamp = None
+        self.result = None
+        self.unchanged = False
+        self.limiter = RateLimiter.get_shared()
+        self.metadata = self.metadata_cache()
+        self.workers = Reader.DEFAULT_WORKERS
+        self.timer = FetchTimer()
+        self.checkpoint = None
+        self._cancelled = threading.Event()
+        # Saved source of the previous rows kept as they are on a refresh
+        # and the position of each of its worksheets
+        self._base_name = None
+        self._base_positions = {}
 
-        # If API_KEY is not found then specify the client to None
-        # Return the FileNotFound Error on call of fetch_data.
+        # Use the shared client of the process to reuse its auth token
+        # and connections. If API_KEY is not found then specify the client
+        # to None. Return the FileNotFound Error on call of fetch_data.
         try:
-            self.client = gspread.service_account(
-                filename=Reader.API_KEY,
-                scopes=gspread.auth.READONLY_SCOPES)
+            self.client = ClientPool.get_client(Reader.API_KEY)
         except FileNotFoundError:
             self.client = None
 
-    def fetch_data(self, *, sheet_identifier, progress, completed):
+    def fetch_data(self, *, sheet_identifier, progress, completed,
+                   batched=False, previous=None, sink=None):
         """
         Fetch all the required data based on the application configuration
-        and save it first on the dictionary variable.
+        and save it first on the dictionary variable. The rows are taken
+        from iter_rows and kept on a compact RowStore as final_data. Use
+        final_data.to_list() to get the rows as a list of lists.
+        If a sink is given, each row is written to it instead of keeping
+        all of them in the final_data. The saved filename is then passed
+        to completed instead of the final_data. The sink only updates the
+        timestamp of an unchanged spreadsheet and keeps the previous rows
+        of a refresh that are not downloaded again as they are saved.
+        The timings kwarg has the FetchTimer report of the fetch stages.
+        Each processed worksheet is saved on a checkpoint, so if the
+        fetch fails a retry resumes from the worksheet that failed.
         """
-        # Check first if client is valid
-        if not self.client:
-            return gspread.exceptions.APIError
+        sheets = self._iter_sheets(sheet_identifier=sheet_identifier,
+                                   progress=progress, batched=batched,
+                                   previous=previous,
+                                   skip_unchanged=sink is not None)
+        return self._store_rows(sheets, progress=progress,
+                                completed=completed, sink=sink)
 
-        # Get the gsheet from the url
-        progress(left="Opening Sheet from URL...", value=0)
+    def cancel(self):
+        """
+        Cancels the running fetch from another thread. The fetch stops
+        before its next API request or worksheet and fetch_data returns
+        FetchCancelled. A sink of the cancelled fetch is discarded.
+        """
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        """ Returns True if cancel was called on this reader. """
+        return self._cancelled.is_set()
+
+    def iter_rows(self, *, sheet_identifier, progress, batched=False,
+                  previous=None, skip_unchanged=False):
+        """
+        Generator that downloads the data based on the application
+        configuration and yields the final rows worksheet by worksheet.
+        After the last row, the url, owner, month and other details of
+        the fetch are saved on the result variable. Every API request
+        goes through the shared rate limiter instead of fixed sleeps.
+        If batched is True, all the worksheet ranges are downloaded in a
+        few values_batch_get requests instead of three requests per sheet.
+        The max_workers setting controls how many worksheets or batch
+        requests are downloaded at the same time.
+        If previous saved data of this url is given, only the rows after
+        the saved watermark of each worksheet are downloaded and merged
+        to the previous final_data rows. The download is skipped if the
+        spreadsheet modified time is the same as the previous fetch and
+        the previous rows are yielded instead, or no rows at all if
+        skip_unchanged is True.
+        The worksheets saved on the checkpoint of a failed fetch are not
+        downloaded again unless the spreadsheet was modified since then.
+        Every stage is timed on the timer variable.
+        Raises FetchError with the result that fetch_data returns if
+        the spreadsheet can't be read.
+        """
+        return self._flatten(self._iter_sheets(
+            sheet_identifier=sheet_identifier, progress=progress,
+            batched=batched, previous=previous,
+            skip_unchanged=skip_unchanged))
+
+    def _iter_sheets(self, *, sheet_identifier, progress, batched=False,
+                     previous=None, skip_unchanged=False):
+        """
+        Helper generator of iter_rows that yields the final rows of each
+        worksheet as the rows kept from the previous saved rows and the
+        new rows. The kept rows are a slice of the previous final_data
+        at the same position of the same worksheet that have the same
+        ownership, so a sink can keep them as they are saved.
+        """
+        self.result, self.unchanged, self.checkpoint = None, False, None
+        self._base_name, self._base_positions = None, {}
+        self.timer = FetchTimer()
+
+        # Check first if client is valid and the url has a spreadsheet id
+        if not self.client:
+            raise FetchError(gspread.exceptions.APIError)
         try:
-            gsheet = self.client.open_by_url(self.url)
-        except (gspread.exceptions.SpreadsheetNotFound,
-                gspread.exceptions.NoValidUrlKeyFound):
-            return gspread.exceptions.SpreadsheetNotFound
-        except PermissionError:
-            return gspread.exceptions.GSpreadException
+            spreadsheet_id = extract_id_from_url(self.url)
+        except gspread.exceptions.NoValidUrlKeyFound:
+            raise FetchError(gspread.exceptions.SpreadsheetNotFound)
+        FetchTimer.install(self.client.http_client.session)
 
-        # Get the settings saved configuration data
-        settings = SettingsManager.get_settings_data()
-        date_col = settings["required"][0]
-        start_col = settings["required"][1]
-        end_col = settings["required"][2]
-        task_col = settings["other_columns"][0]
-        proccessed_col = settings["other_columns"][1]
-        sorted_cols = [start_col[0], end_col[0],
-                       task_col[0], proccessed_col[0]]
-        sorted_cols.sort()
-        # Create a list of sorted columns to use later in merging data
-        min_col, max_col = sorted_cols[0], sorted_cols[-1]
-        col_range = [chr(i) for i in range(ord(min_col), ord(max_col) + 1)]
+        # Get the settings saved configuration data and the planner of
+        # the ranges to request on each worksheet
+        columns, planner = self._load_settings()
+        columns_key = list(columns.values())
+
+        # Check first the last modified time of the spreadsheet and skip
+        # the download if it did not change since the previous fetch
+        progress(left="Checking Sheet Changes...", value=0)
+        with self.timer.span("check_changes"):
+            modified_time = self._get_modified_time()
+        if self._is_unchanged(previous, modified_time, columns_key):
+            progress(left="Sheet Unchanged", center=previous["owner"],
+                     right="Download Skipped", value=1)
+            if not skip_unchanged:
+                with self.timer.span("store"):
+                    yield (), previous["final_data"]
+            self._set_unchanged_result(previous)
+            return
+
+        # Get the worksheets of the spreadsheet from the metadata cache
+        # if the spreadsheet did not change since they were cached. If
+        # not, download the worksheets with its row count to bound the
+        # rows of the ranges.
+        progress(left="Opening Sheet from URL...", value=0)
+        metadata = self.metadata.get(spreadsheet_id, modified_time)
+        cached, row_counts = metadata is not None, {}
+        if not cached:
+            with self.timer.span("open"):
+                sheets, row_counts = self._get_worksheets(spreadsheet_id)
+            self.metadata.update(spreadsheet_id, sheets=sheets,
+                                 modified_time=modified_time)
+            metadata = {"sheets": sheets, "department": None,
+                        "ownerships": {}}
 
         # Get the worksheets with only names starting with identifier
-        sheets_names = []
         progress(left="Filtering Worksheet Names...", value=0.05)
-        for ws in gsheet.worksheets():
-            if ws.title.startswith(sheet_identifier):
-                sheets_names.append(ws.title)
+        sheets_names = [title for title, sheet_id in metadata["sheets"]
+                        if title.startswith(sheet_identifier)]
+
+        # Get the watermarks of the previous fetch and the worksheets of
+        # the checkpoint. Only the pending worksheets are downloaded.
+        resumed, old_marks, old_rows, starts = self._plan_sheets(
+            previous, columns_key, sheets_names, modified_time)
+        pending = [name for name in sheets_names if name not in resumed]
 
-        # Get the department name on F2 cell (Should be in configuration)
+        # Get the department name on H2 cell of the Instructions and the
+        # ownership of each worksheet if they are not cached.
+        # On batched mode, download every worksheet ranges in one go.
         progress(left="Fetching Sheet Ownership...", value=0.1)
-        sheet_source = gsheet.worksheet("Instructions")
-        department_name = sheet_source.acell("H2").value
+        department_name = metadata["department"]
+        ownerships = metadata["ownerships"]
+        executor = None
+        try:
+            if batched:
+                with self.timer.span("batch_download"):
+                    department_name, batch_data = self._batch_download(
+                        spreadsheet_id, pending, starts, row_counts,
+                        planner, department_name, ownerships)
+            elif department_name is None:
+                with self.timer.span("ownership"):
+                    department_name = self._get_department(spreadsheet_id)
+            self.metadata.update(spreadsheet_id, department=department_name)
+
+            # If max_workers is more than 1, the worksheets are downloaded
+            # on a thread pool and its results are still processed in order.
+            if batched:
+                downloads = (batch_data[name] for name in pending)
+            elif self.workers > 1:
+                executor = ThreadPoolExecutor(max_workers=self.workers)
+                downloads = executor.map(
+                    lambda name: self._download_worksheet(
+                        spreadsheet_id, name, starts[name],
+                        row_counts.get(name), planner, ownerships.get(name)),
+                    pending)
+            else:
+                downloads = (self._download_worksheet(
+                    spreadsheet_id, name, starts[name], row_counts.get(name),
+                    planner, ownerships.get(name))
+                    for name in pending)
+
+            yield from self._merge_downloads(
+                downloads, sheets_names=sheets_names, starts=starts,
+                resumed=resumed, old_marks=old_marks, old_rows=old_rows,
+                previous=previous,
+                columns=columns, department_name=department_name,
+                modified_time=modified_time, progress=progress)
+        except gspread.exceptions.APIError as e:
+            # A cached worksheet that was renamed or deleted can't be
+            # requested, so its metadata is downloaded on the next fetch
+            if cached and e.code == 400:
+                self.metadata.invalidate(spreadsheet_id)
+            raise
+        finally:
+            if executor:
+                executor.shutdown(cancel_futures=True)
+
+    def _store_rows(self, sheets, *, progress, completed, sink):
+        """
+        Helper method to keep the rows of the worksheets on a RowStore
+        or write them to the sink, then call completed with the result
+        of the fetch. The sink only gets the count of the kept rows.
+        Returns True or the result of the FetchError if it failed.
+        """
+        final_data = RowStore()
+        try:
+            for kept, rows in sheets:
+                if sink:
+                    sink.start_sheet(len(kept), self._base_name)
+                    for row in rows:
+                        sink.write(row)
+                else:
+                    final_data.extend(kept)
+                    final_data.extend(rows)
+        except FetchError as e:
+            if sink:
+                sink.discard()
+            return e.result
+        except Exception:
+            if sink:
+                sink.discard()
+            raise
+        finally:
+            # Save the metadata downloaded even if the fetch failed
+            self.metadata.save()
+
+        # Call the completed callback method after all fetching are done.
+        # The timings are only passed to completed and are not saved.
+        kwargs = dict(self.result)
+        if sink:
+            filename = self.data_filename(kwargs["owner"],
+                                          kwargs["month_num"])
+            with self.timer.span("save"):
+                if self.unchanged:
+                    sink.touch(filename, kwargs)
+                else:
+                    sink.close(filename, kwargs)
+            kwargs["filename"] = filename
+        else:
+            kwargs["final_data"] = final_data
+        if self.checkpoint:
+            self.checkpoint.clear()
+        self.timer.stop()
+        kwargs["timings"] = self.timer.report()
+        if not self.unchanged:
+            progress(center=kwargs["owner"], right="Download Completed",
+                     value=1)
+        completed(**kwargs)
+        return True
+
+    def _load_settings(self):
+        """
+        Helper method to configure the shared rate limiter, metadata
+        cache, parse pool and the workers from the settings. Returns the
+        configured column letters by field name and the RangePlanner of
+        the columns.
+        """
+        # Use the shared rate limiter with the read quota per minute
+        settings = SettingsManager.get_settings_data()
+        self.limiter = RateLimiter.get_shared(settings.get("read_quota"))
+        self.metadata = self.metadata_cache(
+            settings.get("metadata_ttl", MetadataCache.DEFAULT_TTL))
+        self.workers = settings.get("max_workers", Reader.DEFAULT_WORKERS)
+        self.parse_pool = ParsePool.get_shared(
+            settings.get("parse_workers", ParsePool.DEFAULT_WORKERS))
+
+        # Get the column configuration from settings
+        columns = {"date": settings["required"][0][0],
+                   "start": settings["required"][1][0],
+                   "end": settings["required"][2][0],
+                   "task": settings["other_columns"][0][0],
+                   "processed": settings["other_columns"][1][0]}
+        planner = RangePlanner(date_col=columns["date"],
+                               data_cols=[columns["start"], columns["end"],
+                                          columns["task"],
+                                          columns["processed"]])
+        return columns, planner
+
+    @staticmethod
+    def _is_unchanged(previous, modified_time, columns_key):
+        """
+        Helper method to check if the previous fetch has the same
+        modified time and columns configuration as the spreadsheet.
+        """
+        return bool(previous and modified_time and
+                    previous.get("modified_time") == modified_time and
+                    previous.get("watermarks", {}).get("columns") ==
+                    columns_key)
+
+    def _set_unchanged_result(self, previous):
+        """
+        Helper method to save the details of the previous fetch as the
+        result of a skipped download with a new timestamp.
+        """
+        self.timestamp = datetime.now()
+        self.unchanged = True
+        self.result = {key: value for key, value in previous.items()
+                       if key not in ("final_data", "filename", "timings")}
+        self.result["timestamp"] = self.timestamp.strftime(
+            "%B %d, %Y - %I:%M %p")
+
+    def _plan_sheets(self, previous, columns_key, sheets_names,
+                     modified_time):
+        """
+        Helper method to open the checkpoint of this url and plan the
+        download of each worksheet. Checkpoint worksheets saved on the
+        same modified time are resumed without downloading them. The
+        other checkpoint worksheets replace the watermarks and rows of
+        the previous fetch, so only their new rows are downloaded.
+        A checkpoint worksheet whose kept rows can't be rebuilt from the
+        previous rows is downloaded again and dropped from the checkpoint.
+        Returns the resumed worksheets, the watermarks, the old rows and
+        the data row index where the download of each worksheet starts.
+        """
+        old_marks, old_rows = self._load_watermarks(previous, columns_key)
+        self._base_name, self._base_positions = self._load_positions(
+            previous, old_marks)
+        old_marks, old_rows = dict(old_marks), dict(old_rows)
+        self.checkpoint = FetchCheckpoint(url=self.url, columns=columns_key,
+                                          checkpoint_dir=Reader.CHECKPOINT_DIR)
+        base = (previous or {}).get("modified_time")
+        resumed = {}
+        for sheet_name in sheets_names:
+            if sheet_name not in self.checkpoint.sheets:
+                continue
+            rows = self.checkpoint.sheet_rows(
+                sheet_name, old_rows.get(sheet_name), base)
+            if rows is None:
+                del self.checkpoint.sheets[sheet_name]
+                continue
+            saved = self.checkpoint.sheets[sheet_name]
+            if modified_time and saved["modified_time"] == modified_time:
+                resumed[sheet_name] = {**saved, "rows": rows}
+            else:
+                old_marks[sheet_name] = saved["watermark"]
+                old_rows[sheet_name] = rows
+
+        # Worksheets without watermark starts at data row index 0
+        starts = {name: old_marks[name]["start"] if name in old_marks else 0
+                  for name in sheets_names}
+        return resumed, old_marks, old_rows, starts
+
+    def _merge_downloads(self, downloads, *, sheets_names, starts, resumed,
+                         old_marks, old_rows, previous, columns,
+                         department_name, modified_time, progress):
+        """
+        Generator that processes the downloads of each worksheet in the
+        order of sheets_names and yields the kept rows of the previous
+        fetch and its new final rows. The kept rows are updated with the
+        new ownership and yielded with the new rows if they can't be
+        kept as they are saved. The resumed worksheets are taken
+        from the checkpoint instead of the downloads and every processed
+        worksheet is saved to the checkpoint without the rows it kept
+        from the previous fetch. After the last row, the
+        details of the fetch are saved on the result variable.
+        The worksheets are parsed on the parse pool ahead of the one
+        being merged, so the parsing overlaps the next downloads.
+        """
         month_sheet, month_sheet_numeric = "", None
+        base = (previous or {}).get("modified_time")
+        if previous and old_marks:
+            month_sheet = previous.get("month", "")
+            month_sheet_numeric = previous.get("month_num")
 
         # Iterate over the sheet names and get the data columns
         # The configuration of columns should be on the app configuration
-        final_data = []
+        watermarks = {}
         cur_prog = 0.1
-        per_job_prog = (0.8 / len(sheets_names))
-
-        for sheet_name in sheets_names:
-            # Get the sheet and the ownership names
-            sheet = gsheet.worksheet(sheet_name)
-            ownerships = sheet.get(range_name="F1:F2",
-                                   major_dimension=Dimension.cols)
-            sheet_owner, account_name = ownerships[0]
-            time.sleep(1)
-
-            # Get the column config based from the structure of Excel
-            # Column E - Date and Time
-            # Column F - Task Name
-            # Column H - Processed
-            # Column I - Start Time
-            # Column J - End Time
+        per_job_prog = (0.8 / len(sheets_names)) if sheets_names else 0
+        parsed = self._parse_downloads(
+            downloads, [name for name in sheets_names if name not in resumed],
+            starts=starts, columns=columns, department_name=department_name)
+        for position, sheet_name in enumerate(sheets_names):
+            self._check_cancelled()
             cur_prog = cur_prog + per_job_prog
+            if sheet_name in resumed:
+                saved = resumed[sheet_name]
+                rows, watermark = saved["rows"], saved["watermark"]
+                progress(left="Resuming", center=rows[0][2] if rows else "",
+                         right="Sheet Data...", value=cur_prog)
+                watermarks[sheet_name] = watermark
+                self.timer.add("rows", len(rows), sheet=sheet_name,
+                               total=False)
+                with self.timer.span("store"):
+                    yield (), rows
+                if saved["month"]:
+                    month_sheet, month_sheet_numeric = saved["month"]
+                continue
+
+            ownership, parsing = next(parsed)
+            sheet_owner = ownership[2]
             progress(left="Downloading", center=sheet_owner,
                      right="Sheet Data...", value=cur_prog)
-            datedata = sheet.get(
-                range_name=f"{date_col[0]}:{date_col[0]}",
-                major_dimension=Dimension.cols,
-                date_time_render_option=DateTimeOption.serial_number,
-                value_render_option=ValueRenderOption.unformatted)
-            time.sleep(1)
-            # Get and merge the column letters with the data
-            data = sheet.get(range_name=f"{min_col}:{max_col}",
-                             major_dimension=Dimension.cols)
-            data_merged = dict(zip(col_range, data))
-            time.sleep(2)
-
-            # Select only the required columns and assign to each variable
-            # Also disregard the first 5 initial row of it's column
-            date_times = datedata[0][5:]
-            task_names = data_merged[task_col[0]][5:]
-            num_processed = data_merged[proccessed_col[0]][5:]
-            start_times = data_merged[start_col[0]][5:]
-            end_times = data_merged[end_col[0]][5:]
-            durations = []
-
-            # Format the times to datetime object
-            try:
-                for i, strdate in enumerate(date_times):
-                    if strdate:
-                        date = (datetime(1899, 12, 30) +
-                                timedelta(days=int(strdate)))
-                        date_times[i] = str(date.date())
-                        month_sheet = date.strftime("%B %Y")
-                        month_sheet_numeric = date.strftime("%m-%Y")
-                for i, stime in enumerate(start_times):
-                    start_times[i] = self._sanitize_time(stime)
-                for i, etime in enumerate(end_times):
-                    end_times[i] = self._sanitize_time(etime)
-                # Get the duration of difference in end times and start times
-                for st, et in zip(start_times, end_times):
-                    if st and et:
-                        start_time = datetime.strptime(st, "%I:%M %p")
-                        end_time = datetime.strptime(et, "%I:%M %p")
-                        duration_str = str(end_time - start_time)
-                        durations.append(duration_str.split("day, ")[-1])
-                    else:
-                        durations.append("")
-
-            except Exception as e:
+            with self.timer.span("parse", sheet_name):
+                final_rows = parsing.result()
+            if isinstance(final_rows, Exception):
                 progress(left="Download Failed", center=sheet_owner,
                          right="Sheet Data...", value=cur_prog)
-                return e
-
-            columns = [date_times, task_names, num_processed,
-                       start_times, end_times, durations]
-
-            for index in range(6, len(date_times)):
-                result = [department_name, account_name, sheet_owner]
-                for column in columns:
-                    try:
-                        result.append(column[index])
-                    except IndexError:
-                        result.append("")
-                # Don't append the 5th index which is the num_processed if empty
-                if result[5]:
-                    final_data.append(result)
+                raise FetchError(final_rows)
 
-        # Call the completed callback method after all fetching are done.
+            # Keep the previous rows before the overlap window of this
+            # worksheet. They stay as they are saved if they are on the
+            # same position and ownership, else its ownership names are
+            # updated and they are saved again with the new rows.
+            # Only the kept rows that are previous rows are not saved
+            # on the checkpoint, the others came from the checkpoint
+            rows, month_found, watermark = final_rows
+            watermark["ownership"] = ownership
+            saved = self.checkpoint.sheets.get(sheet_name)
+            kept_rows, kept = (), 0
+            if starts[sheet_name]:
+                old_mark = old_marks[sheet_name]
+                kept_rows = old_rows[sheet_name][
+                    :old_mark["count"] - old_mark["tail"]]
+                kept = len(kept_rows)
+                if saved or \
+                        self._base_positions.get(sheet_name) != position or \
+                        old_mark.get("ownership") != ownership:
+                    rows = [ownership + row[3:] for row in kept_rows] + rows
+                    kept_rows = ()
+            if saved:
+                kept = min(kept, saved.get("kept", 0))
+            watermark["count"] = len(kept_rows) + len(rows)
+            watermarks[sheet_name] = watermark
+            self.timer.add("rows", watermark["count"], sheet=sheet_name,
+                           total=False)
+
+            # Save the worksheet to the checkpoint before yielding its rows
+            # Keep the month of the checkpoint if no new date was found
+            if not month_found and saved:
+                month_found = saved["month"]
+            with self.timer.span("checkpoint"):
+                self.checkpoint.save_sheet(
+                    sheet_name, rows=rows[kept - len(kept_rows):],
+                    kept=kept, ownership=ownership, watermark=watermark,
+                    month=month_found, modified_time=modified_time,
+                    base=base)
+            with self.timer.span("store"):
+                yield kept_rows, rows
+            if month_found:
+                month_sheet, month_sheet_numeric = month_found
+
+        # Save the details of this fetch after all rows are yielded.
         self.timestamp = datetime.now()
-        kwargs = {"url": self.url, "owner": department_name,
-                  "month": month_sheet, "month_num": month_sheet_numeric,
-                  "timestamp": self.timestamp.strftime("%B %d, %Y - %I:%M %p"),
-                  "final_data": final_data}
-        progress(center=department_name, right="Download Completed", value=1)
-        completed(**kwargs)
-        return True
+        self.result = {
+            "url": self.url, "owner": department_name,
+            "month": month_sheet, "month_num": month_sheet_numeric,
+            "timestamp": self.timestamp.strftime("%B %d, %Y - %I:%M %p"),
+            "modified_time": modified_time,
+            "watermarks": {"columns": list(columns.values()),
+                           "sheets": watermarks}}
+
+    def _parse_downloads(self, downloads, sheets_names, *, starts, columns,
+                         department_name):
+        """
+        Helper generator that submits the downloads of the worksheets
+        to the parse pool and yields the ownership and the Future of the
+        parsed rows of each worksheet in the order of sheets_names. The
+        next downloads are submitted before yielding, up to the number
+        of jobs the parse pool takes ahead.
+        """
+        downloads = iter(downloads)
+        queue = deque()
+        try:
+            for sheet_name in sheets_names:
+                with self.timer.span("download"):
+                    ownerships, datedata, data = next(downloads)
+                sheet_owner, account_name = ownerships[0]
+                ownership = [department_name, account_name, sheet_owner]
+                queue.append((ownership, self.parse_pool.submit(
+                    Reader._process_worksheet, datedata, data,
+                    rows=len(datedata[0]) if datedata else 0,
+                    ownership=ownership, first_index=starts[sheet_name],
+                    task_col=columns["task"],
+                    proccessed_col=columns["processed"],
+                    start_col=columns["start"], end_col=columns["end"])))
+                if len(queue) >= self.parse_pool.ahead:
+                    yield queue.popleft()
+            while queue:
+                yield queue.popleft()
+        finally:
+            # Stop the parsing of the worksheets of a failed fetch
+            for ownership, parsing in queue:
+                parsing.cancel()
+
+    @staticmethod
+    def data_filename(owner, month_num):
+        """
+        Returns the filename of the saved data of a spreadsheet. It is
+        the name of its source on the data store.
+        """
+        owner_formatted = owner.lower().replace(" ", "-")
+        return f"{month_num}-{owner_formatted}.json"
 
     @staticmethod
-    def _sanitize_time(strtime):
-        """ Helper method to correct the format of datetime string. """
-        if len(strtime.split()) > 1:
-            timestr, ampm = strtime.split()
-            hour, minutes = timestr.split(":")[:2]
-            return f"{hour}:{minutes} {ampm}"
-        return ""
+    def data_store():
+        """ Returns the shared data store of the downloads data folder. """
+        return DataStore.get_shared(
+            Reader.BASE_PATH / "downloads/data/gsheets.db")
+
+    @staticmethod
+    def metadata_cache(ttl=None):
+        """ Returns the shared metadata cache of the downloads folder. """
+        return MetadataCache.get_shared(
+            Reader.BASE_PATH / "downloads/metadata.json", ttl)
+
+    @staticmethod
+    def invalidate_metadata(url):
+        """
+        Removes the cached metadata of the spreadsheet of the url so its
+        worksheets and ownership are downloaded again on the next fetch.
+        """
+        try:
+            spreadsheet_id = extract_id_from_url(url)
+        except gspread.exceptions.NoValidUrlKeyFound:
+            return
+        Reader.metadata_cache().invalidate(spreadsheet_id)
+
+    def _get_modified_time(self):
+        """
+        Helper method to get the modifiedTime of the spreadsheet from the
+        Drive file metadata. Returns None if it can't be retrieved.
+        """
+        # Only the modifiedTime field of the file metadata is requested
+        url = DRIVE_FILES_API_V3_URL + "/" + extract_id_from_url(self.url)
+        try:
+            response = self._call(self.client.http_client.request, "get", url,
+                                  params={"fields": "modifiedTime",
+                                          "supportsAllDrives": True})
+        except gspread.exceptions.GSpreadException:
+            return None
+        return response.json().get("modifiedTime")
+
+    def _get_worksheets(self, spreadsheet_id):
+        """
+        Helper method to download the title, id and row count of every
+        worksheet in a single request. Returns the list of [title, sheet
+        id] of the worksheets and the row count of each title.
+        """
+        try:
+            metadata = self._call(self.client.http_client.fetch_sheet_metadata,
+                                  spreadsheet_id,
+                                  params={"fields": Reader.SHEETS_FIELDS})
+        except gspread.exceptions.APIError as e:
+            if e.code == 404:
+                raise FetchError(gspread.exceptions.SpreadsheetNotFound)
+            if e.code == 403:
+                raise FetchError(gspread.exceptions.GSpreadException)
+            raise
+        return self._read_worksheets(metadata)
+
+    @staticmethod
+    def _read_worksheets(metadata):
+        """
+        Helper method to get the list of [title, sheet id] and the row
+        count of each title from the worksheets metadata response.
+        """
+        sheets, row_counts = [], {}
+        for sheet in metadata.get("sheets", []):
+            properties = sheet["properties"]
+            sheets.append([properties["title"], properties["sheetId"]])
+            row_counts[properties["title"]] = \
+                properties["gridProperties"]["rowCount"]
+        return sheets, row_counts
+
+    def _get_department(self, spreadsheet_id):
+        """ Helper method to download the department name on H2 cell. """
+        response = self._call(self.client.http_client.values_get,
+                              spreadsheet_id,
+                              absolute_range_name("Instructions", "H2"),
+                              params={"fields": Reader.VALUES_FIELDS})
+        values = response.get("values")
+        return values[0][0] if values else None
+
+    def _download_worksheet(self, spreadsheet_id, sheet_name, first_index,
+                            last_row, planner, ownerships=None):
+        """
+        Helper method to download the ownership, date and data columns
+        of a single worksheet starting from the first_index data row up
+        to the last_row or to the end of the worksheet if it is None.
+        The ownership is only downloaded if it is not given and is then
+        saved on the metadata cache.
+        It is safe to call from worker threads since every request
+        goes through the shared rate limiter.
+        """
+        # Get the column config based from the structure of Excel
+        # Column E - Date and Time
+        # Column F - Task Name
+        # Column H - Processed
+        # Column I - Start Time
+        # Column J - End Time
+        call = self._call
+        http_client = self.client.http_client
+        first_row = self._first_row(first_index)
+        with self.timer.span("download", sheet_name, total=False):
+            if ownerships is None:
+                ownerships = call(
+                    http_client.values_get, spreadsheet_id,
+                    absolute_range_name(sheet_name, "F1:F2"),
+                    params={**Reader.FORMATTED_PARAMS,
+                            "fields": Reader.VALUES_FIELDS}
+                    ).get("values", [])
+                self.metadata.update(spreadsheet_id,
+                                     ownerships={sheet_name: ownerships})
+            datedata = call(
+                http_client.values_get, spreadsheet_id,
+                absolute_range_name(sheet_name, planner.date_range(
+                    first_row, last_row)),
+                params={**Reader.UNFORMATTED_PARAMS,
+                        "fields": Reader.VALUES_FIELDS}).get("values", [])
+            data = self._values_batch_get(
+                spreadsheet_id,
+                [absolute_range_name(sheet_name, data_range)
+                 for data_range in planner.data_ranges(first_row, last_row)],
+                Reader.FORMATTED_PARAMS)
+        return ownerships, datedata, planner.merge(data)
+
+    @staticmethod
+    def _process_worksheet(datedata, data_merged, *, ownership, first_index,
+                           task_col, proccessed_col, start_col, end_col):
+        """
+        Helper method to select the configured columns of a downloaded
+        worksheet and build its final rows. Returns the rows, the month
+        found and the new watermark of the worksheet. Returns the
+        exception instead if the data of the worksheet can't be parsed.
+        It is a staticmethod so it can be run on the parse pool.
+        """
+        # Select only the required columns and assign to each variable
+        # The columns are downloaded without the first 5 initial rows
+        date_times = list(datedata[0]) if datedata else []
+        task_names = data_merged.get(task_col, [])
+        num_processed = data_merged.get(proccessed_col, [])
+        start_times = data_merged.get(start_col, [])
+        end_times = data_merged.get(end_col, [])
+
+        # Format the columns and build the final rows of this sheet
+        try:
+            rows, month_found, indexes = Reader._build_rows(
+                ownership=ownership, first_index=first_index,
+                date_times=date_times, task_names=task_names,
+                num_processed=num_processed, start_times=start_times,
+                end_times=end_times)
+        except Exception as e:
+            return e
+
+        # The next fetch starts on the overlap window before the last row
+        # but never before the start of this fetch. Tail is the number of
+        # rows that will be replaced by the next fetch.
+        length = first_index + len(date_times)
+        next_start = max(first_index, length - Reader.OVERLAP_ROWS, 6)
+        tail = len(indexes) - bisect_left(indexes, next_start)
+        watermark = {"rows": length, "start": next_start, "tail": tail}
+        return rows, month_found, watermark
+
+    def _call(self, func, *args, **kwargs):
+        """
+        Helper method to call an API function through the shared rate
+        limiter and count it on the timer of this fetch.
+        """
+        self._check_cancelled()
+        return self.timer.call(self.limiter, func, *args, **kwargs)
+
+    def _check_cancelled(self):
+        """ Helper method to stop the fetch if it was cancelled. """
+        if self._cancelled.is_set():
+            raise FetchError(FetchCancelled)
+
+    @staticmethod
+    def _first_row(first_index):
+        """
+        Helper method to convert a data row index to the sheet row number
+        of a range. Data row index 0 is the 6th row of the worksheet.
+        """
+        return first_index + 6
+
+    @staticmethod
+    def _flatten(sheets):
+        """
+        Helper generator to yield the kept and new rows of each worksheet
+        yielded by _iter_sheets as a single stream of rows.
+        """
+        for kept, rows in sheets:
+            yield from kept
+            yield from rows
+
+    @staticmethod
+    def _load_positions(previous, old_marks):
+        """
+        Helper method to get the name of the saved source of the previous
+        rows and the position of each of its worksheets, if its rows are
+        saved by worksheet in the order of its watermarks. Returns None
+        and an empty dict if its rows can't be kept as they are saved.
+        """
+        final_data = (previous or {}).get("final_data")
+        counts = [mark["count"] for mark in old_marks.values()]
+        if not isinstance(final_data, StoredRows) or not counts or \
+                final_data.sheets != {position: count for position, count
+                                      in enumerate(counts) if count}:
+            return None, {}
+        return previous["name"], {sheet_name: position for position,
+                                  sheet_name in enumerate(old_marks)}
+
+    @staticmethod
+    def _load_watermarks(previous, columns_key):
+        """
+        Helper method to get the worksheet watermarks and the previous
+        rows of each worksheet from the previous saved data. Returns
+        empty dicts if it has no usable watermarks.
+        """
+        watermarks = (previous or {}).get("watermarks")
+        if not watermarks or watermarks["columns"] != columns_key:
+            return {}, {}
+
+        # Split the previous final_data by the row count of each worksheet
+        old_marks = watermarks["sheets"]
+        final_data = previous["final_data"]
+        if sum(mark["count"] for mark in old_marks.values()) != \
+                len(final_data):
+            return {}, {}
+        old_rows, offset = {}, 0
+        for sheet_name, mark in old_marks.items():
+            old_rows[sheet_name] = final_data[offset:offset + mark["count"]]
+            offset = offset + mark["count"]
+        return old_marks, old_rows
+
+    def _batch_download(self, spreadsheet_id, sheets_names, starts,
+                        row_counts, planner, department_name=None,
+                        ownerships=None):
+        """
+        Helper method to download the Instructions H2 cell and the
+        ownership, date and data ranges of every worksheet using
+        values_batch_get. Formatted and unformatted ranges are split
+        into two kinds of requests and chunked by BATCH_RANGES.
+        The department name and the ownerships that are given are not
+        downloaded again and the downloaded ones are saved on the
+        metadata cache.
+        Returns the department name and a dict of sheet name to
+        (ownerships, datedata, data_merged) column values.
+        """
+        ownerships = ownerships or {}
+        formatted_ranges, date_ranges = self._batch_ranges(
+            sheets_names, starts, row_counts, planner, department_name,
+            ownerships)
+        formatted = self._values_batch_get(
+            spreadsheet_id, formatted_ranges, Reader.FORMATTED_PARAMS)
+        dates = self._values_batch_get(
+            spreadsheet_id, date_ranges, Reader.UNFORMATTED_PARAMS)
+        department_name, batch_data = self._split_batch(
+            formatted, dates, sheets_names, planner, department_name,
+            ownerships)
+        self.metadata.update(spreadsheet_id, ownerships={
+            name: batch_data[name][0] for name in sheets_names
+            if name not in ownerships})
+        return department_name, batch_data
+
+    def _batch_ranges(self, sheets_names, starts, row_counts, planner,
+                      department_name=None, ownerships=None):
+        """
+        Helper method to list the formatted ranges and the unformatted
+        date ranges to request on a batched download. The formatted
+        ranges start with the Instructions H2 cell, then the F1:F2
+        range and the data ranges of each worksheet. The H2 cell and
+        F1:F2 ranges are skipped if its values are already given.
+        A worksheet without row count has open ended ranges.
+        """
+        ownerships = ownerships or {}
+        formatted_ranges, date_ranges = [], []
+        if department_name is None:
+            formatted_ranges.append(absolute_range_name("Instructions", "H2"))
+        for sheet_name in sheets_names:
+            first_row = self._first_row(starts[sheet_name])
+            last_row = row_counts.get(sheet_name)
+            if sheet_name not in ownerships:
+                formatted_ranges.append(
+                    absolute_range_name(sheet_name, "F1:F2"))
+            for data_range in planner.data_ranges(first_row, last_row):
+                formatted_ranges.append(
+                    absolute_range_name(sheet_name, data_range))
+            date_ranges.append(absolute_range_name(
+                sheet_name, planner.date_range(first_row, last_row)))
+        return formatted_ranges, date_ranges
+
+    @staticmethod
+    def _split_batch(formatted, dates, sheets_names, planner,
+                     department_name=None, ownerships=None):
+        """
+        Helper method to split the values of the batched ranges into
+        the department name and the downloads of each worksheet. The
+        given department name and ownerships were not requested.
+        """
+        ownerships = ownerships or {}
+        values = iter(formatted)
+        if department_name is None:
+            department_cell = next(values)
+            department_name = department_cell[0][0] \
+                if department_cell else None
+        # Each worksheet has its F1:F2 range followed by its data ranges
+        batch_data = {}
+        for index, sheet_name in enumerate(sheets_names):
+            if sheet_name in ownerships:
+                sheet_ownerships = ownerships[sheet_name]
+            else:
+                sheet_ownerships = next(values)
+            data = [next(values) for _ in planner.spans]
+            batch_data[sheet_name] = (sheet_ownerships, dates[index],
+                                      planner.merge(data))
+        return department_name, batch_data
+
+    def _values_batch_get(self, spreadsheet_id, ranges, params):
+        """
+        Helper method to call values_batch_get on chunks of ranges and
+        return the list of values of each range in the same order.
+        """
+        chunks = [ranges[i:i + Reader.BATCH_RANGES]
+                  for i in range(0, len(ranges), Reader.BATCH_RANGES)]
+
+        def batch_get(chunk):
+            return self._call(self.client.http_client.values_batch_get,
+                              spreadsheet_id, chunk,
+                              params={**params,
+                                      "fields": Reader.BATCH_FIELDS})
+
+        # Request the chunks on a thread pool if there are many of them
+        if self.workers > 1 and len(chunks) > 1:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                responses = list(executor.map(batch_get, chunks))
+        else:
+            responses = [batch_get(chunk) for chunk in chunks]
+
+        values = []
+        for response in responses:
+            for value_range in response.get("valueRanges", []):
+                values.append(value_range.get("values", []))
+        return values
+
+    @staticmethod
+    def _build_rows(*, ownership, first_index, date_times, task_names,
+                    num_processed, start_times, end_times):
+        """
+        Helper method to format the downloaded columns of a worksheet
+        and merge them into the final data rows. The columns start at
+        the first_index data row. Returns the rows, the last (month,
+        month_num) found on the date column and the index of each row.
+        """
+        month_found = None
+
+        # Format the serial dates and times using the memoized parsers
+        for i, strdate in enumerate(date_times):
+            if strdate:
+                date_times[i], month_found = TimeParser.serial_date(strdate)
+        start_times = [TimeParser.sanitize_time(st) for st in start_times]
+        end_times = [TimeParser.sanitize_time(et) for et in end_times]
+        # Get the duration of difference in end times and start times
+        durations = [TimeParser.duration(st, et) if st and et else ""
+                     for st, et in zip(start_times, end_times)]
+
+        columns = [date_times, task_names, num_processed,
+                   start_times, end_times, durations]
+
+        rows, indexes = [], []
+        for index in range(max(6, first_index), first_index + len(date_times)):
+            result = list(ownership)
+            for column in columns:
+                try:
+                    result.append(column[index - first_index])
+                except IndexError:
+                    result.append("")
+            # Don't append the 5th index which is the num_processed if empty
+            if result[5]:
+                rows.append(result)
+                indexes.append(index)
+        return rows, month_found, indexes
 
     @staticmethod
     def generate_csv_report(progress):
         """
         Standalone method to generate a csv report based
-        on all the saved JSON from data folder
+        on all the saved data of the data store
         """
         # Create first the downloads folder
         path = Reader.BASE_PATH / "downloads"
-        data_path = path / "data"
         path.mkdir(exist_ok=True)
+        store = Reader.data_store()
 
         # Get the settings saved configuration data
         settings = SettingsManager.get_settings_data()
@@ -242,22 +1012,17 @@ class Reader:
         with open(filepath, 'w', newline='') as csvfile:
             csvwriter = csv.writer(csvfile)
             csvwriter.writerow(headers)
-            # Iterate the data folder and get the final_data key from
-            # each JSON file, also skip the recents.json
-            total_files = len(list(data_path.iterdir())) - 1
+            # Iterate the saved sources and write the rows of each one
+            sources = store.sources()
             progress_count = 0
-            per_file_prog = 0.9 / total_files
-            for path_name in data_path.iterdir():
-                if not path_name.name.startswith("recents"):
-                    with open(path_name, "r") as file:
-                        final_rows = json.loads(file.read())["final_data"]
-                        csvwriter.writerows(final_rows)
-                        progress_count = progress_count + per_file_prog
-                        progress.update_progress(
-                            left="Writing",
-                            center=path_name.name,
-                            right="CSV Data...", value=progress_count)
-                        time.sleep(1)
+            per_file_prog = 0.9 / len(sources) if sources else 0
+            for source in sources:
+                csvwriter.writerows(store.iter_rows(source["name"]))
+                progress_count = progress_count + per_file_prog
+                progress.update_progress(
+                    left="Writing", center=source["name"],
+                    right="CSV Data...", value=progress_count)
+                time.sleep(1)
             progress.update_progress(center="CSV REPORT",
                                      right="Generation Completed", value=1)
 
@@ -0,0 +1,68 @@
+# ---------------------------------------------------
+# rowsink.py - StoreRowSink Class
+# ---------------------------------------------------
+# A module that saves the rows yielded by a Reader on
+# the DataStore while the fetch is still running. The
+# rows of each worksheet are staged as column blocks
+# by a BlockWriter, so only a block of rows is kept
+# in memory. A refresh keeps the blocks of the
+# previous rows that were not downloaded again. The
+# staged blocks are saved with the fetch details when
+# the fetch is completed, so a failed fetch keeps the
+# previous saved rows of its url.
+# ---------------------------------------------------
+
+
+class StoreRowSink:
+
+    def __init__(self, store):
+        """
+        StoreRowSink writes the final_data rows of a fetch and saves
+        them on the source of the DataStore named by the filename given
+        on close, replacing its previous rows.
+        """
+        self.store = store
+        self._writer = None
+        self.count = 0
+
+    def start_sheet(self, kept=0, base=None):
+        """
+        Starts the rows of the next worksheet. Its first kept rows are
+        kept from the worksheet at the same position of the source
+        named base, which has to be the same on every worksheet.
+        """
+        self._get_writer(base).start_sheet(kept)
+        self.count = self.count + kept
+
+    def write(self, row):
+        """ Adds a single row to the final_data rows of the source. """
+        self._get_writer().write(row)
+        self.count = self.count + 1
+
+    def close(self, filename, fields):
+        """
+        Saves the written rows and the fetch details of fields on the
+        source named by the filename.
+        """
+        writer, self._writer = self._get_writer(), None
+        writer.commit(filename, fields)
+
+    def touch(self, filename, fields):
+        """
+        Updates only the timestamp of the source named by the filename
+        when its spreadsheet is unchanged, its rows are kept as they are.
+        """
+        self.discard()
+        self.store.touch(filename, fields["timestamp"])
+
+    def discard(self):
+        """ Drops the written rows of a failed fetch. """
+        if self._writer is not None:
+            self._writer.rollback()
+            self._writer = None
+
+    def _get_writer(self, base=None):
+        """ Helper method to get the writer of the running fetch. """
+        if self._writer is None:
+            self._writer = self.store.writer(base)
+        return self._writer
@@ -0,0 +1,101 @@
+# ---------------------------------------------------
+# rowstore.py - RowStore Class
+# ---------------------------------------------------
+# A module that contains a compact in-memory store
+# for the final_data rows of a fetch. Rows are kept
+# as column arrays where the repeated values like the
+# department, account, owner, dates, times and the
+# durations are dictionary encoded into integer codes.
+# Iterating the store gives back the same list rows
+# used by the JSON data files and the CSV report. A
+# slice of the store is another RowStore that shares
+# the distinct values, so only its codes are copied.
+# ---------------------------------------------------
+
+from array import array
+
+
+class RowStore:
+
+    # Number of fields of a final_data row and the index of the
+    # fields that are mostly unique and stored without encoding.
+    # [Department, Account, Name, Date, Task, Processed, Start, End,
+    # Duration]
+    WIDTH = 9
+    PLAIN_COLUMNS = (4,)
+
+    def __init__(self, rows=()):
+        """
+        RowStore keeps the rows on one array of integer codes per
+        column and a list of the distinct values of each column.
+        A repeated value is only stored once no matter how many
+        rows have it, so each row only costs a few bytes per field.
+        """
+        self._values = [[] for _ in range(self.WIDTH)]
+        self._codes = [{} for _ in range(self.WIDTH)]
+        self._columns = [[] if index in self.PLAIN_COLUMNS else array("I")
+                         for index in range(self.WIDTH)]
+        self.extend(rows)
+
+    def __len__(self):
+        return len(self._columns[0])
+
+    def __iter__(self):
+        """ Yields every row as a list in the final_data row format. """
+        columns = []
+        for index, column in enumerate(self._columns):
+            if index in self.PLAIN_COLUMNS:
+                columns.append(iter(column))
+            else:
+                columns.append(map(self._values[index].__getitem__, column))
+        for row in zip(*columns):
+            yield list(row)
+
+    def __getitem__(self, index):
+        """
+        Returns the row on the index as a list, or a RowStore of the
+        rows of a slice.
+        """
+        if isinstance(index, slice):
+            return self._slice(index)
+        row = []
+        for column, column_values in enumerate(self._values):
+            value = self._columns[column][index]
+            if column not in self.PLAIN_COLUMNS:
+                value = column_values[value]
+            row.append(value)
+        return row
+
+    def append(self, row):
+        """ Encodes and adds a single final_data row to the store. """
+        if len(row) != self.WIDTH:
+            raise ValueError(f"Row should have {self.WIDTH} fields.")
+        for index, value in enumerate(row):
+            if index in self.PLAIN_COLUMNS:
+                self._columns[index].append(value)
+                continue
+            codes = self._codes[index]
+            code = codes.get(value)
+            if code is None:
+                code = codes[value] = len(self._values[index])
+                self._values[index].append(value)
+            self._columns[index].append(code)
+
+    def extend(self, rows):
+        """ Encodes and adds all the rows to the store. """
+        for row in rows:
+            self.append(row)
+
+    def to_list(self):
+        """ Returns all the rows as a list of lists for JSON dumps. """
+        return list(self)
+
+    def _slice(self, index):
+        """
+        Helper method to make a RowStore of the rows of a slice. The
+        distinct values are shared since they are only ever appended.
+        """
+        rows = RowStore.__new__(RowStore)
+        rows._values, rows._codes = self._values, self._codes
+        rows._columns = [column[index] for column in self._columns]
+        return rows
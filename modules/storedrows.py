@@ -0,0 +1,83 @@
+# ---------------------------------------------------
+# storedrows.py - StoredRows Class
+# ---------------------------------------------------
+# A module that contains a read only sequence of the
+# final_data rows of a source saved on the DataStore.
+# Only the row count of each column block is read
+# when it is loaded, the blocks are decoded when the
+# rows are iterated or indexed. Slicing it gives a
+# view of the same blocks, so the rows of a single
+# worksheet or the rows kept by a refresh can be
+# taken from a big source without decoding the rest.
+# ---------------------------------------------------
+
+from bisect import bisect_right
+from collections.abc import Sequence
+
+
+class StoredRows(Sequence):
+
+    def __init__(self, store, source_id, blocks, start=0, stop=None):
+        """
+        StoredRows reads the rows of the source_id of the store. The
+        blocks are the worksheet, block number and row count of each
+        block in order. Only the rows from start to stop are shown.
+        """
+        self.store = store
+        self.source_id = source_id
+        self._blocks = blocks
+        self._offsets, total = [], 0
+        for sheet, block, rows in blocks:
+            self._offsets.append(total)
+            total = total + rows
+        self._start = start
+        self._stop = total if stop is None else stop
+
+    @property
+    def sheets(self):
+        """
+        Returns the row count of each saved worksheet of the source by
+        its position. The worksheets without rows are not saved.
+        """
+        counts = {}
+        for sheet, block, rows in self._blocks:
+            counts[sheet] = counts.get(sheet, 0) + rows
+        return counts
+
+    def __len__(self):
+        return self._stop - self._start
+
+    def __getitem__(self, index):
+        """
+        Returns a single row or a StoredRows view of a slice of rows.
+        A slice with a step is returned as a list.
+        """
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return list(self)[index]
+            return StoredRows(self.store, self.source_id, self._blocks,
+                              self._start + start,
+                              self._start + max(start, stop))
+        if index < 0:
+            index = index + len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("StoredRows index out of range")
+        return next(iter(self[index:index + 1]))
+
+    def __iter__(self):
+        """ Yields every row as a list, decoding one block at a time. """
+        if self._start >= self._stop:
+            return
+        first = bisect_right(self._offsets, self._start) - 1
+        last = bisect_right(self._offsets, self._stop - 1)
+        keys = [block[:2] for block in self._blocks[first:last]]
+        for offset, rows in zip(self._offsets[first:last],
+                                self.store.read_blocks(self.source_id,
+                                                       keys)):
+            yield from rows[max(self._start - offset, 0):
+                            self._stop - offset]
+
+    def to_list(self):
+        """ Returns every row on a list. """
+        return list(self)
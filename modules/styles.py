@@ -31,6 +31,13 @@ class Styles:
             CState.DISABLED: ft.colors.GREY_700
         }
     )
+    cancel_url_style = ft.ButtonStyle(
+        color={
+            CState.DEFAULT: ft.colors.GREY_400,
+            CState.HOVERED: ft.colors.ORANGE_400,
+            CState.DISABLED: ft.colors.GREY_700
+        }
+    )
 
     # ----------------------------
     #  MAIN WINDOW BUTTON STYLES
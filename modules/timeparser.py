@@ -0,0 +1,61 @@
+# ---------------------------------------------------
+# timeparser.py - TimeParser Class
+# ---------------------------------------------------
+# A static module that contains memoized parsers of
+# the time, serial date and duration values found on
+# the worksheet rows. A day only has 1440 minutes and
+# a month only has a few serial dates, so each value
+# is parsed once and reused by the next rows.
+# No need to instantiate this class, just call the
+# parser methods and pass the raw cell values.
+# ---------------------------------------------------
+
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+
+class TimeParser:
+    """ Contains memoized parsers for the worksheet cell values. """
+
+    # Base date of the spreadsheet serial date numbers
+    SERIAL_BASE = datetime(1899, 12, 30)
+    # Precomputed duration strings for every minute difference of a day
+    DURATIONS = [str(timedelta(minutes=m)) for m in range(24 * 60)]
+
+    @staticmethod
+    @lru_cache(maxsize=4096)
+    def sanitize_time(strtime):
+        """ Corrects the format of a time string to H:MM AM/PM. """
+        if len(strtime.split()) > 1:
+            timestr, ampm = strtime.split()
+            hour, minutes = timestr.split(":")[:2]
+            return f"{hour}:{minutes} {ampm}"
+        return ""
+
+    @staticmethod
+    @lru_cache(maxsize=4096)
+    def minutes(strtime):
+        """ Returns the minutes of the day of a H:MM AM/PM time string. """
+        time = datetime.strptime(strtime, "%I:%M %p")
+        return time.hour * 60 + time.minute
+
+    @staticmethod
+    def duration(start_time, end_time):
+        """
+        Returns the duration string between two H:MM AM/PM times. An end
+        time earlier than the start time is counted on the next day.
+        """
+        difference = (TimeParser.minutes(end_time) -
+                      TimeParser.minutes(start_time))
+        return TimeParser.DURATIONS[difference % len(TimeParser.DURATIONS)]
+
+    @staticmethod
+    @lru_cache(maxsize=4096)
+    def serial_date(serial):
+        """
+        Converts a serial date number to its date string. Returns it with
+        its month name and year and its numeric month and year strings.
+        """
+        date = TimeParser.SERIAL_BASE + timedelta(days=int(serial))
+        return (str(date.date()),
+                (date.strftime("%B %Y"), date.strftime("%m-%Y")))
@@ -0,0 +1,120 @@
+# ---------------------------------------------------
+# writebehind.py - WriteBehind Class
+# ---------------------------------------------------
+# A module that writes small files like the recents
+# list on a background thread so the UI callbacks
+# and the download threads never wait for the disk.
+# Repeated writes of the same file that are still
+# waiting are merged into the last one.
+# Each file is written into a temporary file that
+# replaces it only when completely written, so a
+# crash never leaves a half-written file. The waiting
+# writes are flushed when the app exits.
+# ---------------------------------------------------
+
+import atexit
+import os
+import threading
+from pathlib import Path
+
+
+class WriteBehind:
+
+    # Class Variable for the process wide shared writer
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self):
+        """
+        WriteBehind keeps the latest text of each file waiting to be
+        written and writes them on a single background thread that is
+        only started on the first write. The error of the last failed
+        write is kept on error.
+        """
+        self.error = None
+        self._pending = {}
+        self._writing = False
+        self._closed = False
+        self._thread = None
+        self._condition = threading.Condition()
+
+    @staticmethod
+    def get_shared():
+        """
+        Returns the process wide writer. Creates it on first call and
+        flushes it when the process exits.
+        """
+        with WriteBehind._shared_lock:
+            if WriteBehind._shared is None:
+                WriteBehind._shared = WriteBehind()
+                atexit.register(WriteBehind._shared.close)
+            return WriteBehind._shared
+
+    def write(self, path, text):
+        """
+        Queues the text to be written into the file of the path. It
+        replaces the text of a previous write of the same file that was
+        not written yet.
+        """
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("WriteBehind is already closed.")
+            self._pending[Path(path)] = text
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run,
+                                                name="WriteBehind",
+                                                daemon=True)
+                self._thread.start()
+            self._condition.notify_all()
+
+    def flush(self, timeout=None):
+        """
+        Waits until every queued write is done or the timeout seconds
+        passed. Returns True if nothing is left to write.
+        """
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: not self._pending and not self._writing, timeout)
+
+    def close(self):
+        """ Writes the queued files and stops the background thread. """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+
+    def _run(self):
+        """
+        Helper method of the background thread that writes the queued
+        files until the writer is closed and nothing is left to write.
+        """
+        while True:
+            with self._condition:
+                self._writing = False
+                self._condition.notify_all()
+                self._condition.wait_for(
+                    lambda: self._pending or self._closed)
+                if not self._pending:
+                    return
+                path, text = self._pending.popitem()
+                self._writing = True
+            try:
+                self._replace(path, text)
+            except OSError as e:
+                self.error = e
+
+    @staticmethod
+    def _replace(path, text):
+        """
+        Helper method to write the text into a temporary file and then
+        replace the file of the path with it.
+        """
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = path.with_name(path.name + ".tmp")
+        with open(temp_path, "w") as outfile:
+            outfile.write(text)
+            outfile.flush()
+            os.fsync(outfile.fileno())
+        os.replace(temp_path, path)
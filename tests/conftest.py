@@ -0,0 +1,68 @@
+# ---------------------------------------------------
+# conftest.py - Test Fixtures
+# ---------------------------------------------------
+# The shared pytest fixtures of the tests. Every test
+# runs on a temporary project folder with a copy of
+# the settings file, so the saved data, checkpoints
+# and metadata cache of the app are never touched.
+# The spreadsheets are served by the local
+# FakeSheetsServer of the benchmarks.
+# Run the tests from the project folder with:
+#   python -m pytest tests
+# ---------------------------------------------------
+
+import json
+from types import SimpleNamespace
+from unittest.mock import patch
+import pytest
+from controls.settingsmanager import SettingsManager
+from modules.reader import Reader
+
+# Spreadsheet id of the fake workbook served on the tests
+SPREADSHEET_ID = "fake"
+
+
+@pytest.fixture
+def project(tmp_path):
+    """
+    Runs the test on a temporary project folder. The settings file is
+    copied with a read quota the rate limiter won't reach and the
+    pauses of the CSV report are skipped. Yields the settings dict,
+    change it and call save_settings to write it.
+    """
+    settings = SettingsManager.get_settings_data()
+    settings["read_quota"] = 10 ** 6
+    settings_path = tmp_path / "settings.json"
+    settings_path.write_text(json.dumps(settings))
+    (tmp_path / "downloads/data").mkdir(parents=True)
+    with patch.object(Reader, "BASE_PATH", tmp_path), \
+            patch.object(Reader, "CHECKPOINT_DIR",
+                         tmp_path / "downloads/checkpoints"), \
+            patch.object(SettingsManager, "settings_path", settings_path), \
+            patch("modules.reader.time",
+                  SimpleNamespace(sleep=lambda seconds: None)):
+        yield settings
+
+
+def save_settings(settings):
+    """ Writes the settings of the project fixture into its file. """
+    SettingsManager.settings_path.write_text(json.dumps(settings))
+
+
+def fetch(reader, **kwargs):
+    """
+    Runs fetch_data of a Reader with the progress updates ignored and
+    returns its result and the kwargs passed to completed.
+    """
+    fetched = {}
+    result = reader.fetch_data(
+        sheet_identifier="*-", progress=lambda **progress: None,
+        completed=lambda **completed: fetched.update(completed), **kwargs)
+    return result, fetched
+
+
+def make_reader(server, spreadsheet_id=SPREADSHEET_ID):
+    """ Returns a Reader of a spreadsheet of the fake server. """
+    reader = Reader(url=server.url(spreadsheet_id))
+    reader.client = server.client()
+    return reader
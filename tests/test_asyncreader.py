@@ -0,0 +1,128 @@
+# ---------------------------------------------------
+# test_asyncreader.py - AsyncReader Tests
+# ---------------------------------------------------
+# Tests the AsyncReader against the Sheets and Drive
+# endpoints of the local FakeSheetsServer. Its rows
+# have to be the same as the batched Reader fetch,
+# the readers of many spreadsheets can share one
+# session and the rows are saved off the event loop.
+# ---------------------------------------------------
+
+import asyncio
+import threading
+from unittest.mock import patch
+from benchmarks.fakesheets import FakeSheetsServer
+from modules.asyncreader import AsyncReader
+from modules.datastore import DataStore
+from modules.reader import Reader
+from modules.rowsink import StoreRowSink
+from tests.conftest import SPREADSHEET_ID, fetch, make_reader
+
+
+def _make_async_reader(server, spreadsheet_id=SPREADSHEET_ID, session=None):
+    """ Helper function to make an AsyncReader of the fake server. """
+    reader = AsyncReader(url=server.url(spreadsheet_id),
+                         sheets_url=server.sheets_url,
+                         drive_url=server.drive_url, session=session)
+    reader.client = server.client()
+    return reader
+
+
+async def _fetch_async(reader, **kwargs):
+    """
+    Helper function to run fetch_data of an AsyncReader. Returns its
+    result and the kwargs passed to completed.
+    """
+    fetched = {}
+    result = await reader.fetch_data(
+        sheet_identifier="*-", progress=lambda **progress: None,
+        completed=lambda **completed: fetched.update(completed), **kwargs)
+    return result, fetched
+
+
+def test_rows_match_batched_reader(project):
+    workbook = FakeSheetsServer.make_workbook(sheets=4, rows=60)
+    with FakeSheetsServer(workbooks={SPREADSHEET_ID: workbook}) as server:
+        result, expected = fetch(make_reader(server), batched=True)
+        assert result is True
+        Reader.invalidate_metadata(server.url(SPREADSHEET_ID))
+
+        before = server.stats()["requests"]
+        result, fetched = asyncio.run(
+            _fetch_async(_make_async_reader(server)))
+        requests = server.stats()["requests"] - before
+
+    assert result is True
+    assert requests == 4
+    assert fetched["owner"] == expected["owner"]
+    assert fetched["final_data"].to_list() == \
+        expected["final_data"].to_list()
+
+
+def test_spreadsheets_share_session(project):
+    ids = [f"{SPREADSHEET_ID}{index}" for index in range(3)]
+    workbooks = {spreadsheet_id: FakeSheetsServer.make_workbook(
+        sheets=2, rows=30, department=f"Department {index}", seed=index)
+        for index, spreadsheet_id in enumerate(ids)}
+
+    async def fetch_all(server):
+        async with AsyncReader.create_session() as session:
+            results = await asyncio.gather(*(
+                _fetch_async(_make_async_reader(server, spreadsheet_id,
+                                                session=session))
+                for spreadsheet_id in ids))
+            # The shared session is left open for the next fetches
+            assert not session.is_closed
+        return results
+
+    with FakeSheetsServer(workbooks=workbooks) as server:
+        results = asyncio.run(fetch_all(server))
+
+    assert [result for result, fetched in results] == [True] * len(ids)
+    assert [fetched["owner"] for result, fetched in results] == \
+        [f"Department {index}" for index in range(len(ids))]
+
+
+def test_rows_are_stored_off_the_event_loop(project):
+    workbook = FakeSheetsServer.make_workbook(sheets=2, rows=30)
+    threads = []
+    store_rows = Reader._store_rows
+
+    def record_thread(self, *args, **kwargs):
+        threads.append(threading.current_thread())
+        return store_rows(self, *args, **kwargs)
+
+    with FakeSheetsServer(workbooks={SPREADSHEET_ID: workbook}) as server, \
+            patch.object(Reader, "_store_rows", record_thread):
+        result, fetched = asyncio.run(
+            _fetch_async(_make_async_reader(server)))
+
+    assert result is True
+    assert threads and threads[0] is not threading.main_thread()
+
+
+def test_unchanged_spreadsheet_only_updates_timestamp(project):
+    workbook = FakeSheetsServer.make_workbook(sheets=3, rows=40)
+    store = Reader.data_store()
+    with FakeSheetsServer(workbooks={SPREADSHEET_ID: workbook}) as server:
+        result, fetched = asyncio.run(_fetch_async(
+            _make_async_reader(server), sink=StoreRowSink(store)))
+        assert result is True
+        name = fetched["filename"]
+        saved = store.load(name)
+        store.touch(name, "Saved Before")
+
+        before = server.stats()["requests"]
+        with patch.object(DataStore, "writer") as writer:
+            reader = _make_async_reader(server)
+            result, fetched = asyncio.run(_fetch_async(
+                reader, previous=store.load(name), sink=StoreRowSink(store)))
+        requests = server.stats()["requests"] - before
+        writer.assert_not_called()
+
+    assert result is True
+    assert reader.unchanged
+    assert requests == 1
+    source = store.load(name)
+    assert source["timestamp"] == fetched["timestamp"] != "Saved Before"
+    assert source["final_data"].to_list() == saved["final_data"].to_list()
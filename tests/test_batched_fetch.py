@@ -0,0 +1,54 @@
+# ---------------------------------------------------
+# test_batched_fetch.py - Batched Fetch Tests
+# ---------------------------------------------------
+# Tests that the batched fetch downloads the same rows
+# as the fetch of one worksheet at a time using a
+# constant number of requests instead of three
+# requests per worksheet.
+# ---------------------------------------------------
+
+import pytest
+from benchmarks.fakesheets import FakeSheetsServer
+from modules.reader import Reader
+from tests.conftest import SPREADSHEET_ID, fetch, make_reader
+
+
+def _count_fetch(server, *, batched):
+    """
+    Helper function to fetch the fake spreadsheet without the metadata
+    cache. Returns its rows and the number of requests it made.
+    """
+    Reader.metadata_cache().invalidate()
+    before = server.stats()["requests"]
+    result, fetched = fetch(make_reader(server), batched=batched)
+    assert result is True
+    return fetched["final_data"].to_list(), \
+        server.stats()["requests"] - before
+
+
+@pytest.mark.parametrize("sheets", [1, 5, 20])
+def test_batched_fetch_requests(project, sheets):
+    workbook = FakeSheetsServer.make_workbook(sheets=sheets, rows=60)
+    with FakeSheetsServer(workbooks={SPREADSHEET_ID: workbook}) as server:
+        rows, per_sheet_requests = _count_fetch(server, batched=False)
+        batched_rows, batched_requests = _count_fetch(server, batched=True)
+
+    # The modified time, worksheets and H2 requests plus the F1:F2, date
+    # and data requests of every worksheet
+    assert per_sheet_requests == 3 + 3 * sheets
+    # The modified time, worksheets, formatted and date batch requests
+    assert batched_requests == 4
+    assert rows and batched_rows == rows
+
+
+def test_batched_fetch_chunks_ranges(project):
+    # Each worksheet has 3 formatted ranges, so 40 worksheets need two
+    # formatted batch requests of BATCH_RANGES ranges
+    workbook = FakeSheetsServer.make_workbook(sheets=40, rows=10)
+    with FakeSheetsServer(workbooks={SPREADSHEET_ID: workbook}) as server:
+        rows, per_sheet_requests = _count_fetch(server, batched=False)
+        batched_rows, batched_requests = _count_fetch(server, batched=True)
+
+    assert per_sheet_requests == 3 + 3 * 40
+    assert batched_requests == 5
+    assert batched_rows == rows
@@ -0,0 +1,132 @@
+# ---------------------------------------------------
+# test_change_detection.py - Change Detection Tests
+# ---------------------------------------------------
+# Tests that a refresh of a spreadsheet that was not
+# modified since its previous fetch only requests its
+# modified time from the Drive files endpoint of the
+# FakeSheetsServer and keeps the saved rows, and that
+# the cached metadata of a modified spreadsheet is
+# not used so its new worksheets are downloaded.
+# ---------------------------------------------------
+
+from unittest.mock import patch
+from benchmarks.fakesheets import FakeSheetsServer
+from modules.datastore import DataStore
+from modules.reader import Reader
+from modules.rowsink import StoreRowSink
+from tests.conftest import SPREADSHEET_ID, fetch, make_reader, \
+    save_settings
+
+
+def _fetch_saved(server, previous=None):
+    """
+    Helper function to fetch the fake spreadsheet into the data store.
+    Returns the reader, its completed kwargs, the progress updates and
+    the number of requests it made.
+    """
+    reader, fetched, updates = make_reader(server), {}, []
+    before = server.stats()["requests"]
+    result = reader.fetch_data(
+        sheet_identifier="*-", progress=lambda **kwargs: updates.append(
+            kwargs), completed=lambda **kwargs: fetched.update(kwargs),
+        batched=True, previous=previous,
+        sink=StoreRowSink(Reader.data_store()))
+    assert result is True
+    return reader, fetched, updates, server.stats()["requests"] - before
+
+
+def test_unchanged_spreadsheet_is_skipped(project):
+    workbook = FakeSheetsServer.make_workbook(sheets=3, rows=50)
+    with FakeSheetsServer(workbooks={SPREADSHEET_ID: workbook}) as server:
+        reader, fetched, updates, requests = _fetch_saved(server)
+        assert not reader.unchanged
+        store = Reader.data_store()
+        name = fetched["filename"]
+        saved = store.load(name)
+        store.touch(name, "Saved Before")
+
+        # Only the modified time is requested and the rows are not saved
+        # again, the source only gets the new timestamp
+        with patch.object(DataStore, "writer") as writer:
+            reader, fetched, updates, requests = _fetch_saved(
+                server, previous=store.load(name))
+        writer.assert_not_called()
+
+    assert reader.unchanged
+    assert requests == 1
+    assert any(update.get("left") == "Sheet Unchanged" and
+               update.get("right") == "Download Skipped"
+               for update in updates)
+    assert fetched["filename"] == name
+    assert fetched["modified_time"] == saved["modified_time"]
+    source = store.load(name)
+    assert source["timestamp"] == fetched["timestamp"] != "Saved Before"
+    assert source["final_data"].to_list() == saved["final_data"].to_list()
+
+
+def test_modified_spreadsheet_is_downloaded(project):
+    workbook = FakeSheetsServer.make_workbook(sheets=3, rows=50)
+    with FakeSheetsServer(workbooks={SPREADSHEET_ID: workbook}) as server:
+        reader, fetched, updates, requests = _fetch_saved(server)
+        store = Reader.data_store()
+        saved = store.load(fetched["filename"])
+
+        # A new modified time downloads the new rows of every worksheet
+        server.touch(SPREADSHEET_ID, rows=5)
+        reader, fetched, updates, requests = _fetch_saved(
+            server, previous=saved)
+
+    assert not reader.unchanged
+    assert requests > 1
+    assert fetched["modified_time"] != saved["modified_time"]
+    assert len(store.load(fetched["filename"])["final_data"]) > \
+        len(saved["final_data"])
+
+
+def test_unchanged_spreadsheet_returns_previous_rows(project):
+    workbook = FakeSheetsServer.make_workbook(sheets=2, rows=40)
+    with FakeSheetsServer(workbooks={SPREADSHEET_ID: workbook}) as server:
+        reader, fetched, updates, requests = _fetch_saved(server)
+        previous = Reader.data_store().load(fetched["filename"])
+
+        # Without a sink the previous rows are the final_data
+        reader, result = make_reader(server), {}
+        assert reader.fetch_data(
+            sheet_identifier="*-", progress=lambda **kwargs: None,
+            completed=lambda **kwargs: result.update(kwargs),
+            batched=True, previous=previous) is True
+
+    assert reader.unchanged
+    assert result["final_data"].to_list() == \
+        previous["final_data"].to_list()
+
+
+def test_new_worksheet_of_cached_spreadsheet_is_downloaded(project):
+    project["metadata_ttl"] = 360
+    save_settings(project)
+    workbook = FakeSheetsServer.make_workbook(sheets=2, rows=40)
+    with FakeSheetsServer(workbooks={SPREADSHEET_ID: workbook}) as server:
+        reader, fetched, updates, requests = _fetch_saved(server)
+        store = Reader.data_store()
+        saved = store.load(fetched["filename"])
+
+        # A tab added after its worksheets were cached changes the
+        # modified time of the spreadsheet
+        added = FakeSheetsServer.make_workbook(sheets=3, rows=40, seed=1)
+        workbook["sheets"]["*-003"] = added["sheets"]["*-003"]
+        server.touch(SPREADSHEET_ID)
+        reader, fetched, updates, requests = _fetch_saved(
+            server, previous=saved)
+        refreshed = store.load(fetched["filename"])
+
+        # The next refresh of the same modified time is skipped
+        reader, fetched, updates, requests = _fetch_saved(
+            server, previous=refreshed)
+        assert reader.unchanged
+        Reader.invalidate_metadata(server.url(SPREADSHEET_ID))
+        result, full = fetch(make_reader(server), batched=True)
+
+    assert "*-003" in refreshed["watermarks"]["sheets"]
+    assert any(row[2] == "Employee 1-2"
+               for row in refreshed["final_data"])
+    assert refreshed["final_data"].to_list() == full["final_data"].to_list()
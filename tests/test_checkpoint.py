@@ -0,0 +1,85 @@
+# ---------------------------------------------------
+# test_checkpoint.py - Fetch Checkpoint Tests
+# ---------------------------------------------------
+# Tests that an incremental fetch that is cancelled
+# only saves the newly downloaded rows of each done
+# worksheet on the checkpoint, and that the retry
+# rebuilds the kept rows from the previous fetch.
+# ---------------------------------------------------
+
+from benchmarks.fakesheets import FakeSheetsServer
+from modules.checkpoint import FetchCheckpoint
+from modules.reader import FetchCancelled, Reader
+from tests.conftest import SPREADSHEET_ID, fetch, make_reader
+
+
+def _fetch_cancelled(server, previous, sheets):
+    """
+    Helper function to fetch the fake spreadsheet and cancel it when
+    the download of the worksheet after the first sheets is shown, so
+    the first sheets and the one being merged are on the checkpoint.
+    """
+    reader, downloading = make_reader(server), []
+
+    def progress(**kwargs):
+        if kwargs.get("left") == "Downloading":
+            downloading.append(kwargs)
+            if len(downloading) > sheets:
+                reader.cancel()
+
+    result = reader.fetch_data(sheet_identifier="*-", progress=progress,
+                               completed=lambda **kwargs: None,
+                               batched=True, previous=previous)
+    return reader, result
+
+
+def test_checkpoint_keeps_only_new_rows(project):
+    workbook = FakeSheetsServer.make_workbook(sheets=4, rows=200)
+    with FakeSheetsServer(workbooks={SPREADSHEET_ID: workbook}) as server:
+        result, fetched = fetch(make_reader(server), batched=True)
+        previous = fetched
+
+        server.touch(SPREADSHEET_ID, rows=5)
+        reader, result = _fetch_cancelled(server, previous, sheets=2)
+        assert result is FetchCancelled
+
+        # The done worksheets only have their new rows and the watermark
+        checkpoint = FetchCheckpoint(url=reader.url,
+                                     columns=previous["watermarks"]["columns"],
+                                     checkpoint_dir=Reader.CHECKPOINT_DIR)
+        assert 0 < len(checkpoint.sheets) < 4
+        for sheet in checkpoint.sheets.values():
+            assert sheet["kept"] > 0
+            assert sheet["base"] == previous["modified_time"]
+            assert len(sheet["rows"]) == sheet["watermark"]["count"] - \
+                sheet["kept"]
+            assert len(sheet["rows"]) < 200
+
+        # The retry resumes the checkpoint worksheets with the same rows
+        # of a full fetch of the spreadsheet
+        result, resumed = fetch(make_reader(server), batched=True,
+                                previous=previous)
+        assert result is True
+        Reader.invalidate_metadata(reader.url)
+        result, full = fetch(make_reader(server), batched=True)
+
+    assert resumed["final_data"].to_list() == full["final_data"].to_list()
+
+
+def test_checkpoint_without_previous_is_downloaded(project):
+    workbook = FakeSheetsServer.make_workbook(sheets=3, rows=50)
+    with FakeSheetsServer(workbooks={SPREADSHEET_ID: workbook}) as server:
+        result, fetched = fetch(make_reader(server), batched=True)
+        previous = fetched
+        server.touch(SPREADSHEET_ID, rows=5)
+        reader, result = _fetch_cancelled(server, previous, sheets=1)
+        assert result is FetchCancelled
+
+        # The kept rows of the checkpoint can't be rebuilt without the
+        # previous rows, so every worksheet is downloaded again
+        result, retried = fetch(make_reader(server), batched=True)
+        assert result is True
+        Reader.invalidate_metadata(reader.url)
+        result, full = fetch(make_reader(server), batched=True)
+
+    assert retried["final_data"].to_list() == full["final_data"].to_list()
@@ -0,0 +1,78 @@
+# ---------------------------------------------------
+# test_columnblock.py - ColumnBlock Tests
+# ---------------------------------------------------
+# Tests that every column block decodes back to the
+# exact saved values, that a value that would not be
+# formatted back to the same string makes its block
+# fall back to the dictionary encoding and that the
+# numbers are saved little endian on every machine.
+# ---------------------------------------------------
+
+import sys
+import zlib
+from array import array
+from unittest.mock import patch
+import pytest
+from modules.columnblock import ColumnBlock
+
+
+@pytest.mark.parametrize("kind, values", [
+    (ColumnBlock.DICT, ["Department", "Department", "", "Other"]),
+    (ColumnBlock.TEXT, ["Task 1", "", "Tâsk \"2\"", "Task 1"]),
+    (ColumnBlock.DATE, ["2024-01-05", "", "2024-12-31", "2024-01-05"]),
+    (ColumnBlock.TIME, ["12:00 AM", "9:05 AM", "", "11:59 PM"]),
+    (ColumnBlock.DURATION, ["0:00:00", "1:30:00", "", "23:59:00"]),
+    (ColumnBlock.NUMBER, ["0", "15", "-3", str(2 ** 63 - 1)]),
+])
+def test_values_round_trip(kind, values):
+    encoding, dictionary, data = ColumnBlock.encode(kind, values)
+
+    assert encoding == kind
+    assert ColumnBlock.decode(encoding, dictionary, data) == values
+
+
+@pytest.mark.parametrize("kind, value", [
+    (ColumnBlock.TIME, "9:5 AM"),
+    (ColumnBlock.TIME, "09:05 AM"),
+    (ColumnBlock.DURATION, "01:00:00"),
+    (ColumnBlock.DURATION, "24:00:00"),
+    (ColumnBlock.DATE, "2024-1-5"),
+    (ColumnBlock.NUMBER, "007"),
+    (ColumnBlock.NUMBER, ""),
+    (ColumnBlock.NUMBER, str(2 ** 63)),
+    (ColumnBlock.NUMBER, str(10 ** 30)),
+])
+def test_unformatted_value_falls_back_to_dictionary(kind, value):
+    values = ["", value, value] if kind != ColumnBlock.NUMBER else \
+        ["1", value, value]
+    encoding, dictionary, data = ColumnBlock.encode(kind, values)
+
+    assert encoding == ColumnBlock.DICT
+    assert ColumnBlock.decode(encoding, dictionary, data) == values
+
+
+def test_typed_values_of_fallback_block():
+    encoding, dictionary, data = ColumnBlock.encode(
+        ColumnBlock.TIME, ["9:5 AM", "9:05 AM", ""])
+
+    assert encoding == ColumnBlock.DICT
+    assert ColumnBlock.decode(encoding, dictionary, data,
+                              kind=ColumnBlock.TIME) == [545, 545, None]
+
+
+def test_numbers_are_saved_little_endian():
+    values = ["1:30:00", "", "23:59:00"]
+    encoding, dictionary, data = ColumnBlock.encode(
+        ColumnBlock.DURATION, values)
+    numbers = array("h", [90, -1, 1439])
+    if sys.byteorder == "big":
+        numbers.byteswap()
+    assert zlib.decompress(data) == numbers.tobytes()
+
+    # The other byte order swaps the numbers on encode and decode
+    other = "big" if sys.byteorder == "little" else "little"
+    with patch.object(sys, "byteorder", other):
+        swapped = ColumnBlock.encode(ColumnBlock.DURATION, values)[2]
+        assert ColumnBlock.decode(encoding, dictionary, swapped) == values
+    numbers.byteswap()
+    assert zlib.decompress(swapped) == numbers.tobytes()
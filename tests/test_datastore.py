@@ -0,0 +1,230 @@
+# ---------------------------------------------------
+# test_datastore.py - DataStore Tests
+# ---------------------------------------------------
+# Tests that a refresh of a saved spreadsheet keeps
+# the column blocks of its previous rows and only
+# writes the tail blocks of each worksheet, that the
+# previous source is kept when the rows are saved
+# with another name or the fetch fails, that fetches
+# saving at the same time don't wait on each other,
+# that the loaded StoredRows read like a list of rows and that
+# the GSheetLister points each url to its newest
+# saved source.
+# ---------------------------------------------------
+
+import threading
+import time
+from contextlib import closing
+from unittest.mock import patch
+import pytest
+from benchmarks.fakesheets import FakeSheetsServer
+from controls.gsheetlister import GSheetLister
+from modules.datastore import DataStore
+from modules.reader import Reader
+from modules.rowsink import StoreRowSink
+from tests.conftest import SPREADSHEET_ID, fetch, make_reader
+
+# Rows of each block on the tests, so a worksheet has many blocks
+BLOCK_ROWS = 16
+
+
+def _blocks(store):
+    """
+    Helper function to get the rowid and data of every saved block by
+    source id, worksheet, block number and field. A block written again
+    gets a new rowid even if its data is the same.
+    """
+    with closing(store.open_connection()) as connection:
+        return {row[:4]: row[4:] for row in connection.execute(
+            "SELECT source_id, sheet, block, field, rowid, data "
+            "FROM blocks")}
+
+
+def _save_fetch(server, previous=None):
+    """
+    Helper function to fetch the fake spreadsheet into the data store
+    and return the loaded source.
+    """
+    store = Reader.data_store()
+    result, fetched = fetch(make_reader(server), batched=True,
+                            previous=previous, sink=StoreRowSink(store))
+    assert result is True
+    return store.load(fetched["filename"])
+
+
+def test_refresh_writes_only_tail_blocks(project):
+    workbook = FakeSheetsServer.make_workbook(sheets=3, rows=100)
+    store = Reader.data_store()
+    with FakeSheetsServer(workbooks={SPREADSHEET_ID: workbook}) as server, \
+            patch.object(DataStore, "BLOCK_ROWS", BLOCK_ROWS):
+        previous = _save_fetch(server)
+        before = _blocks(store)
+
+        server.touch(SPREADSHEET_ID, rows=5)
+        refreshed = _save_fetch(server, previous=previous)
+        after = _blocks(store)
+
+        Reader.invalidate_metadata(server.url(SPREADSHEET_ID))
+        result, full = fetch(make_reader(server), batched=True)
+
+    assert refreshed["final_data"].to_list() == full["final_data"].to_list()
+    assert len(refreshed["final_data"]) > len(previous["final_data"])
+    # The first blocks of each worksheet are kept on their rows and only
+    # the tail blocks from the first refetched row are written again
+    sheets = previous["final_data"].sheets
+    kept = {key[1:3] for key, block in after.items()
+            if before.get(key) == block}
+    written = {key[1:3] for key in after} - kept
+    for sheet in sheets:
+        assert (sheet, 0) in kept
+        assert 0 < len([key for key in written if key[0] == sheet]) <= 3
+
+
+def test_refresh_with_new_name_keeps_base(project):
+    workbook = FakeSheetsServer.make_workbook(sheets=2, rows=60)
+    store = Reader.data_store()
+    with FakeSheetsServer(workbooks={SPREADSHEET_ID: workbook}) as server, \
+            patch.object(DataStore, "BLOCK_ROWS", BLOCK_ROWS):
+        base = _save_fetch(server)
+    rows = base["final_data"].to_list()
+    counts = base["final_data"].sheets
+
+    writer, new_rows = store.writer(base["name"]), []
+    for sheet, sheet_rows in counts.items():
+        kept = sheet_rows - 10
+        writer.start_sheet(kept)
+        start = sum(list(counts.values())[:sheet])
+        new_rows.extend(rows[start:start + kept])
+        for row in rows[start + kept:start + sheet_rows]:
+            writer.write(row)
+            new_rows.append(row)
+    writer.commit("other.json", base)
+
+    assert store.load(base["name"])["final_data"].to_list() == rows
+    other = store.load("other.json")
+    assert other["final_data"].to_list() == new_rows
+    assert other["final_data"].sheets == counts
+    assert other["watermarks"] == base["watermarks"]
+
+
+def test_failed_refresh_keeps_previous_rows(project):
+    workbook = FakeSheetsServer.make_workbook(sheets=2, rows=60)
+    store = Reader.data_store()
+    with FakeSheetsServer(workbooks={SPREADSHEET_ID: workbook}) as server, \
+            patch.object(DataStore, "BLOCK_ROWS", BLOCK_ROWS):
+        base = _save_fetch(server)
+    rows = base["final_data"].to_list()
+    before = _blocks(store)
+
+    sink = StoreRowSink(store)
+    sink.start_sheet(20, base["name"])
+    for row in rows[:40]:
+        sink.write(row)
+    sink.discard()
+
+    assert _blocks(store) == before
+    assert [source["name"] for source in store.sources()] == [base["name"]]
+    assert store.load(base["name"])["final_data"].to_list() == rows
+
+
+def test_refresh_of_changed_base_is_not_saved(project):
+    workbook = FakeSheetsServer.make_workbook(sheets=2, rows=60)
+    store = Reader.data_store()
+    with FakeSheetsServer(workbooks={SPREADSHEET_ID: workbook}) as server, \
+            patch.object(DataStore, "BLOCK_ROWS", BLOCK_ROWS):
+        base = _save_fetch(server)
+        rows = base["final_data"].to_list()
+        writer = store.writer(base["name"])
+        writer.start_sheet(20)
+        for row in rows[20:40]:
+            writer.write(row)
+
+        # Another fetch saves the base while the rows are written
+        server.touch(SPREADSHEET_ID, rows=5)
+        changed = _save_fetch(server, previous=base)
+        with pytest.raises(ValueError):
+            writer.commit(base["name"], base)
+
+    assert store.load(base["name"])["final_data"].to_list() == \
+        changed["final_data"].to_list()
+    with closing(store.open_connection()) as connection:
+        assert connection.execute(
+            "SELECT COUNT(*) FROM staged_blocks").fetchone() == (0,)
+
+
+def test_concurrent_fetches_save_their_rows(project):
+    ids = [f"{SPREADSHEET_ID}{index}" for index in range(2)]
+    workbooks = {spreadsheet_id: FakeSheetsServer.make_workbook(
+        sheets=8, rows=40, department=f"Department {index}", seed=index)
+        for index, spreadsheet_id in enumerate(ids)}
+    store, results = Reader.data_store(), {}
+    store.save("other.json", {"url": "https://example.com/other"}, [])
+
+    def fetch_saved(spreadsheet_id):
+        try:
+            results[spreadsheet_id] = fetch(
+                make_reader(server, spreadsheet_id),
+                sink=StoreRowSink(store))
+        except Exception as e:
+            results[spreadsheet_id] = e, None
+
+    # The write lock is only held to save each block, so neither the
+    # other fetch nor a delete waits for the requests of a fetch
+    with FakeSheetsServer(workbooks=workbooks, latency=0.3) as server, \
+            patch.object(DataStore, "BLOCK_ROWS", BLOCK_ROWS), \
+            patch.object(DataStore, "TIMEOUT", 2):
+        threads = [threading.Thread(target=fetch_saved, args=(key,))
+                   for key in ids]
+        for thread in threads:
+            thread.start()
+        time.sleep(1.5)
+        start = time.perf_counter()
+        store.delete("other.json")
+        deleted = time.perf_counter() - start
+        for thread in threads:
+            thread.join()
+
+    assert deleted < 1
+    for spreadsheet_id in ids:
+        result, fetched = results[spreadsheet_id]
+        assert result is True
+        saved = store.load(fetched["filename"])
+        assert len(saved["final_data"]) == \
+            sum(mark["count"] for mark
+                in saved["watermarks"]["sheets"].values()) > 0
+    assert len(store.sources()) == len(ids)
+
+
+def test_stored_rows_read_like_a_list(project):
+    workbook = FakeSheetsServer.make_workbook(sheets=3, rows=40)
+    with FakeSheetsServer(workbooks={SPREADSHEET_ID: workbook}) as server, \
+            patch.object(DataStore, "BLOCK_ROWS", BLOCK_ROWS):
+        stored = _save_fetch(server)["final_data"]
+    rows = stored.to_list()
+
+    assert len(stored) == len(rows) == sum(stored.sheets.values())
+    assert stored[0] == rows[0] and stored[-1] == rows[-1]
+    assert stored[BLOCK_ROWS] == rows[BLOCK_ROWS]
+    for start, stop in ((0, 5), (10, 50), (BLOCK_ROWS, 3 * BLOCK_ROWS),
+                        (-7, None), (30, 20)):
+        assert list(stored[start:stop]) == rows[start:stop]
+        assert list(stored[start:stop][1:4]) == rows[start:stop][1:4]
+    assert stored[::3] == rows[::3]
+
+
+def test_urls_point_to_newest_source(project):
+    store, url = Reader.data_store(), "https://example.com/sheet"
+    for name, month_num in (("b.json", "02-2024"), ("a.json", "01-2024"),
+                            ("c.json", "02-2024"), ("d.json", "12-2023")):
+        month = f"{month_num[:2]} {month_num[3:]}"
+        store.save(name, {"url": url, "month": month,
+                          "month_num": month_num}, [])
+
+    assert [source["name"] for source in store.sources(newest=True)] == \
+        ["c.json", "b.json", "a.json", "d.json"]
+    with patch.dict(GSheetLister.URLS_DB, clear=True):
+        lister = GSheetLister()
+        lister._month_dropdown.current.value = "01"
+        lister._year_dropdown.current.value = "2024"
+        lister._load_gsheeturl_data(initial_load=True)
+        assert GSheetLister.URLS_DB[url]["filename"] == "c.json"
@@ -0,0 +1,66 @@
+# ---------------------------------------------------
+# test_ratelimiter.py - RateLimiter Tests
+# ---------------------------------------------------
+# Tests that the requests of a fetch answered with a
+# 429 quota error by the FakeSheetsServer are retried
+# by the shared RateLimiter after its backoff or the
+# Retry-After header of the response, and that a call
+# gives up after its maximum number of retries.
+# ---------------------------------------------------
+
+from unittest.mock import patch
+import gspread
+import pytest
+from benchmarks.fakesheets import FakeSheetsServer
+from modules.ratelimiter import RateLimiter
+from tests.conftest import SPREADSHEET_ID, fetch, make_reader
+
+
+def _counters(server):
+    """
+    Helper function to get the retries and wait time of the shared
+    limiter and the throttled responses of the server.
+    """
+    stats = RateLimiter.get_shared().stats()
+    return stats["retries"], stats["wait_time"], \
+        server.stats()["throttled"]
+
+
+def test_throttled_requests_are_retried(project):
+    workbook = FakeSheetsServer.make_workbook(sheets=4, rows=30)
+    with FakeSheetsServer(workbooks={SPREADSHEET_ID: workbook}) as server:
+        result, expected = fetch(make_reader(server))
+    with FakeSheetsServer(workbooks={SPREADSHEET_ID: workbook}, quota=3,
+                          period=0.5, retry_after=0.2) as server, \
+            patch.object(RateLimiter, "BASE_BACKOFF", 0.01):
+        before = _counters(server)
+        result, fetched = fetch(make_reader(server))
+        retries, wait_time, throttled = (
+            after - start for after, start in zip(_counters(server), before))
+
+    # Every 429 response is retried after at least its Retry-After
+    assert result is True
+    assert throttled > 0
+    assert retries == throttled
+    assert wait_time >= 0.2 * throttled - 0.01
+    assert fetched["final_data"].to_list() == \
+        expected["final_data"].to_list()
+
+
+def test_retries_stop_at_maximum(project):
+    workbook = FakeSheetsServer.make_workbook(sheets=2, rows=30)
+    with FakeSheetsServer(workbooks={SPREADSHEET_ID: workbook}, quota=1,
+                          period=60) as server, \
+            patch.object(RateLimiter, "BASE_BACKOFF", 0.01):
+        before = _counters(server)
+        with pytest.raises(gspread.exceptions.APIError) as error:
+            fetch(make_reader(server), batched=True)
+        retries, wait_time, throttled = (
+            after - start for after, start in zip(_counters(server), before))
+
+    # The first request gets the only quota, the next one is retried
+    # until the maximum retries of the limiter and then fails
+    max_retries = RateLimiter.get_shared().max_retries
+    assert error.value.code == 429
+    assert retries == max_retries
+    assert throttled == max_retries + 1
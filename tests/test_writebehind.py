@@ -0,0 +1,101 @@
+# ---------------------------------------------------
+# test_writebehind.py - WriteBehind Tests
+# ---------------------------------------------------
+# Tests that the WriteBehind merges the writes of a
+# file that are still waiting into the last one, that
+# each file is replaced by a completely written
+# temporary file and that flush waits for the queued
+# writes.
+# ---------------------------------------------------
+
+import os
+import threading
+from unittest.mock import patch
+from modules.writebehind import WriteBehind
+
+
+def _blocked_writer():
+    """
+    Helper function to make a WriteBehind whose writes wait for the
+    release event once started. Returns the writer, the release and
+    started events, the list of the written names and texts and the
+    started patcher of the writes.
+    """
+    writer, release, written = WriteBehind(), threading.Event(), []
+    started = threading.Event()
+    replace = WriteBehind._replace
+
+    def blocked_replace(path, text):
+        written.append((path.name, text))
+        started.set()
+        release.wait(5)
+        replace(path, text)
+
+    patcher = patch.object(WriteBehind, "_replace",
+                           staticmethod(blocked_replace))
+    patcher.start()
+    return writer, release, started, written, patcher
+
+
+def test_waiting_writes_are_merged(tmp_path):
+    writer, release, started, written, patcher = _blocked_writer()
+    try:
+        writer.write(tmp_path / "recents.json", "1")
+        assert started.wait(5)
+        # The writes made while the first one is written are merged
+        for text in ("2", "3", "4"):
+            writer.write(tmp_path / "recents.json", text)
+        writer.write(tmp_path / "other.json", "a")
+        release.set()
+        assert writer.flush(5)
+    finally:
+        patcher.stop()
+        writer.close()
+
+    assert sorted(written) == [("other.json", "a"), ("recents.json", "1"),
+                               ("recents.json", "4")]
+    assert (tmp_path / "recents.json").read_text() == "4"
+    assert (tmp_path / "other.json").read_text() == "a"
+
+
+def test_file_is_replaced_by_temporary_file(tmp_path):
+    path = tmp_path / "data/recents.json"
+    writer, replaced = WriteBehind(), []
+
+    def record_replace(source, target):
+        replaced.append((source, target))
+        assert open(source).read() == "[1, 2]"
+        os_replace(source, target)
+
+    os_replace = os.replace
+    with patch("modules.writebehind.os.replace", record_replace):
+        writer.write(path, "[1, 2]")
+        assert writer.flush(5)
+    assert replaced == [(path.with_name("recents.json.tmp"), path)]
+    assert path.read_text() == "[1, 2]"
+    assert not path.with_name("recents.json.tmp").exists()
+
+    # A write that fails keeps the file as it was and its error
+    with patch("modules.writebehind.os.fsync",
+               side_effect=OSError("disk full")):
+        writer.write(path, "[3]")
+        assert writer.flush(5)
+    writer.close()
+    assert path.read_text() == "[1, 2]"
+    assert str(writer.error) == "disk full"
+
+
+def test_flush_waits_for_queued_writes(tmp_path):
+    writer, release, started, written, patcher = _blocked_writer()
+    try:
+        writer.write(tmp_path / "recents.json", "1")
+        assert started.wait(5)
+        writer.write(tmp_path / "recents.json", "2")
+        assert writer.flush(0.1) is False
+        release.set()
+        assert writer.flush(5) is True
+        assert (tmp_path / "recents.json").read_text() == "2"
+    finally:
+        patcher.stop()
+        writer.close()
+    assert writer.flush(0) is True